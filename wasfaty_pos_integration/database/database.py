@@ -2,32 +2,125 @@
 Database connection and session management
 """
 
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker, Session
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.pool import QueuePool
 from contextlib import contextmanager
-from typing import Generator
+from typing import Any, Callable, Dict, Generator, Optional, TypeVar
 
-from config import get_database_url
+from config import (
+    get_database_url, get_read_database_url, get_db_pool_config, get_db_executor_config,
+    get_sync_log_config
+)
 from .models import Base
+from .partitions import SYNC_LOG_TABLE, ensure_monthly_partitions
 
 
-# Create database engine
-engine = create_engine(
-    get_database_url(),
-    poolclass=StaticPool,
-    pool_pre_ping=True,  # Verify connections before use
-    pool_recycle=3600,   # Recycle connections every hour
-    echo=False  # Set to True for SQL query logging in development
-)
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Checkouts slower than this are logged as pool exhaustion warnings
+SLOW_CHECKOUT_SECONDS = 0.5
+
+
+class PoolMetrics:
+    """Connection checkout counters for one engine's pool"""
+    
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.slow_checkouts = 0
+    
+    def record_checkout(self, wait_seconds: float):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait_seconds += wait_seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+            if wait_seconds >= SLOW_CHECKOUT_SECONDS:
+                self.slow_checkouts += 1
+        
+        if wait_seconds >= SLOW_CHECKOUT_SECONDS:
+            logger.warning(f"Waited {wait_seconds:.2f}s for a {self.name} database connection")
+    
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "avg_wait_ms": round(self.total_wait_seconds / self.checkouts * 1000, 2) if self.checkouts else 0.0,
+                "max_wait_ms": round(self.max_wait_seconds * 1000, 2),
+                "slow_checkouts": self.slow_checkouts
+            }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics("database")
+    
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.metrics.record_checkout(time.perf_counter() - start)
+    
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+def _create_pooled_engine(url: str, name: str) -> Engine:
+    """Create an engine with a sized, instrumented connection pool"""
+    pool_config = get_db_pool_config()
+    pooled_engine = create_engine(
+        url,
+        poolclass=InstrumentedQueuePool,
+        pool_size=pool_config["pool_size"],
+        max_overflow=pool_config["max_overflow"],
+        pool_timeout=pool_config["pool_timeout"],
+        pool_recycle=pool_config["pool_recycle"],
+        pool_pre_ping=True,  # Verify connections before use
+        pool_use_lifo=True,  # Let idle connections above pool_size expire
+        echo=False  # Set to True for SQL query logging in development
+    )
+    pooled_engine.pool.metrics = PoolMetrics(name)
+    return pooled_engine
+
+
+# Create database engines; without a replica both names share the primary
+engine = _create_pooled_engine(get_database_url(), "primary")
+
+if get_read_database_url() != get_database_url():
+    read_engine = _create_pooled_engine(get_read_database_url(), "replica")
+else:
+    read_engine = engine
 
-# Create session factory
+# Create session factories
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
 
 
 def create_tables():
-    """Create all database tables"""
+    """Create all database tables and the initial sync log partitions"""
     Base.metadata.create_all(bind=engine)
+    
+    with engine.begin() as conn:
+        ensure_monthly_partitions(
+            conn, SYNC_LOG_TABLE, get_sync_log_config()["partition_months_ahead"]
+        )
 
 
 def get_db() -> Generator[Session, None, None]:
@@ -59,6 +152,89 @@ def get_db_session() -> Generator[Session, None, None]:
         db.close()
 
 
+@contextmanager
+def get_read_db_session() -> Generator[Session, None, None]:
+    """
+    Context manager for read-only sessions on the read replica
+    Results may lag the primary slightly; never write through this session
+    """
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.rollback()
+        db.close()
+
+
+# Bounded thread pool for blocking database work called from async code
+_db_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_db_executor() -> ThreadPoolExecutor:
+    """Get the shared database thread pool, creating it on first use"""
+    global _db_executor
+    if _db_executor is None:
+        _db_executor = ThreadPoolExecutor(
+            max_workers=get_db_executor_config()["max_workers"],
+            thread_name_prefix="db"
+        )
+    return _db_executor
+
+
+async def run_in_db_session(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Run func(db, *args, **kwargs) inside get_db_session() on the DB thread pool
+    Use this from async code so queries never block the event loop.
+    ORM objects must not escape func; return plain values instead.
+    """
+    def call() -> T:
+        with get_db_session() as db:
+            return func(db, *args, **kwargs)
+    
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_db_executor(), call)
+
+
+async def run_in_read_session(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Run func(db, *args, **kwargs) inside get_read_db_session() on the DB thread pool
+    Use this for reports and status lookups that tolerate replica lag.
+    """
+    def call() -> T:
+        with get_read_db_session() as db:
+            return func(db, *args, **kwargs)
+    
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_db_executor(), call)
+
+
+def get_pool_status() -> Dict[str, Any]:
+    """Connection pool usage and checkout wait statistics per engine"""
+    engines = {"primary": engine}
+    if read_engine is not engine:
+        engines["replica"] = read_engine
+    
+    status = {}
+    for name, pooled_engine in engines.items():
+        pool = pooled_engine.pool
+        status[name] = {
+            "pool_size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "idle": pool.checkedin(),
+            **pool.metrics.snapshot()
+        }
+    return status
+
+
+def shutdown_db_executor():
+    """Stop the database thread pool (call once at process shutdown)"""
+    global _db_executor
+    if _db_executor is not None:
+        _db_executor.shutdown(wait=True)
+        _db_executor = None
+
+
 class DatabaseManager:
     """Database management utilities"""
     
@@ -72,7 +248,7 @@ class DatabaseManager:
     def reset_database():
         """Drop and recreate all tables (USE WITH CAUTION)"""
         Base.metadata.drop_all(bind=engine)
-        Base.metadata.create_all(bind=engine)
+        create_tables()
         print("Database reset completed")
     
     @staticmethod
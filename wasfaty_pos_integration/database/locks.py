@@ -0,0 +1,28 @@
+"""
+PostgreSQL advisory locks for work that must not run concurrently
+
+Locks are transaction-scoped: they are released at commit or rollback, so
+a crashed process never leaves one behind.
+"""
+
+import hashlib
+from sqlalchemy import func, select
+
+
+def advisory_lock_key(name: str) -> int:
+    """Signed 64-bit lock key for a name, identical in every process"""
+    return int.from_bytes(hashlib.blake2b(name.encode(), digest_size=8).digest(), "big", signed=True)
+
+
+def try_advisory_xact_lock(db, name: str) -> bool:
+    """
+    Take a named lock until the end of the current transaction
+    
+    Args:
+        db: Session or Connection
+        name: Lock name
+        
+    Returns:
+        False, without waiting, if another transaction holds the lock
+    """
+    return bool(db.execute(select(func.pg_try_advisory_xact_lock(advisory_lock_key(name)))).scalar())
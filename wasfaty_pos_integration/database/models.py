@@ -10,7 +10,7 @@ from enum import Enum
 from typing import Optional
 from sqlalchemy import (
     Column, Integer, String, DateTime, Boolean, Text, 
-    Numeric, ForeignKey, Index, UniqueConstraint
+    Numeric, ForeignKey, Index, UniqueConstraint, Sequence, text
 )
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
@@ -45,6 +45,14 @@ class SyncStatus(str, Enum):
     FAILED = "failed"
 
 
+class OutboxStatus(str, Enum):
+    """Outbox sync job status enumeration"""
+    PENDING = "pending"
+    IN_PROGRESS = "in_progress"
+    COMPLETED = "completed"
+    DEAD_LETTER = "dead_letter"
+
+
 class Pharmacy(Base):
     """
     Pharmacy model - supports multiple pharmacy locations
@@ -98,7 +106,9 @@ class Drug(Base):
     # Relationships
     inventory_items = relationship("InventoryItem", back_populates="drug")
     transaction_items = relationship("TransactionItem", back_populates="drug")
-    prescription_items = relationship("PrescriptionItem", back_populates="drug")
+    prescription_items = relationship(
+        "PrescriptionItem", back_populates="drug", foreign_keys="PrescriptionItem.drug_id"
+    )
     
     # Indexes for performance
     __table_args__ = (
@@ -140,6 +150,11 @@ class InventoryItem(Base):
         UniqueConstraint('pharmacy_id', 'drug_id', 'batch_number', name='unique_pharmacy_drug_batch'),
         Index('idx_inventory_pharmacy_drug', 'pharmacy_id', 'drug_id'),
         Index('idx_inventory_sync_status', 'sync_status'),
+        Index(
+            'idx_inventory_pharmacy_expiry', 'pharmacy_id', 'expiry_date',
+            postgresql_where=text('expiry_date IS NOT NULL')
+        ),
+        Index('idx_inventory_updated', 'updated_at'),
     )
 
 
@@ -181,6 +196,11 @@ class Prescription(Base):
         Index('idx_prescription_wasfaty_id', 'wasfaty_prescription_id'),
         Index('idx_prescription_patient', 'patient_id'),
         Index('idx_prescription_status', 'status'),
+        Index('idx_prescription_pharmacy_expiry', 'pharmacy_id', 'expiry_date'),
+        Index(
+            'idx_prescription_active_expiry', 'expiry_date',
+            postgresql_where=text("status = 'active'")
+        ),
     )
 
 
@@ -205,10 +225,21 @@ class PrescriptionItem(Base):
     
     # Relationships
     prescription = relationship("Prescription", back_populates="prescription_items")
-    drug = relationship("Drug", back_populates="prescription_items")
+    drug = relationship("Drug", back_populates="prescription_items", foreign_keys=[drug_id])
     substituted_drug = relationship("Drug", foreign_keys=[substituted_drug_id])
 
 
+# Values handed out per nextval(); processes allocate numbers within a block locally
+TRANSACTION_NUMBER_BLOCK_SIZE = 100
+
+transaction_number_seq = Sequence(
+    "transaction_number_seq",
+    increment=TRANSACTION_NUMBER_BLOCK_SIZE,
+    start=1,
+    metadata=Base.metadata
+)
+
+
 class Transaction(Base):
     """
     Transaction records for all sales (POS and Wasfaty)
@@ -275,12 +306,18 @@ class TransactionItem(Base):
     # Relationships
     transaction = relationship("Transaction", back_populates="transaction_items")
     drug = relationship("Drug", back_populates="transaction_items")
+    
+    # Indexes
+    __table_args__ = (
+        Index('idx_transaction_item_transaction_drug', 'transaction_id', 'drug_id'),
+    )
 
 
 class SyncLog(Base):
     """
     Synchronization logs between POS and Wasfaty systems
     Provides detailed audit trail for all sync operations
+    Range-partitioned by month on created_at (see database.partitions)
     """
     __tablename__ = "sync_logs"
     
@@ -296,7 +333,7 @@ class SyncLog(Base):
     error_message = Column(Text)
     processing_time_ms = Column(Integer)  # Processing time in milliseconds
     retry_count = Column(Integer, default=0)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, primary_key=True, default=datetime.utcnow)  # Partition key
     completed_at = Column(DateTime)
     
     # Relationships
@@ -308,9 +345,146 @@ class SyncLog(Base):
         Index('idx_sync_log_type', 'sync_type'),
         Index('idx_sync_log_status', 'status'),
         Index('idx_sync_log_created', 'created_at'),
+        {'postgresql_partition_by': 'RANGE (created_at)'},
+    )
+
+
+class SyncLogHourlySummary(Base):
+    """
+    Hourly sync counts rolled up from sync_logs
+    Lets status reports skip scanning raw log rows for completed hours
+    """
+    __tablename__ = "sync_log_hourly_summaries"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    hour = Column(DateTime, nullable=False)  # Start of the hour (UTC)
+    pharmacy_id = Column(UUID(as_uuid=True), ForeignKey("pharmacies.id"))
+    sync_type = Column(String(50), nullable=False)
+    status = Column(String(20), nullable=False)
+    sync_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    # Indexes
+    __table_args__ = (
+        # One row per group and hour; rollups upsert into it (PostgreSQL 15+ for NULLS NOT DISTINCT)
+        UniqueConstraint(
+            'hour', 'pharmacy_id', 'sync_type', 'status',
+            name='unique_sync_summary_group',
+            postgresql_nulls_not_distinct=True
+        ),
+        Index('idx_sync_summary_hour', 'hour'),
+        Index('idx_sync_summary_pharmacy_hour', 'pharmacy_id', 'hour'),
+    )
+
+
+class SyncJob(Base):
+    """
+    Transactional outbox for POS and Wasfaty sync work
+    Jobs are written in the same DB transaction as the sale that produced
+    them and consumed by the outbox worker process
+    """
+    __tablename__ = "sync_jobs"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    pharmacy_id = Column(UUID(as_uuid=True), ForeignKey("pharmacies.id"))
+    shard = Column(Integer, nullable=False, default=0)  # Logical shard of pharmacy_id
+    job_type = Column(String(50), nullable=False)  # 'pos_sale_sync', 'wasfaty_dispense_sync'
+    entity_id = Column(String(100), nullable=False)  # ID of the entity to sync
+    idempotency_key = Column(String(255), unique=True, nullable=False)  # Sent to Wasfaty as Idempotency-Key
+    payload = Column(JSONB)  # Data needed to replay the sync
+    status = Column(String(20), default=OutboxStatus.PENDING)
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, nullable=False)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow)
+    locked_at = Column(DateTime)  # When a worker claimed the job
+    locked_by = Column(String(100))  # Worker identifier
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    completed_at = Column(DateTime)
+    
+    # Relationships
+    pharmacy = relationship("Pharmacy")
+    
+    # Indexes
+    __table_args__ = (
+        Index('idx_sync_job_due', 'status', 'next_attempt_at'),
+        Index('idx_sync_job_entity', 'job_type', 'entity_id'),
+        Index('idx_sync_job_shard_due', 'shard', 'status', 'next_attempt_at'),
+    )
+
+
+class SyncWorker(Base):
+    """
+    Live outbox worker processes
+    Workers heartbeat here; the live set decides which shards each one owns
+    """
+    __tablename__ = "sync_workers"
+    
+    worker_id = Column(String(100), primary_key=True)
+    started_at = Column(DateTime, default=datetime.utcnow)
+    heartbeat_at = Column(DateTime, nullable=False)
+    owned_shards = Column(Integer, default=0)  # Shards owned at the last heartbeat
+
+
+class IngestionRecord(Base):
+    """
+    Inbound POS sales and Wasfaty prescriptions already processed
+    The unique (source, external_id) constraint lets replays of the same
+    upstream event return the stored result instead of running again
+    """
+    __tablename__ = "ingestion_records"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    source = Column(String(50), nullable=False)  # 'pos_sale', 'wasfaty_prescription'
+    external_id = Column(String(255), nullable=False)  # Upstream ID, scoped by pharmacy for POS
+    pharmacy_id = Column(UUID(as_uuid=True), ForeignKey("pharmacies.id"))
+    result = Column(JSONB)  # Response returned to the first caller
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    pharmacy = relationship("Pharmacy")
+    
+    # Indexes
+    __table_args__ = (
+        UniqueConstraint('source', 'external_id', name='unique_ingestion_source_external_id'),
+        Index('idx_ingestion_created', 'created_at'),
     )
 
 
+class NearExpiryStock(Base):
+    """
+    Inventory batches with stock left that expire within the near-expiry window
+    Maintained incrementally by the expiry sweeper, one row per inventory item
+    """
+    __tablename__ = "near_expiry_stock"
+    
+    inventory_item_id = Column(UUID(as_uuid=True), ForeignKey("inventory_items.id", ondelete="CASCADE"), primary_key=True)
+    pharmacy_id = Column(UUID(as_uuid=True), ForeignKey("pharmacies.id"), nullable=False)
+    drug_id = Column(UUID(as_uuid=True), ForeignKey("drugs.id"), nullable=False)
+    batch_number = Column(String(100))
+    expiry_date = Column(DateTime, nullable=False)
+    available_stock = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Indexes
+    __table_args__ = (
+        Index('idx_near_expiry_pharmacy_expiry', 'pharmacy_id', 'expiry_date'),
+    )
+
+
+class SweepCheckpoint(Base):
+    """
+    Last completed run of an incremental background sweep
+    Lets the next run process only rows changed since then
+    """
+    __tablename__ = "sweep_checkpoints"
+    
+    name = Column(String(100), primary_key=True)
+    checkpoint_at = Column(DateTime, nullable=False)  # Start time of the last completed run
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
 class ApiKey(Base):
     """
     API key management for secure authentication
@@ -321,6 +495,7 @@ class ApiKey(Base):
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     pharmacy_id = Column(UUID(as_uuid=True), ForeignKey("pharmacies.id"), nullable=False)
     key_name = Column(String(100), nullable=False)
+    key_prefix = Column(String(32), unique=True)  # Public part of the key, used for lookup
     key_hash = Column(String(255), nullable=False)  # Hashed API key
     permissions = Column(JSONB)  # JSON array of permissions
     is_active = Column(Boolean, default=True)
@@ -0,0 +1,161 @@
+"""
+Partition management for time-partitioned tables
+
+sync_logs is range-partitioned by month on created_at. This module creates
+partitions ahead of time and applies the retention policy by dropping (or
+detaching, for archiving) partitions that are entirely past the retention
+window. Dropping a partition is a metadata operation, so retention does not
+churn the table or its indexes the way bulk DELETEs would.
+"""
+
+import logging
+import re
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Any
+from sqlalchemy import text
+
+from config import get_sync_log_config
+from .locks import try_advisory_xact_lock
+
+
+logger = logging.getLogger(__name__)
+
+
+SYNC_LOG_TABLE = "sync_logs"
+
+# Advisory lock serializing partition maintenance across workers
+PARTITION_MAINTENANCE_LOCK = "sync_log_partition_maintenance"
+
+# Partition names look like sync_logs_y2024m03
+PARTITION_NAME_PATTERN = re.compile(r"^(?P<table>\w+)_y(?P<year>\d{4})m(?P<month>\d{2})$")
+
+
+def month_start(value: datetime) -> datetime:
+    """First instant of the month containing value"""
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(value: datetime, months: int) -> datetime:
+    """Shift a month start by a number of months"""
+    month_index = value.year * 12 + value.month - 1 + months
+    return value.replace(year=month_index // 12, month=month_index % 12 + 1)
+
+
+def partition_name(table: str, month: datetime) -> str:
+    return f"{table}_y{month.year:04d}m{month.month:02d}"
+
+
+def list_partitions(db, table: str) -> List[Dict[str, Any]]:
+    """
+    List the monthly partitions attached to a table
+    
+    Args:
+        db: Session or Connection
+        table: Partitioned parent table name
+        
+    Returns:
+        List of dicts with name, start and end of each partition
+    """
+    rows = db.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.relname = :table"
+    ), {"table": table}).all()
+    
+    partitions = []
+    for (name,) in rows:
+        match = PARTITION_NAME_PATTERN.match(name)
+        if not match or match.group("table") != table:
+            continue
+        start = datetime(int(match.group("year")), int(match.group("month")), 1)
+        partitions.append({"name": name, "start": start, "end": add_months(start, 1)})
+    
+    return sorted(partitions, key=lambda partition: partition["start"])
+
+
+def ensure_monthly_partitions(
+    db,
+    table: str,
+    months_ahead: int,
+    since: Optional[datetime] = None
+) -> List[str]:
+    """
+    Create missing monthly partitions from since (default: this month)
+    through months_ahead months in the future
+    
+    Returns:
+        Names of the partitions created
+    """
+    current = month_start(since or datetime.utcnow())
+    last = add_months(month_start(datetime.utcnow()), months_ahead)
+    existing = {partition["name"] for partition in list_partitions(db, table)}
+    
+    created = []
+    while current <= last:
+        name = partition_name(table, current)
+        if name not in existing:
+            db.execute(text(
+                f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{table}" '
+                f"FOR VALUES FROM ('{current.isoformat()}') TO ('{add_months(current, 1).isoformat()}')"
+            ))
+            created.append(name)
+        current = add_months(current, 1)
+    
+    if created:
+        logger.info(f"Created partitions {', '.join(created)}")
+    return created
+
+
+def expire_partitions(
+    db,
+    table: str,
+    retention_days: int,
+    archive: bool = False
+) -> List[str]:
+    """
+    Drop, or detach when archiving, partitions whose whole range is older
+    than the retention window
+    
+    Detached partitions remain as standalone tables for export to cold storage.
+    
+    Returns:
+        Names of the partitions removed from the table
+    """
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    
+    expired = []
+    for partition in list_partitions(db, table):
+        if partition["end"] > cutoff:
+            continue
+        
+        if archive:
+            db.execute(text(f'ALTER TABLE "{table}" DETACH PARTITION "{partition["name"]}"'))
+        else:
+            db.execute(text(f'DROP TABLE "{partition["name"]}"'))
+        expired.append(partition["name"])
+    
+    if expired:
+        action = "Detached" if archive else "Dropped"
+        logger.info(f"{action} expired partitions {', '.join(expired)}")
+    return expired
+
+
+def maintain_sync_log_partitions(db) -> Dict[str, List[str]]:
+    """
+    Create upcoming sync_logs partitions and apply the retention policy
+    
+    Does nothing while another transaction is maintaining partitions.
+    """
+    config = get_sync_log_config()
+    
+    if not try_advisory_xact_lock(db, PARTITION_MAINTENANCE_LOCK):
+        logger.debug("Sync log partition maintenance already running elsewhere")
+        return {"created": [], "expired": []}
+    
+    return {
+        "created": ensure_monthly_partitions(db, SYNC_LOG_TABLE, config["partition_months_ahead"]),
+        "expired": expire_partitions(
+            db, SYNC_LOG_TABLE, config["retention_days"], archive=config["archive_expired"]
+        )
+    }
@@ -0,0 +1,373 @@
+"""
+Wasfaty POS Integration API
+
+This module is the ASGI application. Run it with:
+
+    python main.py
+
+which starts uvicorn with the worker count, backlog and keep-alive from
+config. Each worker process owns one Wasfaty HTTP connection pool, one
+database pool and one DB thread pool; they are opened and closed by the
+application lifespan, never per request.
+
+POS endpoints authenticate with the X-API-Key header and act for the
+key's pharmacy. Wasfaty webhooks are authenticated with an HMAC-SHA256
+signature of the raw body in the X-Wasfaty-Signature header.
+
+The streaming endpoint takes newline-delimited JSON sales and starts
+processing each one as soon as its line arrives, a bounded number at a
+time, so the upload is never buffered waiting to be parsed. Results are
+held until the whole body is read and then streamed back as NDJSON in
+completion order, each tagged with the index of its input line, so a
+stream is capped at api_stream_max_lines lines.
+
+Errors the caller can fix (malformed sales or prescriptions) answer 4xx
+and must not be retried as sent; everything else answers 503 so POS
+tills and Wasfaty retry. Stream results carry the same distinction in
+their "retryable" flag.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Any
+import uvicorn
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+
+from config import settings, get_api_config
+from database.database import get_pool_status, shutdown_db_executor
+from services.api_key_auth import ApiKeyAuthError, ApiKeyPermissionError, api_key_authenticator
+from services.expiry_service import ExpiryService, ExpiryServiceError
+from services.ingestion_guard import ingestion_guard
+from services.pos_service import POSService, POSIntegrationError, POSValidationError
+from services.reorder_service import ReorderService, ReorderServiceError
+from services.sync_audit import sync_log_writer
+from services.sync_service import SyncService, SyncServiceError, PrescriptionValidationError
+from services.wasfaty_batcher import wasfaty_batcher
+from services.wasfaty_client import wasfaty_client
+
+
+logger = logging.getLogger(__name__)
+
+
+api_config = get_api_config()
+
+pos_service = POSService()
+sync_service = SyncService()
+reorder_service = ReorderService()
+expiry_service = ExpiryService()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open shared clients at worker startup and drain them at shutdown"""
+    
+    await wasfaty_client.start()
+    logger.info("Wasfaty POS Integration API started")
+    try:
+        yield
+    finally:
+        await wasfaty_batcher.flush()
+        await wasfaty_client.close()
+        await sync_log_writer.flush()
+        await api_key_authenticator.flush()
+        await ingestion_guard.close()
+        shutdown_db_executor()
+        logger.info("Wasfaty POS Integration API stopped")
+
+
+app = FastAPI(
+    title="Wasfaty POS Integration",
+    description="Integration gateway between pharmacy POS systems and Wasfaty",
+    lifespan=lifespan
+)
+
+
+# Authentication
+
+def require_api_key(permission: Optional[str] = None) -> Callable[..., Awaitable[Dict[str, Any]]]:
+    """Dependency resolving X-API-Key to its principal"""
+    
+    async def dependency(x_api_key: Optional[str] = Header(None)) -> Dict[str, Any]:
+        try:
+            return await api_key_authenticator.authenticate(x_api_key, permission)
+        except ApiKeyPermissionError as e:
+            raise HTTPException(status_code=403, detail=str(e))
+        except ApiKeyAuthError as e:
+            raise HTTPException(status_code=401, detail=str(e))
+    
+    return dependency
+
+
+async def verify_wasfaty_signature(
+    request: Request,
+    x_wasfaty_signature: Optional[str] = Header(None)
+) -> bytes:
+    """Dependency checking the webhook HMAC; returns the raw body"""
+    
+    body = await request.body()
+    expected = hmac.new(
+        api_config["wasfaty_webhook_secret"].encode(), body, hashlib.sha256
+    ).hexdigest()
+    
+    if not x_wasfaty_signature or not hmac.compare_digest(expected, x_wasfaty_signature):
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+    return body
+
+
+def _parse_json(body: bytes) -> Dict[str, Any]:
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Request body is not valid JSON")
+    
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail="Request body must be a JSON object")
+    return payload
+
+
+# Streaming
+
+async def _ndjson_lines(request: Request) -> AsyncIterator[bytes]:
+    """Non-empty lines of the request body as they arrive"""
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    
+    if buffer.strip():
+        yield buffer
+
+
+async def _start_stream_processing(
+    request: Request,
+    handler: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+    concurrency: int,
+    max_lines: int
+) -> List[asyncio.Task]:
+    """
+    Read an NDJSON body and start a task per line as it arrives
+    
+    At most `concurrency` lines are processed at once; reading the body
+    waits for a free slot, so a fast uploader is held back by TCP flow
+    control instead of buffering the upload. Each task keeps its result
+    until the response is sent, so reading stops after `max_lines` lines
+    and the rest of the body is answered with one non-retryable error.
+    
+    Returns:
+        The tasks, one per non-empty line read, in input order
+    """
+    slots = asyncio.Semaphore(concurrency)
+    tasks = []
+    
+    async def run(index: int, line: bytes) -> Dict[str, Any]:
+        try:
+            try:
+                item = json.loads(line)
+            except ValueError:
+                return {"index": index, "success": False, "retryable": False, "error": "Line is not valid JSON"}
+            
+            if not isinstance(item, dict):
+                return {"index": index, "success": False, "retryable": False, "error": "Line must be a JSON object"}
+            return {"index": index, **await handler(item)}
+        except Exception as e:
+            return {"index": index, "success": False, "retryable": True, "error": str(e)}
+        finally:
+            slots.release()
+    
+    async def refuse(index: int) -> Dict[str, Any]:
+        return {
+            "index": index,
+            "success": False,
+            "retryable": False,
+            "error": f"Streams are limited to {max_lines} lines; this line and the rest were not processed"
+        }
+    
+    async for line in _ndjson_lines(request):
+        if len(tasks) == max_lines:
+            tasks.append(asyncio.create_task(refuse(len(tasks))))
+            break
+        
+        await slots.acquire()
+        tasks.append(asyncio.create_task(run(len(tasks), line)))
+    
+    return tasks
+
+
+async def _stream_results(tasks: List[asyncio.Task]) -> AsyncIterator[str]:
+    """NDJSON results in completion order"""
+    for result in asyncio.as_completed(tasks):
+        yield json.dumps(await result, default=str) + "\n"
+
+
+# Health
+
+@app.get("/health")
+async def health() -> Dict[str, Any]:
+    """Liveness check; no I/O"""
+    return {"status": "ok", "environment": settings.environment}
+
+
+@app.get("/health/details")
+async def health_details(principal: Dict[str, Any] = Depends(require_api_key("admin"))) -> Dict[str, Any]:
+    """Connection pool and cache statistics for this worker"""
+    return {
+        "status": "ok",
+        "database_pools": get_pool_status(),
+        "api_key_cache": api_key_authenticator.stats()
+    }
+
+
+# POS Endpoints
+
+@app.post("/api/v1/pos/sales")
+async def create_pos_sale(
+    sale_data: Dict[str, Any],
+    principal: Dict[str, Any] = Depends(require_api_key("pos:sales"))
+) -> Dict[str, Any]:
+    """Process one POS sale for the key's pharmacy"""
+    try:
+        return await pos_service.process_pos_sale(principal["pharmacy_id"], sale_data)
+    except POSValidationError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except POSIntegrationError as e:
+        # Not the sale's fault; the till retries with the same pos_transaction_id
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+@app.post("/api/v1/pos/sales/stream")
+async def stream_pos_sales(
+    request: Request,
+    principal: Dict[str, Any] = Depends(require_api_key("pos:sales"))
+) -> StreamingResponse:
+    """Process an NDJSON stream of POS sales; results stream back as NDJSON"""
+    
+    async def process(sale_data: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            return await pos_service.process_pos_sale(principal["pharmacy_id"], sale_data)
+        except POSValidationError as e:
+            return {"success": False, "retryable": False, "error": str(e)}
+        except POSIntegrationError as e:
+            return {"success": False, "retryable": True, "error": str(e)}
+    
+    # The body is read completely before the response starts, since the
+    # server listens for disconnects on the same channel once it streams
+    tasks = await _start_stream_processing(
+        request, process, api_config["stream_concurrency"], api_config["stream_max_lines"]
+    )
+    return StreamingResponse(_stream_results(tasks), media_type="application/x-ndjson")
+
+
+@app.post("/api/v1/pos/sales/validate")
+async def validate_pos_sale(
+    transaction_data: Dict[str, Any],
+    principal: Dict[str, Any] = Depends(require_api_key("pos:sales"))
+) -> Dict[str, Any]:
+    """Validate a POS sale without processing it"""
+    return await pos_service.validate_pos_transaction(principal["pharmacy_id"], transaction_data)
+
+
+@app.get("/api/v1/transactions/{transaction_id}/status")
+async def get_transaction_status(
+    transaction_id: str,
+    principal: Dict[str, Any] = Depends(require_api_key("pos:read"))
+) -> Dict[str, Any]:
+    """Transaction status and Wasfaty sync information"""
+    
+    status = await pos_service.get_transaction_status(transaction_id)
+    
+    # Other pharmacies' transactions are reported as missing, not forbidden
+    if "error" in status or status.get("pharmacy_id") != principal["pharmacy_id"]:
+        raise HTTPException(status_code=404, detail="Transaction not found")
+    return status
+
+
+@app.post("/api/v1/transactions/{transaction_id}/retry-sync")
+async def retry_transaction_sync(
+    transaction_id: str,
+    principal: Dict[str, Any] = Depends(require_api_key("pos:sales"))
+) -> Dict[str, Any]:
+    """Retry the Wasfaty sync of a failed transaction"""
+    
+    status = await pos_service.get_transaction_status(transaction_id)
+    if "error" in status or status.get("pharmacy_id") != principal["pharmacy_id"]:
+        raise HTTPException(status_code=404, detail="Transaction not found")
+    
+    result = await pos_service.retry_failed_sync(transaction_id)
+    if "error" in result:
+        raise HTTPException(status_code=409, detail=result["error"])
+    return result
+
+
+@app.get("/api/v1/sync/status")
+async def get_sync_status(
+    hours: int = Query(24, ge=1, le=24 * 31),
+    principal: Dict[str, Any] = Depends(require_api_key("pos:read"))
+) -> Dict[str, Any]:
+    """Sync status report for the key's pharmacy"""
+    return await sync_service.get_sync_status_report(principal["pharmacy_id"], hours)
+
+
+@app.get("/api/v1/inventory/reorder-proposals")
+async def get_reorder_proposals(
+    principal: Dict[str, Any] = Depends(require_api_key("pos:read"))
+) -> Dict[str, Any]:
+    """Reorder proposals for the key's pharmacy"""
+    try:
+        return await reorder_service.generate_reorder_proposals(principal["pharmacy_id"])
+    except ReorderServiceError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+@app.get("/api/v1/inventory/near-expiry")
+async def get_near_expiry_stock(
+    within_days: Optional[int] = Query(None, ge=0),
+    principal: Dict[str, Any] = Depends(require_api_key("pos:read"))
+) -> Dict[str, Any]:
+    """Near-expiry stock for the key's pharmacy"""
+    try:
+        return await expiry_service.get_near_expiry_stock(principal["pharmacy_id"], within_days)
+    except ExpiryServiceError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+# Wasfaty Webhooks
+
+@app.post("/api/v1/webhooks/wasfaty/prescriptions")
+async def wasfaty_prescription_webhook(body: bytes = Depends(verify_wasfaty_signature)) -> Dict[str, Any]:
+    """Dispense a prescription sent by Wasfaty"""
+    try:
+        return await sync_service.process_wasfaty_prescription(_parse_json(body))
+    except PrescriptionValidationError as e:
+        # Redelivering the same payload cannot succeed
+        raise HTTPException(status_code=422, detail=str(e))
+    except SyncServiceError as e:
+        # 5xx so Wasfaty redelivers; duplicates are answered from the ingestion guard
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+def main():
+    """Run the API under uvicorn with the configured worker processes"""
+    
+    logging.basicConfig(level=getattr(logging, settings.log_level.upper(), logging.INFO))
+    uvicorn.run(
+        "main:app",
+        host=api_config["host"],
+        port=api_config["port"],
+        workers=api_config["workers"],
+        backlog=api_config["backlog"],
+        limit_concurrency=api_config["limit_concurrency"],
+        timeout_keep_alive=api_config["timeout_keep_alive_seconds"],
+        log_level=settings.log_level.lower()
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+Local mock of the Wasfaty API for development and load testing
+
+Implements the endpoints WasfatyClient calls, counts every request so
+batching and caching effects can be measured, and can inject latency and
+failures. Run it and point WASFATY_BASE_URL at it:
+
+    uvicorn mock_wasfaty_server:app --port 8100
+    WASFATY_BASE_URL=http://localhost:8100 python -m services.outbox_worker
+"""
+
+import asyncio
+import random
+import uuid
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Optional, Any
+
+from fastapi import FastAPI, Request, HTTPException
+
+from services.inventory_checksums import BucketChecksums, bucket_for_key, inventory_key
+
+
+app = FastAPI(title="Mock Wasfaty API")
+
+API_PREFIX = "/api/v1"
+
+# Request counters per endpoint, inspected with GET /mock/stats
+request_counts: Counter = Counter()
+
+# Responses already returned per Idempotency-Key, so replays get the same answer
+idempotent_responses: Dict[str, Dict[str, Any]] = {}
+
+# Latest stock level per pharmacy and drug key, as received by inventory/sync
+inventory_levels: Dict[str, Dict[str, Dict[str, Any]]] = {}
+
+# Behaviour knobs, changed with POST /mock/config
+mock_config = {
+    "latency_ms": 0,
+    "failure_rate": 0.0,
+    "token_expires_in": 3600,
+    "rejected_transaction_ids": []  # Reported as failed items in batch reports
+}
+
+
+async def simulate_upstream(endpoint: str):
+    """Count the request and apply configured latency and failures"""
+    request_counts[endpoint] += 1
+    
+    if mock_config["latency_ms"]:
+        await asyncio.sleep(mock_config["latency_ms"] / 1000)
+    
+    if random.random() < mock_config["failure_rate"]:
+        raise HTTPException(status_code=503, detail="Injected failure")
+
+
+def replay_or_store(request: Request, response: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the stored response for a repeated Idempotency-Key"""
+    key = request.headers.get("Idempotency-Key")
+    if not key:
+        return response
+    return idempotent_responses.setdefault(key, response)
+
+
+# Mock Control Endpoints
+
+@app.get("/mock/stats")
+async def get_stats():
+    return {"requests": dict(request_counts), "total": sum(request_counts.values())}
+
+
+@app.post("/mock/reset")
+async def reset_stats():
+    request_counts.clear()
+    idempotent_responses.clear()
+    inventory_levels.clear()
+    return {"reset": True}
+
+
+@app.post("/mock/config")
+async def update_config(request: Request):
+    mock_config.update(await request.json())
+    return mock_config
+
+
+# Authentication
+
+@app.post("/oauth/token")
+async def issue_token():
+    await simulate_upstream("oauth/token")
+    return {
+        "access_token": uuid.uuid4().hex,
+        "token_type": "bearer",
+        "expires_in": mock_config["token_expires_in"]
+    }
+
+
+# Prescriptions
+
+@app.post(f"{API_PREFIX}/prescriptions/validate")
+async def validate_prescription(request: Request):
+    await simulate_upstream("prescriptions/validate")
+    body = await request.json()
+    return {
+        "is_valid": True,
+        "prescription_id": body.get("prescription_id"),
+        "validated_at": datetime.utcnow().isoformat()
+    }
+
+
+@app.get(f"{API_PREFIX}/prescriptions/{{prescription_id}}")
+async def get_prescription(prescription_id: str):
+    await simulate_upstream("prescriptions/get")
+    return {"prescription_id": prescription_id, "status": "active", "items": []}
+
+
+@app.post(f"{API_PREFIX}/prescriptions/{{prescription_id}}/dispense")
+async def dispense_prescription(prescription_id: str, request: Request):
+    await simulate_upstream("prescriptions/dispense")
+    return replay_or_store(request, {
+        "prescription_id": prescription_id,
+        "dispensed": True,
+        "wasfaty_transaction_id": f"WT-{uuid.uuid4().hex[:12]}"
+    })
+
+
+# Inventory and Drugs
+
+@app.post(f"{API_PREFIX}/inventory/sync")
+async def sync_inventory(request: Request):
+    await simulate_upstream("inventory/sync")
+    body = await request.json()
+    
+    levels = inventory_levels.setdefault(str(body.get("pharmacy_id")), {})
+    for update in body.get("updates", []):
+        levels[inventory_key(update)] = {
+            "drug_id": update.get("drug_id"),
+            "wasfaty_drug_id": update.get("wasfaty_drug_id"),
+            "current_stock": update.get("current_stock", 0),
+            "available_stock": update.get("available_stock", 0)
+        }
+    
+    return {"accepted": len(body.get("updates", [])), "synced_at": datetime.utcnow().isoformat()}
+
+
+@app.get(f"{API_PREFIX}/inventory/{{pharmacy_id}}/checksums")
+async def inventory_checksums(pharmacy_id: str, bucket_count: int):
+    await simulate_upstream("inventory/checksums")
+    checksums = BucketChecksums(bucket_count)
+    checksums.add_all(inventory_levels.get(pharmacy_id, {}).values())
+    return {"pharmacy_id": pharmacy_id, "bucket_count": bucket_count, "checksums": checksums.checksums()}
+
+
+@app.get(f"{API_PREFIX}/inventory/{{pharmacy_id}}/snapshot")
+async def inventory_snapshot(
+    pharmacy_id: str,
+    bucket_count: int,
+    buckets: str,
+    cursor: Optional[str] = None,
+    limit: int = 1000
+):
+    await simulate_upstream("inventory/snapshot")
+    wanted = {int(bucket) for bucket in buckets.split(",") if bucket}
+    
+    keys = sorted(
+        key for key in inventory_levels.get(pharmacy_id, {})
+        if bucket_for_key(key, bucket_count) in wanted and (cursor is None or key > cursor)
+    )
+    page = keys[:limit]
+    
+    return {
+        "items": [inventory_levels[pharmacy_id][key] for key in page],
+        "next_cursor": page[-1] if len(keys) > limit else None
+    }
+
+
+@app.get(f"{API_PREFIX}/drugs/lookup/{{drug_identifier}}")
+async def lookup_drug(drug_identifier: str):
+    await simulate_upstream("drugs/lookup")
+    return {"wasfaty_drug_id": drug_identifier, "name": f"Drug {drug_identifier}"}
+
+
+# Transactions
+
+@app.post(f"{API_PREFIX}/transactions/report")
+async def report_transaction(request: Request):
+    await simulate_upstream("transactions/report")
+    body = await request.json()
+    return replay_or_store(request, {
+        "transaction_id": body.get("transaction_id"),
+        "success": True,
+        "wasfaty_transaction_id": f"WT-{uuid.uuid4().hex[:12]}"
+    })
+
+
+@app.post(f"{API_PREFIX}/transactions/report/batch")
+async def report_transactions_batch(request: Request):
+    await simulate_upstream("transactions/report/batch")
+    body = await request.json()
+    
+    results = []
+    for transaction in body.get("transactions", []):
+        if transaction.get("transaction_id") in mock_config["rejected_transaction_ids"]:
+            results.append({
+                "transaction_id": transaction.get("transaction_id"),
+                "success": False,
+                "status_code": 422,
+                "error": "Transaction rejected"
+            })
+            continue
+        
+        result = {
+            "transaction_id": transaction.get("transaction_id"),
+            "success": True,
+            "wasfaty_transaction_id": f"WT-{uuid.uuid4().hex[:12]}"
+        }
+        key = transaction.get("idempotency_key")
+        if key:
+            result = idempotent_responses.setdefault(key, result)
+        results.append(result)
+    
+    return {"results": results}
+
+
+# Health and Status
+
+@app.get(f"{API_PREFIX}/health")
+async def health():
+    await simulate_upstream("health")
+    return {"status": "healthy"}
+
+
+@app.get(f"{API_PREFIX}/system/status")
+async def system_status():
+    await simulate_upstream("system/status")
+    return {"status": "operational", "maintenance": False}
@@ -0,0 +1,266 @@
+"""
+API key authentication
+
+Keys look like wpk_<prefix>_<secret>. The prefix is stored in clear on
+ApiKey.key_prefix (unique index) and the whole key is stored as a bcrypt
+hash, so a presented key is found with one indexed lookup and verified
+with one bcrypt check. After that:
+- The verified principal is cached under the key's SHA-256 digest in a
+  bounded TTL cache, so repeat requests cost a hash and a dict lookup
+- Rejected keys are cached briefly too, so bad keys cannot force bcrypt work
+- Concurrent first requests with the same key share one verification
+- last_used_at is buffered per key and written in batches
+
+Revoking or expiring a key takes effect within the cache TTL.
+"""
+
+import asyncio
+import hashlib
+import logging
+import secrets
+from datetime import datetime
+from typing import Dict, List, Optional, Any
+from passlib.context import CryptContext
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from config import get_api_key_config
+from database.database import run_in_db_session
+from database.models import ApiKey
+from services.response_cache import ResponseCache
+
+
+logger = logging.getLogger(__name__)
+
+
+API_KEY_PREFIX = "wpk"
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+class ApiKeyAuthError(Exception):
+    """Raised when an API key is missing, unknown, revoked or lacks permission"""
+    pass
+
+
+class ApiKeyPermissionError(ApiKeyAuthError):
+    """Raised when a valid API key lacks the permission a call requires"""
+    pass
+
+
+def generate_api_key() -> tuple:
+    """
+    Generate a new API key
+    
+    Returns:
+        Tuple of (plaintext key, key prefix, bcrypt hash); only the prefix
+        and hash are stored
+    """
+    key_prefix = secrets.token_hex(6)
+    api_key = f"{API_KEY_PREFIX}_{key_prefix}_{secrets.token_urlsafe(32)}"
+    return api_key, key_prefix, pwd_context.hash(api_key)
+
+
+def parse_key_prefix(api_key: str) -> Optional[str]:
+    """Lookup prefix of a presented key, or None if it is malformed"""
+    parts = api_key.split("_", 2)
+    if len(parts) != 3 or parts[0] != API_KEY_PREFIX or not parts[1]:
+        return None
+    return parts[1]
+
+
+def create_api_key(
+    db: Session,
+    pharmacy_id: str,
+    key_name: str,
+    permissions: Optional[List[str]] = None,
+    expires_at: Optional[datetime] = None
+) -> str:
+    """
+    Create an API key for a pharmacy
+    
+    Returns:
+        The plaintext key; it cannot be recovered later
+    """
+    api_key, key_prefix, key_hash = generate_api_key()
+    db.add(ApiKey(
+        pharmacy_id=pharmacy_id,
+        key_name=key_name,
+        key_prefix=key_prefix,
+        key_hash=key_hash,
+        permissions=permissions,
+        expires_at=expires_at
+    ))
+    db.flush()
+    return api_key
+
+
+class ApiKeyAuthenticator:
+    """
+    Cached API key verification with batched usage tracking
+    Safe to share between all tasks on one event loop
+    """
+    
+    def __init__(self):
+        config = get_api_key_config()
+        self.ttl_seconds = config["cache_ttl_seconds"]
+        self.negative_ttl_seconds = config["negative_cache_ttl_seconds"]
+        self.usage_flush_interval_seconds = config["usage_flush_interval_seconds"]
+        
+        self._verified = ResponseCache(max_entries=config["cache_max_entries"])
+        self._rejected = ResponseCache(max_entries=config["cache_max_entries"])
+        self._verifying: Dict[str, asyncio.Future] = {}
+        
+        self._last_used: Dict[Any, datetime] = {}
+        self._usage_timer: Optional[asyncio.TimerHandle] = None
+        self._in_flight = set()
+    
+    async def authenticate(self, api_key: Optional[str], permission: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Resolve an API key to its principal
+        
+        Args:
+            api_key: Key presented by the caller
+            permission: Permission the call requires, if any
+            
+        Returns:
+            Dict with api_key_id, pharmacy_id, key_name and permissions
+            
+        Raises:
+            ApiKeyAuthError: If the key is invalid, expired or lacks the permission
+        """
+        if not api_key:
+            raise ApiKeyAuthError("Missing API key")
+        
+        digest = hashlib.sha256(api_key.encode()).hexdigest()
+        
+        principal = self._verified.get(digest)
+        if principal is None:
+            if self._rejected.get(digest) is not None:
+                raise ApiKeyAuthError("Invalid API key")
+            principal = await self._verify_once(digest, api_key)
+        
+        if principal["expires_at"] is not None and datetime.utcnow() >= principal["expires_at"]:
+            self._verified.invalidate(digest)
+            raise ApiKeyAuthError("API key expired")
+        
+        # Keys without a permission list are not restricted
+        permissions = principal["permissions"]
+        if permission and permissions is not None and permission not in permissions and "*" not in permissions:
+            raise ApiKeyPermissionError(f"API key lacks permission {permission}")
+        
+        self._record_use(principal["api_key_id"])
+        return principal
+    
+    def invalidate(self, api_key: str):
+        """Forget a cached key, e.g. right after revoking it in this process"""
+        digest = hashlib.sha256(api_key.encode()).hexdigest()
+        self._verified.invalidate(digest)
+        self._rejected.invalidate(digest)
+    
+    async def _verify_once(self, digest: str, api_key: str) -> Dict[str, Any]:
+        """Verify a key, sharing one verification between concurrent callers"""
+        future = self._verifying.get(digest)
+        if future is None:
+            future = asyncio.ensure_future(self._verify(digest, api_key))
+            self._verifying[digest] = future
+            future.add_done_callback(lambda _: self._verifying.pop(digest, None))
+        return await asyncio.shield(future)
+    
+    async def _verify(self, digest: str, api_key: str) -> Dict[str, Any]:
+        """Look the key up by prefix and check it with bcrypt"""
+        key_prefix = parse_key_prefix(api_key)
+        # Read from the primary: a replica may not have a just-created key yet,
+        # and a miss here would be cached as a rejection
+        record = await run_in_db_session(_load_api_key, key_prefix) if key_prefix else None
+        
+        valid = False
+        if record is not None and record["is_active"]:
+            # bcrypt is deliberately slow; keep it off the event loop
+            loop = asyncio.get_running_loop()
+            valid = await loop.run_in_executor(None, pwd_context.verify, api_key, record["key_hash"])
+        
+        if not valid:
+            self._rejected.set(digest, {"rejected": True}, self.negative_ttl_seconds)
+            raise ApiKeyAuthError("Invalid API key")
+        
+        principal = {
+            "api_key_id": record["id"],
+            "pharmacy_id": record["pharmacy_id"],
+            "key_name": record["key_name"],
+            "permissions": record["permissions"],
+            "expires_at": record["expires_at"]
+        }
+        self._verified.set(digest, principal, self.ttl_seconds)
+        return principal
+    
+    # Usage Tracking
+    
+    def _record_use(self, api_key_id):
+        """Buffer a last_used_at update; written with the next batch"""
+        self._last_used[api_key_id] = datetime.utcnow()
+        
+        if self._usage_timer is None:
+            self._usage_timer = asyncio.get_running_loop().call_later(
+                self.usage_flush_interval_seconds, self._flush_usage_buffer
+            )
+    
+    def _flush_usage_buffer(self):
+        """Start writing every buffered last_used_at"""
+        if self._usage_timer is not None:
+            self._usage_timer.cancel()
+            self._usage_timer = None
+        
+        last_used, self._last_used = self._last_used, {}
+        if last_used:
+            task = asyncio.ensure_future(self._write_usage(last_used))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+    
+    async def _write_usage(self, last_used: Dict[Any, datetime]):
+        rows = [{"id": api_key_id, "last_used_at": used_at} for api_key_id, used_at in last_used.items()]
+        try:
+            await run_in_db_session(_update_last_used, rows)
+        except Exception as e:
+            # Usage timestamps are informational; never fail requests over them
+            logger.error(f"Failed to record usage of {len(rows)} API keys: {e}")
+    
+    async def flush(self):
+        """Write buffered usage and wait for in-flight writes (call at shutdown)"""
+        self._flush_usage_buffer()
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Cache counters for monitoring"""
+        return {
+            "verified": self._verified.stats(),
+            "rejected": self._rejected.stats(),
+            "pending_usage_updates": len(self._last_used)
+        }
+
+
+def _load_api_key(db: Session, key_prefix: str) -> Optional[Dict[str, Any]]:
+    """API key row for a prefix as plain values, or None"""
+    api_key = db.query(ApiKey).filter(ApiKey.key_prefix == key_prefix).first()
+    if api_key is None:
+        return None
+    
+    return {
+        "id": api_key.id,
+        "pharmacy_id": str(api_key.pharmacy_id),
+        "key_name": api_key.key_name,
+        "key_hash": api_key.key_hash,
+        "permissions": api_key.permissions,
+        "is_active": api_key.is_active,
+        "expires_at": api_key.expires_at
+    }
+
+
+def _update_last_used(db: Session, rows: List[Dict[str, Any]]):
+    """Bulk UPDATE of last_used_at by primary key"""
+    db.execute(update(ApiKey), rows)
+
+
+# Singleton instance for global use
+api_key_authenticator = ApiKeyAuthenticator()
@@ -0,0 +1,288 @@
+"""
+Expiry Service
+
+This module sweeps expiry dates across the chain:
+- Active prescriptions past their expiry date are marked EXPIRED in bulk
+- Inventory batches with stock left that expire within the near-expiry
+  window are kept in near_expiry_stock, one row per batch
+
+The near-expiry list is maintained incrementally. Each run only looks at
+inventory rows updated since the previous run plus batches whose expiry
+date has moved into the window since then; the first run builds the list
+from scratch. Both sweeps run from the outbox worker's maintenance loop.
+"""
+
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Any
+from sqlalchemy import and_, delete, func, or_, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from config import get_expiry_config
+from database.database import run_in_db_session, run_in_read_session
+from database.models import (
+    Drug, InventoryItem, NearExpiryStock, Prescription,
+    PrescriptionStatus, SweepCheckpoint
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+NEAR_EXPIRY_SWEEP = "near_expiry_stock"
+
+
+class ExpiryServiceError(Exception):
+    """Custom exception for expiry service errors"""
+    pass
+
+
+class ExpiryService:
+    """
+    Background expiry sweeps for prescriptions and inventory batches
+    """
+    
+    def __init__(self):
+        config = get_expiry_config()
+        self.near_expiry_days = config["near_expiry_days"]
+        self.batch_size = config["sweep_batch_size"]
+        self.change_overlap = timedelta(seconds=config["change_overlap_seconds"])
+    
+    async def sweep(self) -> Dict[str, int]:
+        """
+        Expire prescriptions and refresh the near-expiry stock list
+        
+        Returns:
+            Dict with the number of prescriptions expired and near-expiry
+            rows changed
+        """
+        result = {"prescriptions_expired": 0, "near_expiry_changes": 0}
+        
+        try:
+            # One transaction per batch keeps row locks short
+            while True:
+                expired = await run_in_db_session(self._expire_prescription_batch)
+                result["prescriptions_expired"] += expired
+                if expired < self.batch_size:
+                    break
+        except Exception as e:
+            logger.error(f"Failed to expire prescriptions: {e}")
+        
+        try:
+            result["near_expiry_changes"] = await run_in_db_session(self._refresh_near_expiry_stock)
+        except Exception as e:
+            logger.error(f"Failed to refresh near-expiry stock: {e}")
+        
+        if any(result.values()):
+            logger.info(
+                f"Expiry sweep: {result['prescriptions_expired']} prescriptions expired, "
+                f"{result['near_expiry_changes']} near-expiry rows changed"
+            )
+        return result
+    
+    async def get_near_expiry_stock(
+        self,
+        pharmacy_id: Optional[str] = None,
+        within_days: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        Get near-expiry stock grouped by pharmacy
+        
+        Args:
+            pharmacy_id: Optional pharmacy filter; all pharmacies when omitted
+            within_days: Only batches expiring within this many days
+                (default: the whole near-expiry window)
+                
+        Returns:
+            Dict containing near-expiry batches grouped by pharmacy
+        """
+        try:
+            rows = await run_in_read_session(self._load_near_expiry_stock, pharmacy_id, within_days)
+            
+            batches: Dict[str, List[Dict]] = defaultdict(list)
+            for row in rows:
+                batches[row["pharmacy_id"]].append(row)
+            
+            return {
+                "pharmacy_count": len(batches),
+                "batch_count": len(rows),
+                "batches": dict(batches),
+                "within_days": within_days or self.near_expiry_days,
+                "generated_at": datetime.utcnow().isoformat()
+            }
+        
+        except Exception as e:
+            logger.error(f"Failed to get near-expiry stock: {e}")
+            raise ExpiryServiceError(f"Near-expiry lookup failed: {e}")
+    
+    def _expire_prescription_batch(self, db: Session) -> int:
+        """
+        Mark one batch of overdue active prescriptions EXPIRED
+        
+        Returns:
+            Number of prescriptions expired
+        """
+        now = datetime.utcnow()
+        
+        # Served by the partial index on active prescriptions' expiry dates
+        overdue = select(Prescription.id).where(
+            Prescription.status == PrescriptionStatus.ACTIVE,
+            Prescription.expiry_date < now
+        ).order_by(
+            Prescription.expiry_date
+        ).limit(self.batch_size).with_for_update(skip_locked=True)
+        
+        expired_ids = db.execute(
+            update(Prescription).where(
+                Prescription.id.in_(overdue.scalar_subquery())
+            ).values(
+                status=PrescriptionStatus.EXPIRED,
+                updated_at=now
+            ).returning(Prescription.id).execution_options(synchronize_session=False)
+        ).scalars().all()
+        
+        return len(expired_ids)
+    
+    def _refresh_near_expiry_stock(self, db: Session) -> int:
+        """
+        Bring near_expiry_stock up to date with inventory changes since the last run
+        
+        Returns:
+            Number of near-expiry rows written or removed
+        """
+        started_at = datetime.utcnow()
+        window = timedelta(days=self.near_expiry_days)
+        horizon = started_at + window
+        
+        # Locking the checkpoint row keeps concurrent sweeps from interleaving
+        checkpoint = db.query(SweepCheckpoint).filter(
+            SweepCheckpoint.name == NEAR_EXPIRY_SWEEP
+        ).with_for_update().first()
+        
+        candidates = select(
+            InventoryItem.id,
+            InventoryItem.pharmacy_id,
+            InventoryItem.drug_id,
+            InventoryItem.batch_number,
+            InventoryItem.expiry_date,
+            (InventoryItem.current_stock - func.coalesce(InventoryItem.reserved_stock, 0)).label("available_stock")
+        )
+        
+        if checkpoint is None:
+            db.execute(delete(NearExpiryStock))
+            candidates = candidates.where(
+                InventoryItem.expiry_date.isnot(None),
+                InventoryItem.expiry_date <= horizon
+            )
+        else:
+            # Rows changed since the last run, plus batches the moving window has reached
+            previous_horizon = checkpoint.checkpoint_at + window
+            candidates = candidates.where(or_(
+                InventoryItem.updated_at >= checkpoint.checkpoint_at - self.change_overlap,
+                and_(
+                    InventoryItem.expiry_date > previous_horizon,
+                    InventoryItem.expiry_date <= horizon
+                )
+            ))
+        
+        changes = 0
+        upserts: List[Dict] = []
+        removals: List = []
+        for row in db.execute(candidates.execution_options(yield_per=self.batch_size)):
+            if row.expiry_date is not None and row.expiry_date <= horizon and (row.available_stock or 0) > 0:
+                upserts.append({
+                    "inventory_item_id": row.id,
+                    "pharmacy_id": row.pharmacy_id,
+                    "drug_id": row.drug_id,
+                    "batch_number": row.batch_number,
+                    "expiry_date": row.expiry_date,
+                    "available_stock": row.available_stock,
+                    "updated_at": started_at
+                })
+            else:
+                removals.append(row.id)
+            
+            if len(upserts) + len(removals) >= self.batch_size:
+                changes += self._write_near_expiry_changes(db, upserts, removals)
+                upserts, removals = [], []
+        
+        changes += self._write_near_expiry_changes(db, upserts, removals)
+        
+        db.execute(
+            insert(SweepCheckpoint).values(
+                name=NEAR_EXPIRY_SWEEP,
+                checkpoint_at=started_at,
+                updated_at=started_at
+            ).on_conflict_do_update(
+                index_elements=[SweepCheckpoint.name],
+                set_={"checkpoint_at": started_at, "updated_at": started_at}
+            )
+        )
+        
+        return changes
+    
+    def _write_near_expiry_changes(self, db: Session, upserts: List[Dict], removals: List) -> int:
+        """Apply one chunk of near-expiry upserts and removals"""
+        
+        changes = 0
+        if upserts:
+            statement = insert(NearExpiryStock).values(upserts)
+            db.execute(statement.on_conflict_do_update(
+                index_elements=[NearExpiryStock.inventory_item_id],
+                set_={
+                    "batch_number": statement.excluded.batch_number,
+                    "expiry_date": statement.excluded.expiry_date,
+                    "available_stock": statement.excluded.available_stock,
+                    "updated_at": statement.excluded.updated_at
+                }
+            ))
+            changes += len(upserts)
+        
+        if removals:
+            changes += db.execute(
+                delete(NearExpiryStock).where(NearExpiryStock.inventory_item_id.in_(removals))
+            ).rowcount
+        
+        return changes
+    
+    def _load_near_expiry_stock(
+        self,
+        db: Session,
+        pharmacy_id: Optional[str],
+        within_days: Optional[int]
+    ) -> List[Dict]:
+        """Near-expiry batches, soonest expiry first within each pharmacy"""
+        
+        now = datetime.utcnow()
+        query = db.query(
+            NearExpiryStock,
+            Drug.name,
+            Drug.wasfaty_drug_id
+        ).join(
+            Drug, Drug.id == NearExpiryStock.drug_id
+        )
+        
+        if pharmacy_id:
+            query = query.filter(NearExpiryStock.pharmacy_id == pharmacy_id)
+        if within_days:
+            query = query.filter(NearExpiryStock.expiry_date <= now + timedelta(days=within_days))
+        
+        return [
+            {
+                "pharmacy_id": str(batch.pharmacy_id),
+                "inventory_item_id": str(batch.inventory_item_id),
+                "drug_id": str(batch.drug_id),
+                "drug_name": drug_name,
+                "wasfaty_drug_id": wasfaty_drug_id,
+                "batch_number": batch.batch_number,
+                "expiry_date": batch.expiry_date.isoformat(),
+                "days_to_expiry": (batch.expiry_date - now).days,
+                "expired": batch.expiry_date <= now,
+                "available_stock": batch.available_stock
+            }
+            for batch, drug_name, wasfaty_drug_id in query.order_by(
+                NearExpiryStock.pharmacy_id, NearExpiryStock.expiry_date
+            )
+        ]
@@ -0,0 +1,125 @@
+"""
+Field-level encryption for Wasfaty payloads
+
+This module encrypts and decrypts individual sensitive fields (patient and
+prescription identifiers) with Fernet:
+- Keys are derived once from configured secrets and cached
+- MultiFernet keeps previous keys readable during key rotation
+
+Run `python -m services.field_crypto` for a throughput micro-benchmark.
+"""
+
+import base64
+import binascii
+import logging
+from functools import lru_cache
+from typing import Dict, List, Optional, Any
+
+from cryptography.fernet import Fernet, MultiFernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+from config import get_encryption_config
+
+
+logger = logging.getLogger(__name__)
+
+
+SENSITIVE_FIELDS = ('patient_id', 'prescription_id', 'patient_phone')
+
+
+@lru_cache(maxsize=16)
+def derive_fernet_key(secret: str) -> bytes:
+    """
+    Turn a configured secret into a Fernet key
+    
+    A secret that already is a Fernet key (url-safe base64 of 32 bytes) is
+    used as is; anything else is stretched with HKDF-SHA256.
+    """
+    try:
+        if len(base64.urlsafe_b64decode(secret.encode())) == 32:
+            return secret.encode()
+    except (binascii.Error, ValueError):
+        pass
+    
+    derived = HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=b"wasfaty-pos-field-encryption"
+    ).derive(secret.encode())
+    return base64.urlsafe_b64encode(derived)
+
+
+class FieldCipher:
+    """
+    Fernet field encryption with key rotation
+    The first configured key encrypts; every key can decrypt
+    """
+    
+    def __init__(self, keys: Optional[List[str]] = None):
+        keys = keys or get_encryption_config()["keys"]
+        self.fernet = MultiFernet([Fernet(derive_fernet_key(key)) for key in keys])
+    
+    # Single values
+    
+    def encrypt_value(self, value: Any) -> str:
+        return self.fernet.encrypt(str(value).encode()).decode()
+    
+    def decrypt_value(self, token: str) -> str:
+        return self.fernet.decrypt(token.encode()).decode()
+    
+    # Payloads
+    
+    def encrypt_payload(self, data: Dict) -> Dict:
+        """Replace sensitive fields with their encrypted_<field> counterparts"""
+        encrypted_data = data.copy()
+        
+        for field in SENSITIVE_FIELDS:
+            if field in encrypted_data:
+                encrypted_data[f"encrypted_{field}"] = self.encrypt_value(encrypted_data.pop(field))
+        
+        return encrypted_data
+    
+    def decrypt_payload(self, response_data: Dict) -> Dict:
+        """Merge the decrypted contents of encrypted_data into the response"""
+        decrypted_data = response_data.copy()
+        encrypted_fields = decrypted_data.pop('encrypted_data', None) or {}
+        
+        for field, encrypted_value in encrypted_fields.items():
+            try:
+                decrypted_data[field] = self.decrypt_value(encrypted_value)
+            except Exception as e:
+                logger.warning(f"Failed to decrypt field {field}: {e}")
+        
+        return decrypted_data
+
+
+def run_benchmark(payload_sizes=(32, 256, 4096, 65536), iterations: int = 2000):
+    """Print encrypt/decrypt throughput per field size"""
+    import time
+    
+    cipher = FieldCipher(keys=[Fernet.generate_key().decode()])
+    
+    print(f"{'bytes':>8} {'encrypt/s':>12} {'decrypt/s':>12} {'MB/s enc':>10}")
+    for size in payload_sizes:
+        value = "x" * size
+        count = max(10, iterations * 256 // max(size, 256))
+        
+        start = time.perf_counter()
+        tokens = [cipher.encrypt_value(value) for _ in range(count)]
+        encrypt_seconds = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        for token in tokens:
+            cipher.decrypt_value(token)
+        decrypt_seconds = time.perf_counter() - start
+        
+        print(
+            f"{size:>8} {count / encrypt_seconds:>12.0f} {count / decrypt_seconds:>12.0f} "
+            f"{size * count / encrypt_seconds / 1e6:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    run_benchmark()
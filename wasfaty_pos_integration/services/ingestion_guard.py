@@ -0,0 +1,191 @@
+"""
+Idempotent ingestion of inbound POS sales and Wasfaty prescriptions
+
+POS retries and duplicate webhooks carry the same upstream ID
+(pos_transaction_id, Wasfaty prescription_id). The first delivery claims
+that ID in ingestion_records inside the same DB transaction as the work
+it triggers, and stores its result there. Later deliveries get the stored
+result back:
+- From an in-memory (optionally Redis-shared) cache of recent results,
+  without touching the DB or Wasfaty
+- Otherwise from ingestion_records; a duplicate that races the first
+  delivery waits on the unique index and then sees the committed result
+"""
+
+import json
+import logging
+import uuid
+from datetime import datetime
+from typing import Dict, Optional, Any
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from config import get_ingestion_config
+from database.database import run_in_db_session
+from database.models import IngestionRecord
+from services.response_cache import ResponseCache
+
+
+logger = logging.getLogger(__name__)
+
+
+POS_SALE_SOURCE = "pos_sale"
+PRESCRIPTION_SOURCE = "wasfaty_prescription"
+
+
+def pos_sale_external_id(pharmacy_id: str, pos_transaction_id: str) -> str:
+    """POS transaction IDs are only unique within a pharmacy"""
+    return f"{pharmacy_id}:{pos_transaction_id}"
+
+
+def mark_duplicate(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Flag a stored result returned for a replayed event"""
+    return {**result, "duplicate": True}
+
+
+# DB helpers, called inside the caller's session and transaction
+
+def claim_ingestion(
+    db: Session,
+    source: str,
+    external_id: str,
+    pharmacy_id: Optional[str] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Claim an upstream event for processing
+    
+    Returns:
+        None if this call claimed the event, otherwise the stored result
+        of the delivery that processed it
+    """
+    claimed_id = db.execute(
+        insert(IngestionRecord).values(
+            id=uuid.uuid4(),
+            source=source,
+            external_id=external_id,
+            pharmacy_id=pharmacy_id,
+            created_at=datetime.utcnow()
+        ).on_conflict_do_nothing(
+            index_elements=[IngestionRecord.source, IngestionRecord.external_id]
+        ).returning(IngestionRecord.id)
+    ).scalar()
+    
+    if claimed_id is not None:
+        return None
+    
+    return find_ingestion_result(db, source, external_id) or {}
+
+
+def complete_ingestion(db: Session, source: str, external_id: str, result: Dict[str, Any]):
+    """Store the result of a claimed event for later replays"""
+    db.query(IngestionRecord).filter(
+        IngestionRecord.source == source,
+        IngestionRecord.external_id == external_id
+    ).update({IngestionRecord.result: result}, synchronize_session=False)
+
+
+def release_ingestion(db: Session, source: str, external_id: str):
+    """Give up a claim so a later delivery of the event is processed again"""
+    db.query(IngestionRecord).filter(
+        IngestionRecord.source == source,
+        IngestionRecord.external_id == external_id
+    ).delete(synchronize_session=False)
+
+
+def find_ingestion_result(db: Session, source: str, external_id: str) -> Optional[Dict[str, Any]]:
+    """Stored result of a processed event, or None"""
+    return db.query(IngestionRecord.result).filter(
+        IngestionRecord.source == source,
+        IngestionRecord.external_id == external_id,
+        IngestionRecord.result.isnot(None)
+    ).scalar()
+
+
+class IngestionGuard:
+    """
+    Recent-result cache in front of ingestion_records
+    Safe to share between all tasks on one event loop
+    """
+    
+    def __init__(self):
+        self.config = get_ingestion_config()
+        self.ttl_seconds = self.config["cache_ttl_seconds"]
+        self._recent = ResponseCache(max_entries=self.config["cache_max_entries"])
+        self._shared_cache = None
+    
+    async def get_recent(self, source: str, external_id: str) -> Optional[Dict[str, Any]]:
+        """Stored result from the recent-result cache only; never touches the DB"""
+        key = (source, external_id)
+        
+        result = self._recent.get(key)
+        if result is None:
+            result = await self._read_shared(key)
+            if result is not None:
+                self._recent.set(key, result, self.ttl_seconds)
+        
+        return mark_duplicate(result) if result is not None else None
+    
+    async def lookup(self, source: str, external_id: str) -> Optional[Dict[str, Any]]:
+        """Stored result from the cache, falling back to ingestion_records"""
+        result = await self.get_recent(source, external_id)
+        if result is not None:
+            return result
+        
+        result = await run_in_db_session(find_ingestion_result, source, external_id)
+        if result is None:
+            return None
+        
+        await self.remember(source, external_id, result)
+        return mark_duplicate(result)
+    
+    async def remember(self, source: str, external_id: str, result: Dict[str, Any]):
+        """Cache the result of a processed event"""
+        key = (source, external_id)
+        self._recent.set(key, result, self.ttl_seconds)
+        await self._write_shared(key, result)
+    
+    async def close(self):
+        """Close the shared cache connection"""
+        if self._shared_cache is not None:
+            await self._shared_cache.close()
+            self._shared_cache = None
+    
+    async def _read_shared(self, key: tuple) -> Optional[Dict[str, Any]]:
+        cache = self._get_shared_cache()
+        if cache is None:
+            return None
+        
+        try:
+            cached = await cache.get(_shared_key(key))
+            return json.loads(cached) if cached else None
+        except Exception as e:
+            logger.warning(f"Failed to read shared ingestion result: {e}")
+            return None
+    
+    async def _write_shared(self, key: tuple, result: Dict[str, Any]):
+        cache = self._get_shared_cache()
+        if cache is None:
+            return
+        
+        try:
+            await cache.set(_shared_key(key), json.dumps(result), ex=int(self.ttl_seconds))
+        except Exception as e:
+            logger.warning(f"Failed to share ingestion result: {e}")
+    
+    def _get_shared_cache(self):
+        """Redis client for sharing recent results, or None when disabled"""
+        if not self.config["cache_url"]:
+            return None
+        
+        if self._shared_cache is None:
+            import redis.asyncio as redis
+            self._shared_cache = redis.from_url(self.config["cache_url"])
+        return self._shared_cache
+
+
+def _shared_key(key: tuple) -> str:
+    return "wasfaty_pos:ingestion:" + ":".join(key)
+
+
+# Singleton instance for global use
+ingestion_guard = IngestionGuard()
@@ -0,0 +1,65 @@
+"""
+Bucketed inventory checksums shared by reconciliation and the Wasfaty mock
+
+Each drug's stock level is hashed into one of a fixed number of buckets.
+A bucket checksum is the item count plus the sum (mod 2^64) of its item
+digests, so it can be built from a stream in any order with memory
+proportional to the bucket count, not the inventory size. Two sides that
+agree on a bucket's checksum hold the same stock for every drug in it.
+"""
+
+from typing import Dict, Iterable, List
+
+from services.sharding import stable_hash
+
+
+DIGEST_MODULUS = 2 ** 64
+
+
+def inventory_key(item: Dict) -> str:
+    """Drug key Wasfaty tracks stock under (as sent by the inventory sync)"""
+    return str(item.get("wasfaty_drug_id") or item.get("drug_id"))
+
+
+def bucket_for_key(key: str, bucket_count: int) -> int:
+    return stable_hash(f"bucket:{key}") % bucket_count
+
+
+def item_digest(key: str, current_stock: int, available_stock: int) -> int:
+    return stable_hash(f"{key}|{int(current_stock or 0)}|{int(available_stock or 0)}")
+
+
+class BucketChecksums:
+    """Order-independent running checksums over a stream of stock levels"""
+    
+    def __init__(self, bucket_count: int):
+        self.bucket_count = bucket_count
+        self._sums = [0] * bucket_count
+        self._counts = [0] * bucket_count
+    
+    def add(self, item: Dict):
+        key = inventory_key(item)
+        bucket = bucket_for_key(key, self.bucket_count)
+        digest = item_digest(key, item.get("current_stock"), item.get("available_stock"))
+        self._sums[bucket] = (self._sums[bucket] + digest) % DIGEST_MODULUS
+        self._counts[bucket] += 1
+    
+    def add_all(self, items: Iterable[Dict]):
+        for item in items:
+            self.add(item)
+    
+    def checksums(self) -> Dict[str, str]:
+        """Checksum per non-empty bucket, keyed by bucket number as a string"""
+        return {
+            str(bucket): f"{self._counts[bucket]}:{self._sums[bucket]:016x}"
+            for bucket in range(self.bucket_count)
+            if self._counts[bucket]
+        }
+
+
+def mismatched_buckets(local: Dict[str, str], remote: Dict[str, str]) -> List[int]:
+    """Buckets whose checksums differ, including buckets only one side has"""
+    return sorted(
+        int(bucket) for bucket in set(local) | set(remote)
+        if local.get(bucket) != remote.get(bucket)
+    )
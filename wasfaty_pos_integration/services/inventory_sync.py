@@ -0,0 +1,258 @@
+"""
+Incremental Inventory Sync Service
+
+This module pushes local stock changes to Wasfaty. Stock movements mark
+their inventory rows PENDING; each run picks up only those rows through
+idx_inventory_sync_status, so the whole inventory never has to be re-sent:
+- Changes are coalesced per drug: a drug with any changed batch is sent
+  once, with its stock summed over all of its batches in the pharmacy
+- Drugs are sent in bounded chunks per pharmacy, pharmacies concurrently,
+  through the request batcher, which merges concurrent pushes for the same
+  pharmacy (e.g. reconciliation corrections) into one request per window
+- After Wasfaty accepts a chunk its rows are marked synced in one UPDATE,
+  unless they changed again while the chunk was in flight
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Any
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Session
+
+from config import get_inventory_sync_config, get_outbox_config
+from database.database import run_in_db_session
+from database.models import Drug, InventoryItem, SyncStatus
+from services.sharding import shard_for_pharmacy
+from services.sync_audit import sync_log_writer
+from services.wasfaty_batcher import wasfaty_batcher
+
+
+logger = logging.getLogger(__name__)
+
+
+class InventorySyncError(Exception):
+    """Custom exception for inventory sync errors"""
+    pass
+
+
+class InventorySyncService:
+    """
+    Incremental inventory delta sync to Wasfaty
+    """
+    
+    def __init__(self):
+        config = get_inventory_sync_config()
+        self.chunk_size = config["chunk_size"]
+        self.concurrency = config["concurrency"]
+        self.shard_count = get_outbox_config()["shard_count"]
+    
+    async def sync_pending_inventory(self, shards: Optional[Iterable[int]] = None) -> Dict[str, Any]:
+        """
+        Send every pending inventory change to Wasfaty
+        
+        Args:
+            shards: Only sync pharmacies in these shards, e.g. the ones the
+                calling outbox worker owns (defaults to all pharmacies)
+                
+        Returns:
+            Dict containing drugs and rows synced and the pharmacies that failed
+        """
+        results = {
+            "pharmacies": 0,
+            "drugs_synced": 0,
+            "rows_synced": 0,
+            "failed_pharmacies": []
+        }
+        
+        try:
+            pharmacy_ids = await run_in_db_session(self._pending_pharmacies)
+        except Exception as e:
+            logger.error(f"Failed to list pending inventory changes: {e}")
+            raise InventorySyncError(f"Inventory sync failed: {e}")
+        
+        if shards is not None:
+            owned = set(shards)
+            pharmacy_ids = [
+                pharmacy_id for pharmacy_id in pharmacy_ids
+                if shard_for_pharmacy(pharmacy_id, self.shard_count) in owned
+            ]
+        
+        slots = asyncio.Semaphore(self.concurrency)
+        
+        async def sync_with_limit(pharmacy_id: str):
+            async with slots:
+                return await self._sync_pharmacy(pharmacy_id)
+        
+        outcomes = await asyncio.gather(*(sync_with_limit(pharmacy_id) for pharmacy_id in pharmacy_ids))
+        
+        for pharmacy_id, (drugs_synced, rows_synced, error) in zip(pharmacy_ids, outcomes):
+            results["pharmacies"] += 1
+            results["drugs_synced"] += drugs_synced
+            results["rows_synced"] += rows_synced
+            if error:
+                results["failed_pharmacies"].append({"pharmacy_id": pharmacy_id, "error": error})
+        
+        if results["drugs_synced"] or results["failed_pharmacies"]:
+            logger.info(
+                f"Inventory sync: {results['drugs_synced']} drugs ({results['rows_synced']} rows) "
+                f"synced for {results['pharmacies']} pharmacies, "
+                f"{len(results['failed_pharmacies'])} failed"
+            )
+        return results
+    
+    async def _sync_pharmacy(self, pharmacy_id: str) -> tuple:
+        """
+        Send one pharmacy's pending changes chunk by chunk
+        
+        Returns:
+            Tuple of (drugs synced, rows synced, error message or None)
+        """
+        drugs_synced = 0
+        rows_synced = 0
+        cursor = None
+        
+        while True:
+            chunk = await run_in_db_session(self._load_changed_chunk, pharmacy_id, cursor)
+            if not chunk["drug_updates"]:
+                return drugs_synced, rows_synced, None
+            
+            started_at = time.monotonic()
+            try:
+                response = await wasfaty_batcher.sync_inventory_update(pharmacy_id, chunk["drug_updates"])
+            except Exception as e:
+                # Rows stay pending and are picked up again by the next run
+                sync_log_writer.log(
+                    pharmacy_id=pharmacy_id,
+                    sync_type="inventory_sync",
+                    entity_type="inventory",
+                    entity_id=pharmacy_id,
+                    direction="pos_to_wasfaty",
+                    status=SyncStatus.FAILED,
+                    request_data={"updates": chunk["drug_updates"]},
+                    error_message=str(e),
+                    processing_time_ms=int((time.monotonic() - started_at) * 1000)
+                )
+                logger.error(f"Inventory sync failed for pharmacy {pharmacy_id}: {e}")
+                return drugs_synced, rows_synced, str(e)
+            
+            rows_synced += await run_in_db_session(self._mark_synced, chunk["versions"])
+            drugs_synced += len(chunk["drug_updates"])
+            
+            sync_log_writer.log(
+                pharmacy_id=pharmacy_id,
+                sync_type="inventory_sync",
+                entity_type="inventory",
+                entity_id=pharmacy_id,
+                direction="pos_to_wasfaty",
+                status=SyncStatus.COMPLETED,
+                request_data={"updates": chunk["drug_updates"]},
+                response_data=response,
+                processing_time_ms=int((time.monotonic() - started_at) * 1000)
+            )
+            
+            if len(chunk["drug_updates"]) < self.chunk_size:
+                return drugs_synced, rows_synced, None
+            cursor = chunk["cursor"]
+    
+    def _pending_pharmacies(self, db: Session) -> List[str]:
+        """Pharmacies with inventory rows waiting to be synced"""
+        return [
+            str(pharmacy_id)
+            for (pharmacy_id,) in db.query(InventoryItem.pharmacy_id).filter(
+                InventoryItem.sync_status == SyncStatus.PENDING
+            ).distinct()
+        ]
+    
+    def _load_changed_chunk(self, db: Session, pharmacy_id: str, cursor) -> Dict[str, Any]:
+        """
+        Load the next chunk of changed drugs for a pharmacy
+        
+        Returns:
+            Dict with one stock update per drug, the (id, updated_at)
+            versions of the changed rows and the keyset cursor
+        """
+        changed = [
+            InventoryItem.pharmacy_id == pharmacy_id,
+            InventoryItem.sync_status == SyncStatus.PENDING
+        ]
+        
+        drug_query = db.query(InventoryItem.drug_id).filter(*changed)
+        if cursor is not None:
+            drug_query = drug_query.filter(InventoryItem.drug_id > cursor)
+        
+        drug_ids = [
+            drug_id for (drug_id,) in
+            drug_query.distinct().order_by(InventoryItem.drug_id).limit(self.chunk_size)
+        ]
+        if not drug_ids:
+            return {"drug_updates": [], "versions": [], "cursor": cursor}
+        
+        # Every batch of the changed drugs, so totals cover unchanged batches too
+        rows = db.query(
+            InventoryItem.id,
+            InventoryItem.drug_id,
+            InventoryItem.current_stock,
+            InventoryItem.reserved_stock,
+            InventoryItem.sync_status,
+            InventoryItem.updated_at,
+            Drug.wasfaty_drug_id,
+            Drug.barcode
+        ).join(
+            Drug, Drug.id == InventoryItem.drug_id
+        ).filter(
+            InventoryItem.pharmacy_id == pharmacy_id,
+            InventoryItem.drug_id.in_(drug_ids)
+        ).all()
+        
+        drug_updates: Dict[str, Dict[str, Any]] = {}
+        versions = []
+        for row in rows:
+            update = drug_updates.setdefault(str(row.drug_id), {
+                "drug_id": str(row.drug_id),
+                "wasfaty_drug_id": row.wasfaty_drug_id,
+                "barcode": row.barcode,
+                "current_stock": 0,
+                "available_stock": 0,
+                "updated_at": None
+            })
+            update["current_stock"] += row.current_stock or 0
+            update["available_stock"] += (row.current_stock or 0) - (row.reserved_stock or 0)
+            if row.updated_at and (update["updated_at"] is None or row.updated_at > update["updated_at"]):
+                update["updated_at"] = row.updated_at
+            
+            if row.sync_status == SyncStatus.PENDING:
+                versions.append((row.id, row.updated_at))
+        
+        for update in drug_updates.values():
+            if update["updated_at"]:
+                update["updated_at"] = update["updated_at"].isoformat()
+        
+        return {
+            "drug_updates": list(drug_updates.values()),
+            "versions": versions,
+            "cursor": drug_ids[-1]
+        }
+    
+    def _mark_synced(self, db: Session, versions: List[tuple]) -> int:
+        """
+        Mark sent rows synced in one UPDATE
+        
+        Rows are matched on (id, updated_at), so a row changed again after
+        it was read stays pending for the next run. Only values read back
+        from the row are compared, never clocks of different hosts.
+        
+        Returns:
+            Number of rows marked synced
+        """
+        if not versions:
+            return 0
+        
+        return db.query(InventoryItem).filter(
+            tuple_(InventoryItem.id, InventoryItem.updated_at).in_(versions)
+        ).update({
+            InventoryItem.sync_status: SyncStatus.COMPLETED,
+            InventoryItem.last_sync_at: datetime.utcnow(),
+            InventoryItem.updated_at: InventoryItem.updated_at  # Not a stock change
+        }, synchronize_session=False)
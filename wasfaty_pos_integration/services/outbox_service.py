@@ -0,0 +1,68 @@
+"""
+Sync Outbox Service
+
+This module writes sync jobs into the transactional outbox. Jobs are added
+to the caller's database session so they commit (or roll back) together
+with the business data that produced them. The outbox worker in
+services/outbox_worker.py consumes them.
+"""
+
+import logging
+from datetime import datetime
+from typing import Dict, Optional, Any
+from sqlalchemy.orm import Session
+
+from config import get_outbox_config
+from database.models import SyncJob, OutboxStatus
+from services.sharding import shard_for_pharmacy
+
+
+logger = logging.getLogger(__name__)
+
+
+def build_idempotency_key(job_type: str, entity_id: str) -> str:
+    """Build the default idempotency key for a sync job"""
+    return f"{job_type}:{entity_id}"
+
+
+def enqueue_sync_job(
+    db: Session,
+    job_type: str,
+    pharmacy_id: str,
+    entity_id: str,
+    payload: Dict[str, Any],
+    idempotency_key: Optional[str] = None
+) -> SyncJob:
+    """
+    Add a sync job to the outbox within the caller's transaction
+    
+    Args:
+        db: Session holding the business transaction
+        job_type: Job type handled by the outbox worker
+        pharmacy_id: Pharmacy identifier
+        entity_id: ID of the entity to sync
+        payload: Data the worker needs to replay the sync
+        idempotency_key: Optional explicit key, defaults to job type and entity ID
+        
+    Returns:
+        The pending SyncJob (flushed, not committed)
+    """
+    config = get_outbox_config()
+    job = SyncJob(
+        pharmacy_id=pharmacy_id,
+        shard=shard_for_pharmacy(pharmacy_id, config["shard_count"]),
+        job_type=job_type,
+        entity_id=str(entity_id),
+        idempotency_key=idempotency_key or build_idempotency_key(job_type, str(entity_id)),
+        payload=payload,
+        status=OutboxStatus.PENDING,
+        attempts=0,
+        max_attempts=config["max_attempts"],
+        next_attempt_at=datetime.utcnow()
+    )
+    
+    db.add(job)
+    db.flush()
+    
+    logger.debug(f"Enqueued {job_type} job for {entity_id}")
+    return job
@@ -0,0 +1,638 @@
+"""
+Sync Outbox Worker
+
+This module consumes sync jobs from the transactional outbox and runs them
+against Wasfaty. It is meant to run as its own process:
+
+    python -m services.outbox_worker
+
+Work is sharded by pharmacy. Each job carries the logical shard of its
+pharmacy, and workers heartbeat into sync_workers and split the shards
+between themselves on a consistent hash ring, so adding workers adds
+throughput and a worker joining or leaving only moves its neighbours'
+shards. A worker claims only from its own shards, caps the jobs in flight
+per shard and ranks candidates round-robin across pharmacies, so one busy
+branch cannot starve the others. Jobs are still claimed with
+SELECT ... FOR UPDATE SKIP LOCKED, so the brief overlap while shards
+move between workers is harmless. Failures are retried with exponential backoff and
+full jitter; jobs that exhaust their attempts move to the dead-letter state.
+Jobs left in progress by a crashed worker are reclaimed after the
+visibility timeout. While Wasfaty's circuit breaker is open, jobs are
+parked until it half-opens without spending an attempt.
+
+With sync_task_backend set to "celery" the worker still claims jobs but
+dispatches them to per-type Celery queues (services.sync_tasks) instead
+of running them, and queues its inventory sync the same way, so sync
+capacity scales with Celery worker nodes. Dispatched jobs stay in progress,
+and count against the in-flight limits, until their task records the
+outcome.
+
+Between polls the worker also runs periodic maintenance. Global
+housekeeping (rolling sync logs up into hourly report summaries, managing
+sync_logs partitions, sweeping expired prescriptions and near-expiry
+stock) runs only on the maintenance leader, the worker owning the
+"maintenance" key on the hash ring. Every worker pushes pending inventory
+changes and reconciles inventory with Wasfaty for its own shards'
+pharmacies.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import signal
+import socket
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Any
+from sqlalchemy import case, func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from config import (
+    get_celery_config, get_expiry_config, get_inventory_sync_config, get_outbox_config,
+    get_reconciliation_config, get_sync_config, get_sync_log_config
+)
+from database.database import run_in_db_session, shutdown_db_executor
+from database.partitions import maintain_sync_log_partitions
+from database.models import SyncJob, SyncWorker, OutboxStatus, Transaction, SyncStatus
+from services.expiry_service import ExpiryService
+from services.inventory_sync import InventorySyncService
+from services.pos_service import POSService
+from services.reconciliation_service import ReconciliationService
+from services.sharding import HashRing
+from services.sync_service import SyncService
+from services.wasfaty_client import wasfaty_client, WasfatyCircuitOpenError
+from services.wasfaty_batcher import wasfaty_batcher
+from services.sync_audit import sync_log_writer
+
+
+logger = logging.getLogger(__name__)
+
+# Wasfaty endpoint group (circuit breaker) each job type depends on
+JOB_ENDPOINT_GROUPS = {
+    "pos_sale_sync": "transactions",
+    "wasfaty_dispense_sync": "prescriptions"
+}
+
+# Hash ring key whose owner runs global maintenance
+MAINTENANCE_RING_KEY = "maintenance"
+
+
+class OutboxWorkerError(Exception):
+    """Custom exception for outbox worker errors"""
+    pass
+
+
+class OutboxWorker:
+    """
+    Outbox consumer for POS and Wasfaty sync jobs
+    Claims due jobs from its shards and runs them concurrently
+    """
+    
+    def __init__(self, worker_id: Optional[str] = None):
+        config = get_outbox_config()
+        self.batch_size = config["batch_size"]
+        self.poll_interval_seconds = config["poll_interval_seconds"]
+        self.backoff_base_seconds = config["backoff_base_seconds"]
+        self.backoff_max_seconds = config["backoff_max_seconds"]
+        self.visibility_timeout_seconds = config["visibility_timeout_seconds"]
+        self.max_in_flight = config["max_in_flight"]
+        self.shard_count = config["shard_count"]
+        self.max_in_flight_per_shard = config["max_in_flight_per_shard"]
+        self.virtual_nodes = config["virtual_nodes"]
+        self.heartbeat_interval_seconds = config["heartbeat_interval_seconds"]
+        self.membership_ttl_seconds = config["membership_ttl_seconds"]
+        self.dispatch_to_celery = config["task_backend"] == "celery" and not get_celery_config()["always_eager"]
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.rollup_interval_seconds = get_sync_config()["rollup_interval_seconds"]
+        self.partition_maintenance_interval_seconds = get_sync_log_config()["maintenance_interval_seconds"]
+        self.expiry_sweep_interval_seconds = get_expiry_config()["sweep_interval_seconds"]
+        self.inventory_sync_interval_seconds = get_inventory_sync_config()["interval_seconds"]
+        self.reconcile_interval_seconds = get_reconciliation_config()["interval_seconds"]
+        
+        self.pos_service = POSService()
+        self.sync_service = SyncService()
+        self.expiry_service = ExpiryService()
+        self.inventory_sync_service = InventorySyncService()
+        self.reconciliation_service = ReconciliationService()
+        
+        self.handlers = {
+            "pos_sale_sync": self._handle_pos_sale_sync,
+            "wasfaty_dispense_sync": self._handle_wasfaty_dispense_sync
+        }
+        
+        self.sync_tasks = None
+        if self.dispatch_to_celery:
+            # Celery is only needed when jobs are dispatched to it
+            from services import sync_tasks
+            self.sync_tasks = sync_tasks
+        
+        self.owned_shards: List[int] = []
+        self.is_maintenance_leader = False
+        self._in_flight: Dict[asyncio.Task, int] = {}  # Running job task -> shard
+        self._shard_load: Dict[int, int] = {}
+        
+        self._running = False
+        self._next_heartbeat_at = 0.0
+        self._next_rollup_at = 0.0
+        self._next_partition_maintenance_at = 0.0
+        self._next_expiry_sweep_at = 0.0
+        self._next_inventory_sync_at = 0.0
+        self._next_reconcile_at = 0.0
+    
+    async def run_forever(self):
+        """Poll the outbox until stop() is called"""
+        
+        self._running = True
+        logger.info(f"Outbox worker {self.worker_id} started")
+        
+        while self._running:
+            try:
+                await self._maintain_membership()
+                claimed = await self.run_once()
+            except Exception as e:
+                logger.error(f"Outbox poll failed: {e}")
+                claimed = 0
+            
+            try:
+                await self._run_maintenance()
+            except Exception as e:
+                logger.error(f"Outbox maintenance failed: {e}")
+            
+            if not claimed:
+                await self._wait_for_capacity()
+        
+        await self.drain()
+        try:
+            await run_in_db_session(self._leave)
+        except Exception as e:
+            logger.warning(f"Failed to deregister worker {self.worker_id}: {e}")
+        
+        logger.info(f"Outbox worker {self.worker_id} stopped")
+    
+    def stop(self):
+        """Stop claiming; jobs already running are allowed to finish"""
+        self._running = False
+    
+    async def run_once(self) -> int:
+        """
+        Claim due jobs from this worker's shards and start them
+        
+        Only shards below their in-flight limit are claimed from, and never
+        more than the worker's free capacity. Jobs dispatched to Celery keep
+        counting against both until their task releases the lease, so a
+        slow queue stops further claims instead of growing without bound.
+        
+        Returns:
+            Number of jobs claimed
+        """
+        await run_in_db_session(self._reclaim_stale_jobs)
+        
+        shard_load = self._shard_load
+        if self.dispatch_to_celery:
+            shard_load = await run_in_db_session(self._count_leased_jobs)
+        
+        shard_capacity = {}
+        for shard in self.owned_shards:
+            capacity = self.max_in_flight_per_shard - shard_load.get(shard, 0)
+            if capacity > 0:
+                shard_capacity[shard] = capacity
+        
+        limit = min(self.batch_size, self.max_in_flight - sum(shard_load.values()))
+        if not shard_capacity or limit <= 0:
+            return 0
+        
+        jobs = await run_in_db_session(self._claim_due_jobs, shard_capacity, limit)
+        if self.dispatch_to_celery:
+            await self._dispatch_jobs(jobs)
+        else:
+            for job in jobs:
+                self._start_job(job)
+        
+        return len(jobs)
+    
+    async def _dispatch_jobs(self, jobs: List[Dict[str, Any]]):
+        """Hand claimed jobs to their Celery queues"""
+        
+        loop = asyncio.get_running_loop()
+        for job in jobs:
+            if job["job_type"] not in self.sync_tasks.JOB_TASKS:
+                # Runs locally, where it is recorded as a failure
+                self._start_job(job)
+                continue
+            
+            try:
+                # Publishing is blocking broker I/O
+                await loop.run_in_executor(None, self.sync_tasks.dispatch_sync_job, job)
+            except Exception as e:
+                # Undispatched jobs go straight back without spending an attempt
+                logger.error(f"Failed to dispatch outbox job {job['id']} to Celery: {e}")
+                await run_in_db_session(self._park, job, self.poll_interval_seconds)
+    
+    async def drain(self):
+        """Wait for every running job to finish"""
+        if self._in_flight:
+            await asyncio.wait(list(self._in_flight))
+    
+    def _start_job(self, job: Dict[str, Any]):
+        task = asyncio.create_task(self._run_job(job))
+        self._in_flight[task] = job["shard"]
+        self._shard_load[job["shard"]] = self._shard_load.get(job["shard"], 0) + 1
+        task.add_done_callback(self._job_finished)
+    
+    def _job_finished(self, task: asyncio.Task):
+        shard = self._in_flight.pop(task)
+        self._shard_load[shard] -= 1
+        if not self._shard_load[shard]:
+            del self._shard_load[shard]
+        
+        if not task.cancelled() and task.exception():
+            logger.error(f"Outbox job task failed: {task.exception()}")
+    
+    async def _wait_for_capacity(self):
+        """Sleep until the poll interval passes or a running job finishes"""
+        if self._in_flight:
+            await asyncio.wait(
+                list(self._in_flight),
+                timeout=self.poll_interval_seconds,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+        else:
+            await asyncio.sleep(self.poll_interval_seconds)
+    
+    async def _maintain_membership(self):
+        """Heartbeat and recompute owned shards and maintenance leadership"""
+        
+        now = time.monotonic()
+        if now < self._next_heartbeat_at:
+            return
+        self._next_heartbeat_at = now + self.heartbeat_interval_seconds
+        
+        members = await run_in_db_session(self._heartbeat)
+        if self.worker_id not in members:
+            members.append(self.worker_id)
+        
+        ring = HashRing(members, self.virtual_nodes)
+        is_leader = ring.owner(MAINTENANCE_RING_KEY) == self.worker_id
+        if is_leader != self.is_maintenance_leader:
+            logger.info(f"Worker {self.worker_id} {'took over' if is_leader else 'handed off'} global maintenance")
+            self.is_maintenance_leader = is_leader
+        
+        owned = ring.shards_for(self.worker_id, self.shard_count)
+        if owned != self.owned_shards:
+            logger.info(
+                f"Worker {self.worker_id} owns {len(owned)} of {self.shard_count} shards "
+                f"({len(members)} live workers)"
+            )
+            self.owned_shards = owned
+    
+    def _heartbeat(self, db: Session) -> List[str]:
+        """
+        Record this worker as alive and forget workers that went silent
+        
+        Returns:
+            IDs of the live workers
+        """
+        now = datetime.utcnow()
+        
+        db.execute(
+            insert(SyncWorker).values(
+                worker_id=self.worker_id,
+                started_at=now,
+                heartbeat_at=now,
+                owned_shards=len(self.owned_shards)
+            ).on_conflict_do_update(
+                index_elements=[SyncWorker.worker_id],
+                set_={"heartbeat_at": now, "owned_shards": len(self.owned_shards)}
+            )
+        )
+        
+        db.query(SyncWorker).filter(
+            SyncWorker.heartbeat_at < now - timedelta(seconds=self.membership_ttl_seconds)
+        ).delete(synchronize_session=False)
+        
+        return [worker_id for (worker_id,) in db.query(SyncWorker.worker_id)]
+    
+    def _leave(self, db: Session):
+        """Deregister so the remaining workers take over this worker's shards"""
+        db.query(SyncWorker).filter(
+            SyncWorker.worker_id == self.worker_id
+        ).delete(synchronize_session=False)
+    
+    async def _run_maintenance(self):
+        """Run periodic housekeeping that is due"""
+        
+        now = time.monotonic()
+        if self.is_maintenance_leader:
+            await self._run_global_maintenance(now)
+        
+        if now >= self._next_inventory_sync_at and self.owned_shards:
+            self._next_inventory_sync_at = now + self.inventory_sync_interval_seconds
+            try:
+                if self.dispatch_to_celery:
+                    await asyncio.get_running_loop().run_in_executor(
+                        None,
+                        self.sync_tasks.dispatch_inventory_sync,
+                        self.owned_shards,
+                        self.inventory_sync_interval_seconds
+                    )
+                else:
+                    await self.inventory_sync_service.sync_pending_inventory(shards=self.owned_shards)
+            except Exception as e:
+                logger.error(f"Inventory sync failed: {e}")
+        
+        if now >= self._next_reconcile_at and self.owned_shards:
+            self._next_reconcile_at = now + self.reconcile_interval_seconds
+            try:
+                await self.reconciliation_service.reconcile_inventory(shards=self.owned_shards)
+            except Exception as e:
+                logger.error(f"Inventory reconciliation failed: {e}")
+    
+    async def _run_global_maintenance(self, now: float):
+        """
+        Housekeeping that covers every pharmacy, run by the maintenance leader only
+        
+        Leadership can briefly overlap while workers join or leave; the
+        rollup and partition maintenance take advisory locks for that.
+        """
+        if now >= self._next_rollup_at:
+            self._next_rollup_at = now + self.rollup_interval_seconds
+            await self.sync_service.roll_up_sync_logs()
+        
+        if now >= self._next_partition_maintenance_at:
+            self._next_partition_maintenance_at = now + self.partition_maintenance_interval_seconds
+            try:
+                await run_in_db_session(maintain_sync_log_partitions)
+            except Exception as e:
+                logger.error(f"Sync log partition maintenance failed: {e}")
+        
+        if now >= self._next_expiry_sweep_at:
+            self._next_expiry_sweep_at = now + self.expiry_sweep_interval_seconds
+            await self.expiry_service.sweep()
+    
+    def _reclaim_stale_jobs(self, db: Session):
+        """Return jobs abandoned by crashed workers to the pending state"""
+        
+        stale_before = datetime.utcnow() - timedelta(seconds=self.visibility_timeout_seconds)
+        
+        reclaimed = db.query(SyncJob).filter(
+            SyncJob.status == OutboxStatus.IN_PROGRESS,
+            SyncJob.locked_at < stale_before
+        ).update({
+            SyncJob.status: OutboxStatus.PENDING,
+            SyncJob.locked_at: None,
+            SyncJob.locked_by: None
+        }, synchronize_session=False)
+        
+        if reclaimed:
+            logger.warning(f"Reclaimed {reclaimed} stale outbox jobs")
+    
+    def _count_leased_jobs(self, db: Session) -> Dict[int, int]:
+        """Jobs in progress per owned shard, including those waiting in a Celery queue"""
+        
+        if not self.owned_shards:
+            return {}
+        
+        return dict(
+            db.query(SyncJob.shard, func.count(SyncJob.id)).filter(
+                SyncJob.status == OutboxStatus.IN_PROGRESS,
+                SyncJob.shard.in_(self.owned_shards)
+            ).group_by(SyncJob.shard).all()
+        )
+    
+    def _claim_due_jobs(
+        self,
+        db: Session,
+        shard_capacity: Dict[int, int],
+        limit: int
+    ) -> List[Dict[str, Any]]:
+        """
+        Lock due jobs from the given shards and mark them in progress
+        
+        Candidates are ranked per pharmacy first and per shard second, so a
+        claim takes the oldest job of every waiting pharmacy before the
+        second job of any of them, and at most shard_capacity[shard] jobs
+        from each shard.
+        
+        Args:
+            db: Database session
+            shard_capacity: Free in-flight slots per owned shard
+            limit: Maximum number of jobs to claim
+            
+        Returns:
+            Claimed jobs as plain dicts
+        """
+        now = datetime.utcnow()
+        
+        due = select(
+            SyncJob.id,
+            SyncJob.shard,
+            SyncJob.next_attempt_at,
+            func.row_number().over(
+                partition_by=SyncJob.pharmacy_id,
+                order_by=SyncJob.next_attempt_at
+            ).label("pharmacy_rank")
+        ).where(
+            SyncJob.status == OutboxStatus.PENDING,
+            SyncJob.next_attempt_at <= now,
+            SyncJob.shard.in_(list(shard_capacity))
+        ).subquery("due")
+        
+        ranked = select(
+            due.c.id,
+            due.c.shard,
+            due.c.pharmacy_rank,
+            func.row_number().over(
+                partition_by=due.c.shard,
+                order_by=(due.c.pharmacy_rank, due.c.next_attempt_at)
+            ).label("shard_rank")
+        ).subquery("ranked")
+        
+        candidate_ids = select(ranked.c.id).where(
+            ranked.c.shard_rank <= case(shard_capacity, value=ranked.c.shard, else_=0)
+        ).order_by(
+            ranked.c.shard_rank, ranked.c.pharmacy_rank
+        ).limit(limit)
+        
+        # Row locks cannot be taken alongside window functions, so lock in a second step
+        jobs = db.query(SyncJob).filter(
+            SyncJob.id.in_(candidate_ids.scalar_subquery()),
+            SyncJob.status == OutboxStatus.PENDING
+        ).with_for_update(skip_locked=True).all()
+        
+        claimed = []
+        for job in jobs:
+            job.status = OutboxStatus.IN_PROGRESS
+            job.locked_at = now
+            job.locked_by = self.worker_id
+            
+            # Detach plain values, the session closes before the job runs
+            claimed.append({
+                "id": job.id,
+                "job_type": job.job_type,
+                "pharmacy_id": str(job.pharmacy_id) if job.pharmacy_id else None,
+                "shard": job.shard or 0,
+                "entity_id": job.entity_id,
+                "idempotency_key": job.idempotency_key,
+                "payload": job.payload or {},
+                "attempts": job.attempts or 0,
+                "max_attempts": job.max_attempts,
+                "locked_at": now.isoformat(),
+                "locked_by": self.worker_id
+            })
+        
+        return claimed
+    
+    async def _run_job(self, job: Dict[str, Any]):
+        """Run a claimed job and record the outcome"""
+        
+        try:
+            handler = self.handlers.get(job["job_type"])
+            if handler is None:
+                raise OutboxWorkerError(f"No handler for job type {job['job_type']}")
+            
+            endpoint_group = JOB_ENDPOINT_GROUPS.get(job["job_type"])
+            if endpoint_group and wasfaty_client.is_circuit_open(endpoint_group):
+                raise WasfatyCircuitOpenError(
+                    f"Circuit open for Wasfaty {endpoint_group} endpoints",
+                    retry_after=wasfaty_client.circuit_retry_after(endpoint_group)
+                )
+            
+            await handler(job)
+        
+        except WasfatyCircuitOpenError as e:
+            await run_in_db_session(self._park, job, e.retry_after)
+        
+        except Exception as e:
+            logger.error(f"Outbox job {job['id']} ({job['job_type']}) failed: {e}")
+            await run_in_db_session(self._record_failure, job, e)
+        
+        else:
+            await run_in_db_session(self._record_success, job)
+    
+    def _record_success(self, db: Session, job: Dict[str, Any]):
+        """Mark a job completed"""
+        
+        db.query(SyncJob).filter(SyncJob.id == job["id"]).update({
+            SyncJob.status: OutboxStatus.COMPLETED,
+            SyncJob.attempts: job["attempts"] + 1,
+            SyncJob.completed_at: datetime.utcnow(),
+            SyncJob.locked_at: None,
+            SyncJob.locked_by: None,
+            SyncJob.last_error: None
+        }, synchronize_session=False)
+    
+    def _park(self, db: Session, job: Dict[str, Any], retry_after: float):
+        """Put a job back until the circuit lets calls through again"""
+        
+        db.query(SyncJob).filter(SyncJob.id == job["id"]).update({
+            SyncJob.status: OutboxStatus.PENDING,
+            SyncJob.next_attempt_at: datetime.utcnow() + timedelta(seconds=max(retry_after, 1.0)),
+            SyncJob.locked_at: None,
+            SyncJob.locked_by: None
+        }, synchronize_session=False)
+    
+    def _record_failure(self, db: Session, job: Dict[str, Any], error: Exception):
+        """Schedule a retry with backoff, or dead-letter the job"""
+        
+        attempts = job["attempts"] + 1
+        values = {
+            SyncJob.attempts: attempts,
+            SyncJob.last_error: str(error),
+            SyncJob.locked_at: None,
+            SyncJob.locked_by: None
+        }
+        
+        if attempts >= job["max_attempts"]:
+            values[SyncJob.status] = OutboxStatus.DEAD_LETTER
+            logger.error(f"Outbox job {job['id']} moved to dead letter after {attempts} attempts")
+        else:
+            values[SyncJob.status] = OutboxStatus.PENDING
+            values[SyncJob.next_attempt_at] = datetime.utcnow() + timedelta(
+                seconds=self._backoff_delay(attempts)
+            )
+        
+        db.query(SyncJob).filter(SyncJob.id == job["id"]).update(
+            values, synchronize_session=False
+        )
+    
+    def _backoff_delay(self, attempts: int) -> float:
+        """Exponential backoff with full jitter"""
+        ceiling = min(
+            self.backoff_max_seconds,
+            self.backoff_base_seconds * (2 ** attempts)
+        )
+        return random.uniform(0, ceiling)
+    
+    def _is_transaction_synced(self, db: Session, transaction_id: str) -> bool:
+        """Check whether a transaction was already synced by an earlier attempt"""
+        
+        sync_status = db.query(Transaction.sync_status).filter(
+            Transaction.id == transaction_id
+        ).scalar()
+        
+        return sync_status == SyncStatus.COMPLETED
+    
+    # Job Handlers
+    
+    async def _handle_pos_sale_sync(self, job: Dict[str, Any]):
+        """Report a POS sale to Wasfaty"""
+        
+        transaction_id = job["payload"].get("transaction_id", job["entity_id"])
+        if await run_in_db_session(self._is_transaction_synced, transaction_id):
+            return
+        
+        synced = await self.pos_service._sync_pos_sale_with_wasfaty(
+            job["pharmacy_id"],
+            transaction_id,
+            job["payload"].get("sale_data", {}),
+            idempotency_key=job["idempotency_key"]
+        )
+        
+        if not synced:
+            raise OutboxWorkerError(f"POS sale sync failed for transaction {transaction_id}")
+    
+    async def _handle_wasfaty_dispense_sync(self, job: Dict[str, Any]):
+        """Mark a prescription dispensed in Wasfaty"""
+        
+        sync_request = await run_in_db_session(
+            self.sync_service._load_sync_request, job["entity_id"]
+        )
+        
+        if not sync_request:
+            raise OutboxWorkerError(f"Transaction {job['entity_id']} not found")
+        
+        if sync_request["sync_status"] == SyncStatus.COMPLETED:
+            return
+        
+        await self.sync_service._retry_wasfaty_dispense_sync(
+            sync_request, idempotency_key=job["idempotency_key"]
+        )
+
+
+def main():
+    """Run the outbox worker until SIGINT or SIGTERM"""
+    
+    logging.basicConfig(level=logging.INFO)
+    worker = OutboxWorker()
+    
+    async def run():
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, worker.stop)
+        
+        await wasfaty_client.start()
+        try:
+            await worker.run_forever()
+        finally:
+            await wasfaty_batcher.flush()
+            await wasfaty_client.close()
+            await sync_log_writer.flush()
+            shutdown_db_executor()
+    
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
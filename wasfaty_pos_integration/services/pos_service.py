@@ -6,19 +6,31 @@ It provides a unified interface for different POS vendors and handles
 real-time inventory synchronization.
 """
 
-import asyncio
 import logging
+import time
 from datetime import datetime
 from typing import Dict, List, Optional, Any
+from sqlalchemy.exc import DataError
 from sqlalchemy.orm import Session
 
-from database.database import get_db_session
+from database.database import run_in_db_session, run_in_read_session
 from database.models import (
     Transaction, TransactionItem, InventoryItem, Drug, 
-    Pharmacy, SyncLog, TransactionStatus, SyncStatus
+    Pharmacy, TransactionStatus, SyncStatus
 )
-from services.wasfaty_client import wasfaty_client
+from services.wasfaty_client import WasfatyCircuitOpenError
+from services.wasfaty_batcher import wasfaty_batcher
 from services.sync_service import SyncService
+from services.outbox_service import enqueue_sync_job, build_idempotency_key
+from services.sync_audit import sync_log_writer
+from services.transaction_numbers import generate_transaction_number
+from services.query_builders import (
+    transaction_graph_query, load_inventory_by_drug, resolve_pos_item_drugs
+)
+from services.ingestion_guard import (
+    ingestion_guard, claim_ingestion, complete_ingestion, pos_sale_external_id,
+    POS_SALE_SOURCE
+)
 
 
 logger = logging.getLogger(__name__)
@@ -29,6 +41,11 @@ class POSIntegrationError(Exception):
     pass
 
 
+class POSValidationError(POSIntegrationError):
+    """Raised when sale data is malformed, so retrying it cannot succeed"""
+    pass
+
+
 class POSService:
     """
     POS System Integration Service
@@ -46,47 +63,105 @@ class POSService:
         """
         Process a sale from POS system and sync with Wasfaty
         
+        The Wasfaty sync is written to the outbox in the same DB transaction
+        as the sale, so the till returns immediately and the sync survives
+        restarts. The outbox worker performs the actual API call.
+        
+        Sales carrying a pos_transaction_id are processed once; retries of
+        the same sale get the original result back, flagged as duplicate.
+        
         Args:
             pharmacy_id: Pharmacy identifier
             sale_data: Sale transaction data from POS
             
         Returns:
             Dict containing processing result and sync status
+            
+        Raises:
+            POSValidationError: If the sale data is malformed
+            POSIntegrationError: If the sale could not be recorded right now
         """
+        pos_transaction_id = sale_data.get('pos_transaction_id')
+        external_id = (
+            pos_sale_external_id(pharmacy_id, pos_transaction_id) if pos_transaction_id else None
+        )
+        
         try:
-            with get_db_session() as db:
-                # Create transaction record
-                transaction = await self._create_transaction_record(
-                    db, pharmacy_id, sale_data
-                )
-                
-                # Update local inventory
-                inventory_updates = await self._update_local_inventory(
-                    db, pharmacy_id, sale_data['items']
-                )
-                
-                # Sync with Wasfaty asynchronously
-                sync_task = asyncio.create_task(
-                    self._sync_pos_sale_with_wasfaty(
-                        pharmacy_id, transaction.id, sale_data
-                    )
-                )
-                
-                logger.info(f"Processed POS sale {transaction.transaction_number}")
-                
-                return {
-                    "success": True,
-                    "transaction_id": str(transaction.id),
-                    "transaction_number": transaction.transaction_number,
-                    "inventory_updates": len(inventory_updates),
-                    "sync_initiated": True
-                }
+            if external_id:
+                replay = await ingestion_guard.get_recent(POS_SALE_SOURCE, external_id)
+                if replay:
+                    return replay
+            
+            result = await run_in_db_session(
+                self._record_pos_sale, pharmacy_id, sale_data, external_id
+            )
+            
+            if external_id:
+                await ingestion_guard.remember(POS_SALE_SOURCE, external_id, result)
+            
+            return result
                 
         except Exception as e:
             logger.error(f"Failed to process POS sale: {e}")
+            if isinstance(e, (AttributeError, KeyError, TypeError, ValueError, DataError)):
+                # Malformed sale data; sending it again cannot succeed
+                raise POSValidationError(f"Invalid POS sale: {e}")
             raise POSIntegrationError(f"POS sale processing failed: {e}")
     
-    async def _create_transaction_record(
+    def _record_pos_sale(
+        self, 
+        db: Session, 
+        pharmacy_id: str, 
+        sale_data: Dict,
+        external_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Write the sale, inventory changes and outbox job in one DB transaction"""
+        
+        if external_id:
+            stored_result = claim_ingestion(db, POS_SALE_SOURCE, external_id, pharmacy_id)
+            if stored_result is not None:
+                logger.info(f"Ignoring duplicate POS sale {external_id}")
+                return {**stored_result, "duplicate": True}
+        
+        # Create transaction record
+        transaction = self._create_transaction_record(
+            db, pharmacy_id, sale_data
+        )
+        
+        # Update local inventory
+        inventory_updates = self._update_local_inventory(
+            db, pharmacy_id, sale_data['items']
+        )
+        
+        # Queue the Wasfaty sync in the same DB transaction
+        enqueue_sync_job(
+            db,
+            job_type="pos_sale_sync",
+            pharmacy_id=pharmacy_id,
+            entity_id=str(transaction.id),
+            payload={
+                "transaction_id": str(transaction.id),
+                "sale_data": {"items": sale_data.get('items', [])}
+            }
+        )
+        
+        logger.info(f"Processed POS sale {transaction.transaction_number}")
+        
+        result = {
+            "success": True,
+            "transaction_id": str(transaction.id),
+            "pharmacy_id": str(transaction.pharmacy_id),
+            "transaction_number": transaction.transaction_number,
+            "inventory_updates": len(inventory_updates),
+            "sync_initiated": True
+        }
+        
+        if external_id:
+            complete_ingestion(db, POS_SALE_SOURCE, external_id, result)
+        
+        return result
+    
+    def _create_transaction_record(
         self, 
         db: Session, 
         pharmacy_id: str, 
@@ -95,7 +170,7 @@ class POSService:
         """Create transaction record in database"""
         
         # Generate transaction number
-        transaction_number = self._generate_transaction_number(pharmacy_id)
+        transaction_number = self._generate_transaction_number(db, pharmacy_id)
         
         # Create main transaction
         transaction = Transaction(
@@ -119,14 +194,12 @@ class POSService:
         db.add(transaction)
         db.flush()  # Get the ID
         
+        # Find drugs by barcode or SKU in one query
+        items = sale_data.get('items', [])
+        drugs = resolve_pos_item_drugs(db, items)
+        
         # Create transaction items
-        for item_data in sale_data.get('items', []):
-            # Find drug by barcode or SKU
-            drug = db.query(Drug).filter(
-                (Drug.barcode == item_data.get('barcode')) |
-                (Drug.pos_drug_id == item_data.get('drug_id'))
-            ).first()
-            
+        for item_data, drug in zip(items, drugs):
             if not drug:
                 logger.warning(f"Drug not found for barcode/ID: {item_data.get('barcode', item_data.get('drug_id'))}")
                 continue
@@ -143,10 +216,10 @@ class POSService:
             
             db.add(transaction_item)
         
-        db.commit()
+        db.flush()  # Committed with the rest of the sale
         return transaction
     
-    async def _update_local_inventory(
+    def _update_local_inventory(
         self, 
         db: Session, 
         pharmacy_id: str, 
@@ -156,21 +229,18 @@ class POSService:
         
         inventory_updates = []
         
-        for item_data in items:
-            # Find drug
-            drug = db.query(Drug).filter(
-                (Drug.barcode == item_data.get('barcode')) |
-                (Drug.pos_drug_id == item_data.get('drug_id'))
-            ).first()
-            
+        # Find drugs and their inventory rows in two queries
+        drugs = resolve_pos_item_drugs(db, items)
+        inventory_by_drug = load_inventory_by_drug(
+            db, pharmacy_id, (drug.id for drug in drugs if drug)
+        )
+        
+        for item_data, drug in zip(items, drugs):
             if not drug:
                 continue
             
             # Find inventory item
-            inventory_item = db.query(InventoryItem).filter(
-                InventoryItem.pharmacy_id == pharmacy_id,
-                InventoryItem.drug_id == drug.id
-            ).first()
+            inventory_item = inventory_by_drug.get(drug.id)
             
             if inventory_item:
                 # Update stock
@@ -190,16 +260,28 @@ class POSService:
                 
                 logger.info(f"Updated inventory for {drug.name}: {old_stock} -> {inventory_item.current_stock}")
         
-        db.commit()
+        db.flush()  # Committed with the rest of the sale
         return inventory_updates
     
     async def _sync_pos_sale_with_wasfaty(
         self, 
         pharmacy_id: str, 
         transaction_id: str, 
-        sale_data: Dict
-    ):
-        """Sync POS sale with Wasfaty system asynchronously"""
+        sale_data: Dict,
+        idempotency_key: Optional[str] = None
+    ) -> bool:
+        """
+        Sync POS sale with Wasfaty system
+        
+        Returns:
+            True if Wasfaty accepted the sale, False if the sync failed
+            
+        Raises:
+            WasfatyCircuitOpenError: Wasfaty is down; the sale stays pending
+        """
+        
+        started_at = time.perf_counter()
+        wasfaty_data = None
         
         try:
             # Prepare data for Wasfaty
@@ -212,81 +294,100 @@ class POSService:
             }
             
             # Convert items to Wasfaty format
-            with get_db_session() as db:
-                for item_data in sale_data.get('items', []):
-                    drug = db.query(Drug).filter(
-                        (Drug.barcode == item_data.get('barcode')) |
-                        (Drug.pos_drug_id == item_data.get('drug_id'))
-                    ).first()
-                    
-                    if drug and drug.wasfaty_drug_id:
-                        wasfaty_data["items"].append({
-                            "wasfaty_drug_id": drug.wasfaty_drug_id,
-                            "quantity_sold": item_data['quantity'],
-                            "unit_price": item_data['unit_price'],
-                            "batch_number": item_data.get('batch_number')
-                        })
+            wasfaty_data["items"] = await run_in_db_session(
+                self._build_wasfaty_items, sale_data
+            )
             
-            # Send to Wasfaty
-            async with wasfaty_client as client:
-                response = await client.report_pos_transaction(wasfaty_data)
+            # Send to Wasfaty, batched with other concurrent reports
+            response = await wasfaty_batcher.report_pos_transaction(
+                wasfaty_data,
+                idempotency_key=idempotency_key or build_idempotency_key(
+                    "pos_sale_sync", str(transaction_id)
+                )
+            )
             
             # Update sync status
-            with get_db_session() as db:
-                transaction = db.query(Transaction).filter(
-                    Transaction.id == transaction_id
-                ).first()
-                
-                if transaction:
-                    transaction.sync_status = SyncStatus.COMPLETED
-                    transaction.last_sync_at = datetime.utcnow()
-                    transaction.wasfaty_transaction_id = response.get('wasfaty_transaction_id')
-                
-                # Log sync success
-                sync_log = SyncLog(
-                    pharmacy_id=pharmacy_id,
-                    sync_type="pos_sale_sync",
-                    entity_type="transaction",
-                    entity_id=str(transaction_id),
-                    direction="pos_to_wasfaty",
-                    status=SyncStatus.COMPLETED,
-                    request_data=wasfaty_data,
-                    response_data=response,
-                    completed_at=datetime.utcnow()
-                )
-                db.add(sync_log)
-                db.commit()
+            await run_in_db_session(self._record_sync_success, transaction_id, response)
+            
+            sync_log_writer.log(
+                pharmacy_id=pharmacy_id,
+                sync_type="pos_sale_sync",
+                entity_type="transaction",
+                entity_id=transaction_id,
+                direction="pos_to_wasfaty",
+                status=SyncStatus.COMPLETED,
+                request_data=wasfaty_data,
+                response_data=response,
+                processing_time_ms=_elapsed_ms(started_at)
+            )
             
             logger.info(f"Successfully synced POS sale {transaction_id} with Wasfaty")
+            return True
+            
+        except WasfatyCircuitOpenError:
+            # Wasfaty is known to be down; leave the sale in the backlog untouched
+            logger.warning(f"Wasfaty circuit open, parking POS sale {transaction_id}")
+            raise
             
         except Exception as e:
             logger.error(f"Failed to sync POS sale with Wasfaty: {e}")
             
             # Update sync status to failed
-            with get_db_session() as db:
-                transaction = db.query(Transaction).filter(
-                    Transaction.id == transaction_id
-                ).first()
-                
-                if transaction:
-                    transaction.sync_status = SyncStatus.FAILED
-                    transaction.sync_attempts += 1
-                    transaction.error_message = str(e)
-                
-                # Log sync failure
-                sync_log = SyncLog(
-                    pharmacy_id=pharmacy_id,
-                    sync_type="pos_sale_sync",
-                    entity_type="transaction",
-                    entity_id=str(transaction_id),
-                    direction="pos_to_wasfaty",
-                    status=SyncStatus.FAILED,
-                    request_data=wasfaty_data if 'wasfaty_data' in locals() else None,
-                    error_message=str(e),
-                    completed_at=datetime.utcnow()
-                )
-                db.add(sync_log)
-                db.commit()
+            await run_in_db_session(self._record_sync_failure, transaction_id, str(e))
+            
+            sync_log_writer.log(
+                pharmacy_id=pharmacy_id,
+                sync_type="pos_sale_sync",
+                entity_type="transaction",
+                entity_id=transaction_id,
+                direction="pos_to_wasfaty",
+                status=SyncStatus.FAILED,
+                request_data=wasfaty_data,
+                error_message=str(e),
+                processing_time_ms=_elapsed_ms(started_at)
+            )
+            
+            return False
+    
+    def _build_wasfaty_items(self, db: Session, sale_data: Dict) -> List[Dict]:
+        """Convert POS sale items to Wasfaty format"""
+        
+        items = []
+        sale_items = sale_data.get('items', [])
+        for item_data, drug in zip(sale_items, resolve_pos_item_drugs(db, sale_items)):
+            if drug and drug.wasfaty_drug_id:
+                items.append({
+                    "wasfaty_drug_id": drug.wasfaty_drug_id,
+                    "quantity_sold": item_data['quantity'],
+                    "unit_price": item_data['unit_price'],
+                    "batch_number": item_data.get('batch_number')
+                })
+        
+        return items
+    
+    def _record_sync_success(self, db: Session, transaction_id: str, response: Dict):
+        """Mark the transaction synced"""
+        
+        transaction = db.query(Transaction).filter(
+            Transaction.id == transaction_id
+        ).first()
+        
+        if transaction:
+            transaction.sync_status = SyncStatus.COMPLETED
+            transaction.last_sync_at = datetime.utcnow()
+            transaction.wasfaty_transaction_id = response.get('wasfaty_transaction_id')
+    
+    def _record_sync_failure(self, db: Session, transaction_id: str, error_message: str):
+        """Mark the transaction failed"""
+        
+        transaction = db.query(Transaction).filter(
+            Transaction.id == transaction_id
+        ).first()
+        
+        if transaction:
+            transaction.sync_status = SyncStatus.FAILED
+            transaction.sync_attempts += 1
+            transaction.error_message = error_message
     
     async def validate_pos_transaction(
         self, 
@@ -310,57 +411,9 @@ class POSService:
         }
         
         try:
-            with get_db_session() as db:
-                # Check if pharmacy exists and is active
-                pharmacy = db.query(Pharmacy).filter(
-                    Pharmacy.id == pharmacy_id,
-                    Pharmacy.is_active == True
-                ).first()
-                
-                if not pharmacy:
-                    validation_result["is_valid"] = False
-                    validation_result["errors"].append("Invalid or inactive pharmacy")
-                    return validation_result
-                
-                # Validate transaction items
-                for item in transaction_data.get('items', []):
-                    # Check if drug exists
-                    drug = db.query(Drug).filter(
-                        (Drug.barcode == item.get('barcode')) |
-                        (Drug.pos_drug_id == item.get('drug_id'))
-                    ).first()
-                    
-                    if not drug:
-                        validation_result["errors"].append(
-                            f"Drug not found: {item.get('barcode', item.get('drug_id'))}"
-                        )
-                        continue
-                    
-                    # Check inventory availability
-                    inventory = db.query(InventoryItem).filter(
-                        InventoryItem.pharmacy_id == pharmacy_id,
-                        InventoryItem.drug_id == drug.id
-                    ).first()
-                    
-                    if not inventory:
-                        validation_result["warnings"].append(
-                            f"No inventory record for {drug.name}"
-                        )
-                    elif inventory.current_stock < item['quantity']:
-                        validation_result["warnings"].append(
-                            f"Insufficient stock for {drug.name}: {inventory.current_stock} available, {item['quantity']} requested"
-                        )
-                    
-                    # Check if prescription is required
-                    if drug.is_prescription_required and not transaction_data.get('prescription_id'):
-                        validation_result["errors"].append(
-                            f"Prescription required for {drug.name}"
-                        )
-                
-                if validation_result["errors"]:
-                    validation_result["is_valid"] = False
-                
-                return validation_result
+            return await run_in_db_session(
+                self._validate_pos_transaction, pharmacy_id, transaction_data, validation_result
+            )
                 
         except Exception as e:
             logger.error(f"Transaction validation failed: {e}")
@@ -368,11 +421,69 @@ class POSService:
             validation_result["errors"].append(f"Validation error: {e}")
             return validation_result
     
-    def _generate_transaction_number(self, pharmacy_id: str) -> str:
+    def _validate_pos_transaction(
+        self, 
+        db: Session, 
+        pharmacy_id: str, 
+        transaction_data: Dict, 
+        validation_result: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """Run the database checks for validate_pos_transaction"""
+        
+        # Check if pharmacy exists and is active
+        pharmacy = db.query(Pharmacy).filter(
+            Pharmacy.id == pharmacy_id,
+            Pharmacy.is_active == True
+        ).first()
+        
+        if not pharmacy:
+            validation_result["is_valid"] = False
+            validation_result["errors"].append("Invalid or inactive pharmacy")
+            return validation_result
+        
+        # Validate transaction items
+        for item in transaction_data.get('items', []):
+            # Check if drug exists
+            drug = db.query(Drug).filter(
+                (Drug.barcode == item.get('barcode')) |
+                (Drug.pos_drug_id == item.get('drug_id'))
+            ).first()
+            
+            if not drug:
+                validation_result["errors"].append(
+                    f"Drug not found: {item.get('barcode', item.get('drug_id'))}"
+                )
+                continue
+            
+            # Check inventory availability
+            inventory = db.query(InventoryItem).filter(
+                InventoryItem.pharmacy_id == pharmacy_id,
+                InventoryItem.drug_id == drug.id
+            ).first()
+            
+            if not inventory:
+                validation_result["warnings"].append(
+                    f"No inventory record for {drug.name}"
+                )
+            elif inventory.current_stock < item['quantity']:
+                validation_result["warnings"].append(
+                    f"Insufficient stock for {drug.name}: {inventory.current_stock} available, {item['quantity']} requested"
+                )
+            
+            # Check if prescription is required
+            if drug.is_prescription_required and not transaction_data.get('prescription_id'):
+                validation_result["errors"].append(
+                    f"Prescription required for {drug.name}"
+                )
+        
+        if validation_result["errors"]:
+            validation_result["is_valid"] = False
+        
+        return validation_result
+    
+    def _generate_transaction_number(self, db: Session, pharmacy_id: str) -> str:
         """Generate unique transaction number"""
-        timestamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
-        pharmacy_code = pharmacy_id[-4:].upper()  # Last 4 chars of pharmacy ID
-        return f"POS-{pharmacy_code}-{timestamp}"
+        return generate_transaction_number(db, pharmacy_id, "POS")
     
     async def get_transaction_status(
         self, 
@@ -388,30 +499,35 @@ class POSService:
             Dict containing transaction status
         """
         try:
-            with get_db_session() as db:
-                transaction = db.query(Transaction).filter(
-                    Transaction.id == transaction_id
-                ).first()
-                
-                if not transaction:
-                    return {"error": "Transaction not found"}
-                
-                return {
-                    "transaction_id": str(transaction.id),
-                    "transaction_number": transaction.transaction_number,
-                    "status": transaction.status,
-                    "sync_status": transaction.sync_status,
-                    "sync_attempts": transaction.sync_attempts,
-                    "last_sync_at": transaction.last_sync_at.isoformat() if transaction.last_sync_at else None,
-                    "wasfaty_transaction_id": transaction.wasfaty_transaction_id,
-                    "error_message": transaction.error_message,
-                    "created_at": transaction.created_at.isoformat()
-                }
+            return await run_in_read_session(self._get_transaction_status, transaction_id)
                 
         except Exception as e:
             logger.error(f"Failed to get transaction status: {e}")
             return {"error": str(e)}
     
+    def _get_transaction_status(self, db: Session, transaction_id: str) -> Dict[str, Any]:
+        """Load transaction status and sync information"""
+        
+        transaction = db.query(Transaction).filter(
+            Transaction.id == transaction_id
+        ).first()
+        
+        if not transaction:
+            return {"error": "Transaction not found"}
+        
+        return {
+            "transaction_id": str(transaction.id),
+            "pharmacy_id": str(transaction.pharmacy_id),
+            "transaction_number": transaction.transaction_number,
+            "status": transaction.status,
+            "sync_status": transaction.sync_status,
+            "sync_attempts": transaction.sync_attempts,
+            "last_sync_at": transaction.last_sync_at.isoformat() if transaction.last_sync_at else None,
+            "wasfaty_transaction_id": transaction.wasfaty_transaction_id,
+            "error_message": transaction.error_message,
+            "created_at": transaction.created_at.isoformat()
+        }
+    
     async def retry_failed_sync(self, transaction_id: str) -> Dict[str, Any]:
         """
         Retry synchronization for failed transactions
@@ -423,42 +539,56 @@ class POSService:
             Dict containing retry result
         """
         try:
-            with get_db_session() as db:
-                transaction = db.query(Transaction).filter(
-                    Transaction.id == transaction_id,
-                    Transaction.sync_status == SyncStatus.FAILED
-                ).first()
-                
-                if not transaction:
-                    return {"error": "Transaction not found or not in failed state"}
-                
-                # Reset sync status
-                transaction.sync_status = SyncStatus.PENDING
-                transaction.error_message = None
-                db.commit()
-                
-                # Retry sync
-                sale_data = {
-                    "items": [
-                        {
-                            "drug_id": item.drug.pos_drug_id,
-                            "barcode": item.drug.barcode,
-                            "quantity": item.quantity,
-                            "unit_price": float(item.unit_price),
-                            "batch_number": item.batch_number
-                        }
-                        for item in transaction.transaction_items
-                    ]
-                }
-                
-                await self._sync_pos_sale_with_wasfaty(
-                    str(transaction.pharmacy_id), 
-                    str(transaction.id), 
-                    sale_data
-                )
-                
-                return {"success": True, "message": "Sync retry initiated"}
+            retry = await run_in_db_session(self._reset_failed_sync, transaction_id)
+            
+            if not retry:
+                return {"error": "Transaction not found or not in failed state"}
+            
+            # Retry sync
+            await self._sync_pos_sale_with_wasfaty(
+                retry["pharmacy_id"], 
+                retry["transaction_id"], 
+                retry["sale_data"]
+            )
+            
+            return {"success": True, "message": "Sync retry initiated"}
                 
         except Exception as e:
             logger.error(f"Failed to retry sync: {e}")
             return {"error": str(e)}
+    
+    def _reset_failed_sync(self, db: Session, transaction_id: str) -> Optional[Dict[str, Any]]:
+        """Reset a failed transaction to pending and rebuild its sale data"""
+        
+        transaction = transaction_graph_query(db).filter(
+            Transaction.id == transaction_id,
+            Transaction.sync_status == SyncStatus.FAILED
+        ).first()
+        
+        if not transaction:
+            return None
+        
+        # Reset sync status
+        transaction.sync_status = SyncStatus.PENDING
+        transaction.error_message = None
+        
+        return {
+            "pharmacy_id": str(transaction.pharmacy_id),
+            "transaction_id": str(transaction.id),
+            "sale_data": {
+                "items": [
+                    {
+                        "drug_id": item.drug.pos_drug_id,
+                        "barcode": item.drug.barcode,
+                        "quantity": item.quantity,
+                        "unit_price": float(item.unit_price),
+                        "batch_number": item.batch_number
+                    }
+                    for item in transaction.transaction_items
+                ]
+            }
+        }
+
+
+def _elapsed_ms(started_at: float) -> int:
+    return int((time.perf_counter() - started_at) * 1000)
@@ -0,0 +1,97 @@
+"""
+Query builders for prescription, transaction and inventory object graphs
+
+Services load whole graphs through these helpers instead of walking lazy
+relationships, so the number of SELECTs stays constant no matter how many
+items a prescription or transaction has:
+- Collections are loaded with selectinload (one extra query per level)
+- Many-to-one links (item.drug, transaction.prescription) with joinedload
+- Per-item lookups (drugs, inventory rows) are batched into one IN query
+"""
+
+from typing import Dict, Iterable, List, Optional
+from sqlalchemy import or_
+from sqlalchemy.orm import Query, Session, joinedload, selectinload
+
+from database.models import (
+    Drug, InventoryItem, Prescription, PrescriptionItem, Transaction, TransactionItem
+)
+
+
+def prescription_graph_query(db: Session) -> Query:
+    """Prescriptions with their items and each item's drug"""
+    return db.query(Prescription).options(
+        selectinload(Prescription.prescription_items).joinedload(PrescriptionItem.drug)
+    )
+
+
+def transaction_graph_query(db: Session) -> Query:
+    """Transactions with their items, each item's drug and the prescription"""
+    return db.query(Transaction).options(
+        selectinload(Transaction.transaction_items).joinedload(TransactionItem.drug),
+        joinedload(Transaction.prescription)
+    )
+
+
+def load_inventory_by_drug(
+    db: Session,
+    pharmacy_id,
+    drug_ids: Iterable
+) -> Dict:
+    """
+    Inventory rows of a pharmacy for several drugs in one query
+    
+    Returns:
+        Dict mapping drug_id to its (first) inventory row
+    """
+    drug_ids = list({drug_id for drug_id in drug_ids if drug_id is not None})
+    if not drug_ids:
+        return {}
+    
+    inventory_items = db.query(InventoryItem).filter(
+        InventoryItem.pharmacy_id == pharmacy_id,
+        InventoryItem.drug_id.in_(drug_ids)
+    ).all()
+    
+    inventory_by_drug = {}
+    for inventory_item in inventory_items:
+        inventory_by_drug.setdefault(inventory_item.drug_id, inventory_item)
+    return inventory_by_drug
+
+
+def load_drugs_by_wasfaty_id(db: Session, wasfaty_drug_ids: Iterable[str]) -> Dict[str, Drug]:
+    """Drugs keyed by Wasfaty drug ID, in one query"""
+    wasfaty_drug_ids = list({drug_id for drug_id in wasfaty_drug_ids if drug_id})
+    if not wasfaty_drug_ids:
+        return {}
+    
+    drugs = db.query(Drug).filter(Drug.wasfaty_drug_id.in_(wasfaty_drug_ids)).all()
+    return {drug.wasfaty_drug_id: drug for drug in drugs}
+
+
+def resolve_pos_item_drugs(db: Session, items: List[Dict]) -> List[Optional[Drug]]:
+    """
+    Match POS sale items to drugs by barcode or POS drug ID in one query
+    
+    Returns:
+        The matching drug (or None) for each item, in item order
+    """
+    barcodes = {item.get('barcode') for item in items if item.get('barcode')}
+    pos_drug_ids = {item.get('drug_id') for item in items if item.get('drug_id')}
+    if not barcodes and not pos_drug_ids:
+        return [None] * len(items)
+    
+    drugs = db.query(Drug).filter(
+        or_(Drug.barcode.in_(barcodes), Drug.pos_drug_id.in_(pos_drug_ids))
+    ).all()
+    
+    by_barcode = {drug.barcode: drug for drug in drugs if drug.barcode}
+    by_pos_id = {}
+    for drug in drugs:
+        if drug.pos_drug_id:
+            by_pos_id.setdefault(drug.pos_drug_id, drug)
+    
+    return [
+        by_barcode.get(item.get('barcode')) or by_pos_id.get(item.get('drug_id'))
+        for item in items
+    ]
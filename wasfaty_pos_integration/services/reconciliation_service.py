@@ -0,0 +1,296 @@
+"""
+Inventory Reconciliation Service
+
+This module detects drift between local inventory and Wasfaty's view of
+it and pushes corrections. Per pharmacy:
+1. Local stock is streamed from the database in chunks, summed per drug,
+   and folded into per-bucket checksums while Wasfaty's checksums for the
+   same buckets are fetched concurrently
+2. Only buckets whose checksums differ are drilled into: their local
+   items and Wasfaty's snapshot pages are loaded side by side and compared
+3. Drugs whose stock differs become corrective updates, sent through the
+   request batcher to the regular inventory sync endpoint
+   
+Memory stays proportional to the bucket count plus the drilled-down
+buckets, however many SKU-batch rows a pharmacy has. Mismatched buckets
+beyond the per-run drill-down limit are left for the next run.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Any
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from config import get_inventory_sync_config, get_outbox_config, get_reconciliation_config
+from database.database import run_in_db_session
+from database.models import Drug, InventoryItem, Pharmacy, SyncStatus
+from services.inventory_checksums import (
+    BucketChecksums, bucket_for_key, inventory_key, mismatched_buckets
+)
+from services.sharding import shard_for_pharmacy
+from services.sync_audit import sync_log_writer
+from services.wasfaty_batcher import wasfaty_batcher
+from services.wasfaty_client import wasfaty_client
+
+
+logger = logging.getLogger(__name__)
+
+
+class ReconciliationError(Exception):
+    """Custom exception for inventory reconciliation errors"""
+    pass
+
+
+class ReconciliationService:
+    """
+    Checksum-based inventory reconciliation against Wasfaty
+    """
+    
+    def __init__(self):
+        config = get_reconciliation_config()
+        self.bucket_count = config["bucket_count"]
+        self.max_drilldown_buckets = config["max_drilldown_buckets"]
+        self.stream_chunk_size = config["stream_chunk_size"]
+        self.snapshot_page_size = config["snapshot_page_size"]
+        self.concurrency = config["concurrency"]
+        self.apply_corrections = config["apply_corrections"]
+        self.correction_chunk_size = get_inventory_sync_config()["chunk_size"]
+        self.shard_count = get_outbox_config()["shard_count"]
+    
+    async def reconcile_inventory(
+        self,
+        pharmacy_id: Optional[str] = None,
+        shards: Optional[Iterable[int]] = None
+    ) -> Dict[str, Any]:
+        """
+        Reconcile local inventory with Wasfaty
+        
+        Args:
+            pharmacy_id: Optional single pharmacy; all active pharmacies when omitted
+            shards: Only reconcile pharmacies in these shards
+            
+        Returns:
+            Dict containing a reconciliation summary per pharmacy
+        """
+        started_at = datetime.utcnow()
+        
+        if pharmacy_id:
+            pharmacy_ids = [pharmacy_id]
+        else:
+            try:
+                pharmacy_ids = await run_in_db_session(self._active_pharmacies)
+            except Exception as e:
+                logger.error(f"Failed to list pharmacies for reconciliation: {e}")
+                raise ReconciliationError(f"Reconciliation failed: {e}")
+        
+        if shards is not None:
+            owned = set(shards)
+            pharmacy_ids = [
+                candidate for candidate in pharmacy_ids
+                if shard_for_pharmacy(candidate, self.shard_count) in owned
+            ]
+        
+        slots = asyncio.Semaphore(self.concurrency)
+        
+        async def reconcile_with_limit(candidate: str):
+            async with slots:
+                try:
+                    return await self._reconcile_pharmacy(candidate)
+                except Exception as e:
+                    logger.error(f"Reconciliation failed for pharmacy {candidate}: {e}")
+                    return {"pharmacy_id": candidate, "error": str(e)}
+        
+        pharmacies = await asyncio.gather(*(reconcile_with_limit(candidate) for candidate in pharmacy_ids))
+        
+        return {
+            "pharmacies": pharmacies,
+            "corrections": sum(len(result.get("corrections", [])) for result in pharmacies),
+            "started_at": started_at.isoformat(),
+            "completed_at": datetime.utcnow().isoformat()
+        }
+    
+    async def _reconcile_pharmacy(self, pharmacy_id: str) -> Dict[str, Any]:
+        """Compare bucket checksums, then drill into mismatched buckets"""
+        
+        started_at = time.monotonic()
+        
+        local_checksums, remote = await asyncio.gather(
+            run_in_db_session(self._local_checksums, pharmacy_id),
+            wasfaty_client.get_inventory_checksums(pharmacy_id, self.bucket_count)
+        )
+        
+        mismatched = mismatched_buckets(local_checksums, remote.get("checksums", {}))
+        drilldown = mismatched[:self.max_drilldown_buckets]
+        
+        result = {
+            "pharmacy_id": pharmacy_id,
+            "buckets": self.bucket_count,
+            "mismatched_buckets": len(mismatched),
+            "deferred_buckets": len(mismatched) - len(drilldown),
+            "corrections": [],
+            "corrections_applied": 0
+        }
+        if not drilldown:
+            return result
+        
+        local_items, remote_items = await asyncio.gather(
+            run_in_db_session(self._local_bucket_items, pharmacy_id, set(drilldown)),
+            self._remote_bucket_items(pharmacy_id, drilldown)
+        )
+        
+        corrections = self._diff(local_items, remote_items)
+        result["corrections"] = corrections
+        
+        if corrections and self.apply_corrections:
+            result["corrections_applied"] = await self._apply_corrections(pharmacy_id, corrections)
+        
+        sync_log_writer.log(
+            pharmacy_id=pharmacy_id,
+            sync_type="inventory_reconciliation",
+            entity_type="inventory",
+            entity_id=pharmacy_id,
+            direction="pos_to_wasfaty",
+            status=SyncStatus.COMPLETED,
+            request_data={"mismatched_buckets": mismatched},
+            response_data={"corrections": corrections},
+            processing_time_ms=int((time.monotonic() - started_at) * 1000)
+        )
+        
+        logger.info(
+            f"Reconciled pharmacy {pharmacy_id}: {len(mismatched)} mismatched buckets, "
+            f"{len(corrections)} corrections, {result['deferred_buckets']} buckets deferred"
+        )
+        return result
+    
+    def _diff(self, local_items: Dict[str, Dict], remote_items: Dict[str, Dict]) -> List[Dict]:
+        """Corrective updates for drugs whose stock differs"""
+        
+        corrections = []
+        for key in sorted(set(local_items) | set(remote_items)):
+            local = local_items.get(key)
+            remote = remote_items.get(key)
+            
+            # Drugs with unsynced changes are already on their way to Wasfaty
+            if local and local["pending_sync"]:
+                continue
+            
+            local_stock = (local["current_stock"], local["available_stock"]) if local else (0, 0)
+            remote_stock = (
+                (int(remote.get("current_stock") or 0), int(remote.get("available_stock") or 0))
+                if remote else None
+            )
+            if local_stock == remote_stock:
+                continue
+            
+            source = local or remote
+            corrections.append({
+                "drug_id": source.get("drug_id"),
+                "wasfaty_drug_id": source.get("wasfaty_drug_id"),
+                "current_stock": local_stock[0],
+                "available_stock": local_stock[1],
+                "wasfaty_current_stock": remote_stock[0] if remote_stock else None,
+                "difference": local_stock[0] - (remote_stock[0] if remote_stock else 0)
+            })
+        
+        return corrections
+    
+    async def _apply_corrections(self, pharmacy_id: str, corrections: List[Dict]) -> int:
+        """Send local stock levels for drifted drugs in bounded chunks"""
+        
+        applied = 0
+        for start in range(0, len(corrections), self.correction_chunk_size):
+            chunk = corrections[start:start + self.correction_chunk_size]
+            updates = [
+                {
+                    "drug_id": correction["drug_id"],
+                    "wasfaty_drug_id": correction["wasfaty_drug_id"],
+                    "current_stock": correction["current_stock"],
+                    "available_stock": correction["available_stock"],
+                    "reconciled": True
+                }
+                for correction in chunk
+            ]
+            
+            try:
+                await wasfaty_batcher.sync_inventory_update(pharmacy_id, updates)
+            except Exception as e:
+                logger.error(f"Failed to apply reconciliation corrections for pharmacy {pharmacy_id}: {e}")
+                break
+            applied += len(chunk)
+        
+        return applied
+    
+    def _active_pharmacies(self, db: Session) -> List[str]:
+        return [
+            str(pharmacy_id)
+            for (pharmacy_id,) in db.query(Pharmacy.id).filter(Pharmacy.is_active.is_(True))
+        ]
+    
+    def _stream_local_items(self, db: Session, pharmacy_id: str) -> Iterator[Dict[str, Any]]:
+        """
+        Stream local stock per drug, summed over batches
+        
+        Rows come through a server-side cursor in chunks, so the whole
+        inventory is never held in memory. Reads the primary so corrections
+        are never based on replica lag.
+        """
+        statement = select(
+            InventoryItem.drug_id,
+            Drug.wasfaty_drug_id,
+            func.sum(func.coalesce(InventoryItem.current_stock, 0)).label("current_stock"),
+            func.sum(
+                func.coalesce(InventoryItem.current_stock, 0) - func.coalesce(InventoryItem.reserved_stock, 0)
+            ).label("available_stock"),
+            func.bool_or(InventoryItem.sync_status == SyncStatus.PENDING).label("pending_sync")
+        ).join(
+            Drug, Drug.id == InventoryItem.drug_id
+        ).where(
+            InventoryItem.pharmacy_id == pharmacy_id
+        ).group_by(
+            InventoryItem.drug_id, Drug.wasfaty_drug_id
+        ).execution_options(yield_per=self.stream_chunk_size)
+        
+        for row in db.execute(statement):
+            yield {
+                "drug_id": str(row.drug_id),
+                "wasfaty_drug_id": row.wasfaty_drug_id,
+                "current_stock": int(row.current_stock or 0),
+                "available_stock": int(row.available_stock or 0),
+                "pending_sync": bool(row.pending_sync)
+            }
+    
+    def _local_checksums(self, db: Session, pharmacy_id: str) -> Dict[str, str]:
+        checksums = BucketChecksums(self.bucket_count)
+        checksums.add_all(self._stream_local_items(db, pharmacy_id))
+        return checksums.checksums()
+    
+    def _local_bucket_items(self, db: Session, pharmacy_id: str, buckets: set) -> Dict[str, Dict]:
+        """Local items that fall into the given buckets, keyed by drug key"""
+        return {
+            inventory_key(item): item
+            for item in self._stream_local_items(db, pharmacy_id)
+            if bucket_for_key(inventory_key(item), self.bucket_count) in buckets
+        }
+    
+    async def _remote_bucket_items(self, pharmacy_id: str, buckets: List[int]) -> Dict[str, Dict]:
+        """Wasfaty's items in the given buckets, paged, keyed by drug key"""
+        
+        items = {}
+        cursor = None
+        while True:
+            page = await wasfaty_client.get_inventory_snapshot(
+                pharmacy_id,
+                self.bucket_count,
+                buckets,
+                cursor=cursor,
+                limit=self.snapshot_page_size
+            )
+            for item in page.get("items", []):
+                items[inventory_key(item)] = item
+            
+            cursor = page.get("next_cursor")
+            if not cursor:
+                return items
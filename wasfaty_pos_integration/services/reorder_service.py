@@ -0,0 +1,177 @@
+"""
+Reorder Service
+
+This module computes low-stock reorder proposals for every pharmacy.
+The whole catalog is evaluated in a single set-based query:
+- Available stock, minimum and maximum levels are summed per pharmacy and
+  drug across inventory batches
+- Daily sales velocity comes from completed transactions in a recent window
+- Reorder point = max(minimum_stock, velocity x (lead time + safety days))
+- Items at or below their reorder point get an order quantity that brings
+  them up to max(maximum_stock, reorder point + velocity x review days)
+
+The query runs on the read replica when one is configured.
+"""
+
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Any
+from sqlalchemy import Float, and_, cast, func, select
+from sqlalchemy.orm import Session
+
+from config import get_reorder_config
+from database.database import run_in_read_session
+from database.models import (
+    Drug, InventoryItem, Transaction, TransactionItem, TransactionStatus
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+class ReorderServiceError(Exception):
+    """Custom exception for reorder service errors"""
+    pass
+
+
+class ReorderService:
+    """
+    Chain-wide reorder computation over InventoryItem and sales history
+    """
+    
+    def __init__(self):
+        config = get_reorder_config()
+        self.sales_window_days = config["sales_window_days"]
+        self.lead_time_days = config["lead_time_days"]
+        self.safety_days = config["safety_days"]
+        self.review_days = config["review_days"]
+    
+    async def generate_reorder_proposals(
+        self,
+        pharmacy_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Compute reorder proposals
+        
+        Args:
+            pharmacy_id: Optional pharmacy filter; all pharmacies when omitted
+            
+        Returns:
+            Dict containing proposals grouped by pharmacy
+        """
+        try:
+            started_at = datetime.utcnow()
+            rows = await run_in_read_session(self._compute_reorder_rows, pharmacy_id)
+            
+            proposals: Dict[str, List[Dict]] = defaultdict(list)
+            for row in rows:
+                proposals[row["pharmacy_id"]].append(row)
+            
+            logger.info(
+                f"Computed {len(rows)} reorder proposals for {len(proposals)} pharmacies "
+                f"in {(datetime.utcnow() - started_at).total_seconds():.2f}s"
+            )
+            
+            return {
+                "pharmacy_count": len(proposals),
+                "proposal_count": len(rows),
+                "proposals": dict(proposals),
+                "sales_window_days": self.sales_window_days,
+                "generated_at": datetime.utcnow().isoformat()
+            }
+        
+        except Exception as e:
+            logger.error(f"Failed to compute reorder proposals: {e}")
+            raise ReorderServiceError(f"Reorder computation failed: {e}")
+    
+    def _compute_reorder_rows(self, db: Session, pharmacy_id: Optional[str]) -> List[Dict]:
+        """Evaluate every pharmacy/drug pair in one query"""
+        
+        since = datetime.utcnow() - timedelta(days=self.sales_window_days)
+        
+        # Stock per pharmacy and drug, summed across batches
+        stock_query = select(
+            InventoryItem.pharmacy_id,
+            InventoryItem.drug_id,
+            func.sum(
+                InventoryItem.current_stock - func.coalesce(InventoryItem.reserved_stock, 0)
+            ).label("available_stock"),
+            func.max(func.coalesce(InventoryItem.minimum_stock, 0)).label("minimum_stock"),
+            func.max(func.coalesce(InventoryItem.maximum_stock, 0)).label("maximum_stock")
+        ).group_by(InventoryItem.pharmacy_id, InventoryItem.drug_id)
+        
+        # Units sold per pharmacy and drug over the sales window
+        sales_query = select(
+            Transaction.pharmacy_id,
+            TransactionItem.drug_id,
+            func.sum(TransactionItem.quantity).label("units_sold")
+        ).join(
+            Transaction, Transaction.id == TransactionItem.transaction_id
+        ).where(
+            Transaction.created_at >= since,
+            Transaction.status == TransactionStatus.COMPLETED
+        ).group_by(Transaction.pharmacy_id, TransactionItem.drug_id)
+        
+        if pharmacy_id:
+            stock_query = stock_query.where(InventoryItem.pharmacy_id == pharmacy_id)
+            sales_query = sales_query.where(Transaction.pharmacy_id == pharmacy_id)
+        
+        stock = stock_query.cte("stock")
+        sales = sales_query.cte("sales")
+        
+        daily_velocity = (
+            cast(func.coalesce(sales.c.units_sold, 0), Float) / float(self.sales_window_days)
+        )
+        reorder_point = func.greatest(
+            stock.c.minimum_stock,
+            daily_velocity * (self.lead_time_days + self.safety_days)
+        )
+        order_up_to = func.greatest(
+            stock.c.maximum_stock,
+            reorder_point + daily_velocity * self.review_days
+        )
+        
+        query = select(
+            stock.c.pharmacy_id,
+            stock.c.drug_id,
+            Drug.name.label("drug_name"),
+            Drug.wasfaty_drug_id,
+            stock.c.available_stock,
+            stock.c.minimum_stock,
+            stock.c.maximum_stock,
+            daily_velocity.label("daily_velocity"),
+            reorder_point.label("reorder_point"),
+            func.ceil(order_up_to - stock.c.available_stock).label("reorder_quantity")
+        ).select_from(
+            stock.join(Drug, Drug.id == stock.c.drug_id).outerjoin(
+                sales,
+                and_(
+                    sales.c.pharmacy_id == stock.c.pharmacy_id,
+                    sales.c.drug_id == stock.c.drug_id
+                )
+            )
+        ).where(
+            stock.c.available_stock <= reorder_point
+        ).order_by(
+            stock.c.pharmacy_id, stock.c.available_stock - reorder_point
+        )
+        
+        proposals = []
+        for row in db.execute(query):
+            velocity = float(row.daily_velocity or 0)
+            proposals.append({
+                "pharmacy_id": str(row.pharmacy_id),
+                "drug_id": str(row.drug_id),
+                "drug_name": row.drug_name,
+                "wasfaty_drug_id": row.wasfaty_drug_id,
+                "available_stock": int(row.available_stock or 0),
+                "minimum_stock": int(row.minimum_stock or 0),
+                "maximum_stock": int(row.maximum_stock or 0),
+                "daily_velocity": round(velocity, 3),
+                "days_of_cover": round(row.available_stock / velocity, 1) if velocity > 0 else None,
+                "reorder_point": round(float(row.reorder_point), 1),
+                "reorder_quantity": max(int(row.reorder_quantity or 0), 0)
+            })
+        
+        return proposals
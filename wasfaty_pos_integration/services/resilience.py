@@ -0,0 +1,120 @@
+"""
+Resilience primitives for upstream API calls
+
+This module provides the circuit breaker and retry policy used by
+WasfatyClient:
+- CircuitBreaker fails fast while an endpoint is known to be down
+- RetryPolicy computes jittered exponential backoff between attempts
+"""
+
+import logging
+import random
+import time
+from enum import Enum
+
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitState(str, Enum):
+    """Circuit breaker state enumeration"""
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker
+    Opens after failure_threshold failures, lets a limited number of probe
+    calls through once recovery_timeout_seconds have passed, and closes
+    again on the first successful probe
+    """
+    
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        recovery_timeout_seconds: float = 30.0,
+        half_open_max_calls: int = 1
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout_seconds = recovery_timeout_seconds
+        self.half_open_max_calls = half_open_max_calls
+        
+        self.state = CircuitState.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+        self._probe_started_at = 0.0
+    
+    def allow_request(self) -> bool:
+        """Check whether a call may proceed, claiming a probe slot if half-open"""
+        if self.state == CircuitState.OPEN:
+            if self.retry_after() > 0:
+                return False
+            self.state = CircuitState.HALF_OPEN
+            self._half_open_calls = 0
+            logger.info(f"Circuit {self.name} half-open, probing upstream")
+        
+        if self.state == CircuitState.HALF_OPEN:
+            if self._half_open_calls >= self.half_open_max_calls:
+                # A probe that never reported back must not wedge the circuit
+                if time.monotonic() - self._probe_started_at < self.recovery_timeout_seconds:
+                    return False
+                self._half_open_calls = 0
+            self._half_open_calls += 1
+            self._probe_started_at = time.monotonic()
+        
+        return True
+    
+    def is_open(self) -> bool:
+        """Check whether calls are currently being rejected"""
+        return self.state == CircuitState.OPEN and self.retry_after() > 0
+    
+    def retry_after(self) -> float:
+        """Seconds until the circuit lets a probe through"""
+        if self.state != CircuitState.OPEN:
+            return 0.0
+        elapsed = time.monotonic() - self._opened_at
+        return max(0.0, self.recovery_timeout_seconds - elapsed)
+    
+    def record_success(self):
+        """Record a call that reached a healthy upstream"""
+        self._consecutive_failures = 0
+        if self.state != CircuitState.CLOSED:
+            logger.info(f"Circuit {self.name} closed")
+            self.state = CircuitState.CLOSED
+    
+    def record_failure(self):
+        """Record a call that failed because of the upstream"""
+        self._consecutive_failures += 1
+        if self.state == CircuitState.HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+            if self.state != CircuitState.OPEN:
+                logger.warning(
+                    f"Circuit {self.name} opened after {self._consecutive_failures} consecutive failures"
+                )
+            self.state = CircuitState.OPEN
+            self._opened_at = time.monotonic()
+
+
+class RetryPolicy:
+    """
+    Retry schedule with exponential backoff and full jitter
+    """
+    
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay_seconds: float = 0.2,
+        max_delay_seconds: float = 5.0
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+    
+    def delay(self, attempt: int) -> float:
+        """Seconds to wait after the given (1-based) failed attempt"""
+        ceiling = min(self.max_delay_seconds, self.base_delay_seconds * (2 ** (attempt - 1)))
+        return random.uniform(0, ceiling)
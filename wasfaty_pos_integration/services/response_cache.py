@@ -0,0 +1,189 @@
+"""
+Response cache for read-mostly Wasfaty lookups
+
+Bounded in-memory TTL cache with LRU eviction used by WasfatyClient for
+prescription and drug lookups:
+- Concurrent requests for the same key share one upstream call
+- Entries past their TTL can be served stale while a background task
+  revalidates them
+- Cache-Control headers from the API (no-store, max-age,
+  stale-while-revalidate) override the configured lifetimes
+"""
+
+import asyncio
+import logging
+import re
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Any, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+# A fetch returns the response body and its Cache-Control header, if any
+Fetcher = Callable[[], Awaitable[Tuple[Dict[str, Any], Optional[str]]]]
+
+
+class CacheEntry:
+    """Cached response with its freshness deadlines (monotonic seconds)"""
+    __slots__ = ("value", "fresh_until", "stale_until")
+    
+    def __init__(self, value: Dict[str, Any], fresh_until: float, stale_until: float):
+        self.value = value
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+
+
+class ResponseCache:
+    """
+    TTL + LRU response cache with request coalescing
+    Safe to share between all tasks on one event loop
+    """
+    
+    def __init__(self, max_entries: int = 5000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, CacheEntry]" = OrderedDict()
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+    
+    async def get_or_fetch(
+        self,
+        key: Hashable,
+        fetch: Fetcher,
+        ttl_seconds: float,
+        stale_seconds: float = 0
+    ) -> Dict[str, Any]:
+        """
+        Return a cached response or fetch it once for all concurrent callers
+        
+        Args:
+            key: Cache key built from the endpoint and its parameters
+            fetch: Coroutine factory performing the upstream call
+            ttl_seconds: How long a response is served as fresh
+            stale_seconds: How long after that it may be served while revalidating
+            
+        Returns:
+            A copy of the response body
+        """
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        
+        if entry is not None:
+            self._entries.move_to_end(key)
+            
+            if now < entry.fresh_until:
+                self.hits += 1
+                return dict(entry.value)
+            
+            if now < entry.stale_until:
+                self.stale_hits += 1
+                if key not in self._in_flight:
+                    self._start_fetch(key, fetch, ttl_seconds, stale_seconds)
+                return dict(entry.value)
+        
+        self.misses += 1
+        future = self._in_flight.get(key)
+        if future is None:
+            future = self._start_fetch(key, fetch, ttl_seconds, stale_seconds)
+        
+        # Shield so one cancelled caller does not cancel the shared fetch
+        return dict(await asyncio.shield(future))
+    
+    def _start_fetch(
+        self,
+        key: Hashable,
+        fetch: Fetcher,
+        ttl_seconds: float,
+        stale_seconds: float
+    ) -> asyncio.Future:
+        """Start the single in-flight fetch for a key"""
+        future = asyncio.ensure_future(self._fetch_and_store(key, fetch, ttl_seconds, stale_seconds))
+        self._in_flight[key] = future
+        future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # Background revalidations may finish with nobody awaiting them
+        future.add_done_callback(_consume_exception)
+        return future
+    
+    async def _fetch_and_store(
+        self,
+        key: Hashable,
+        fetch: Fetcher,
+        ttl_seconds: float,
+        stale_seconds: float
+    ) -> Dict[str, Any]:
+        value, cache_control = await fetch()
+        
+        directives = parse_cache_control(cache_control)
+        if "no-store" in directives or "no-cache" in directives:
+            self._entries.pop(key, None)
+            return value
+        
+        if "max-age" in directives:
+            ttl_seconds = directives["max-age"]
+        if "stale-while-revalidate" in directives:
+            stale_seconds = directives["stale-while-revalidate"]
+        
+        if ttl_seconds > 0 or stale_seconds > 0:
+            self.set(key, value, ttl_seconds, stale_seconds)
+        return value
+    
+    def get(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        """Return a copy of a fresh entry without fetching, or None"""
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() >= entry.fresh_until:
+            return None
+        
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return dict(entry.value)
+    
+    def set(self, key: Hashable, value: Dict[str, Any], ttl_seconds: float, stale_seconds: float = 0):
+        """Store a response, evicting the least recently used entries"""
+        now = time.monotonic()
+        self._entries[key] = CacheEntry(value, now + ttl_seconds, now + ttl_seconds + stale_seconds)
+        self._entries.move_to_end(key)
+        
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    def invalidate(self, key: Hashable):
+        """Drop a single entry"""
+        self._entries.pop(key, None)
+    
+    def clear(self):
+        """Drop every entry"""
+        self._entries.clear()
+    
+    def stats(self) -> Dict[str, int]:
+        """Hit and size counters for monitoring"""
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses
+        }
+
+
+def parse_cache_control(header: Optional[str]) -> Dict[str, Any]:
+    """Parse the Cache-Control directives this cache understands"""
+    directives: Dict[str, Any] = {}
+    if not header:
+        return directives
+    
+    for part in header.lower().split(","):
+        part = part.strip()
+        match = re.fullmatch(r"(max-age|stale-while-revalidate)=\"?(\d+)\"?", part)
+        if match:
+            directives[match.group(1)] = int(match.group(2))
+        elif part in ("no-store", "no-cache", "private"):
+            directives[part] = True
+    
+    return directives
+
+
+def _consume_exception(future: asyncio.Future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.debug(f"Cached fetch failed: {future.exception()}")
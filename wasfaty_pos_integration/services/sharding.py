@@ -0,0 +1,56 @@
+"""
+Pharmacy sharding for sync workers
+
+Sync work is partitioned by pharmacy. Every pharmacy hashes onto one of a
+fixed number of logical shards (stored on each outbox job), and logical
+shards are spread over the live worker processes with a consistent hash
+ring. When a worker joins or leaves only the shards next to its ring
+points move, so the rest of the fleet keeps its assignments.
+"""
+
+import bisect
+import hashlib
+from typing import Iterable, List, Optional
+
+
+def stable_hash(value: str) -> int:
+    """64-bit hash that is identical in every process (unlike hash())"""
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+def shard_for_pharmacy(pharmacy_id, shard_count: int) -> int:
+    """Logical shard a pharmacy's sync work belongs to"""
+    if pharmacy_id is None:
+        return 0
+    return stable_hash(str(pharmacy_id)) % shard_count
+
+
+class HashRing:
+    """
+    Consistent hash ring over worker IDs
+    Each worker is placed at several virtual points to even out the load
+    """
+    
+    def __init__(self, members: Iterable[str], virtual_nodes: int):
+        self.members = sorted(set(members))
+        points = sorted(
+            (stable_hash(f"{member}#{index}"), member)
+            for member in self.members
+            for index in range(virtual_nodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._owners = [member for _, member in points]
+    
+    def owner(self, key: str) -> Optional[str]:
+        """Member owning a key: the first ring point clockwise of its hash"""
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, stable_hash(key)) % len(self._hashes)
+        return self._owners[index]
+    
+    def shards_for(self, member: str, shard_count: int) -> List[int]:
+        """Logical shards assigned to a member"""
+        return [
+            shard for shard in range(shard_count)
+            if self.owner(f"shard-{shard}") == member
+        ]
@@ -0,0 +1,152 @@
+"""
+Sync audit logging
+
+This module records every POS/Wasfaty sync in sync_logs:
+- Failed syncs keep their full request and response payloads for
+  troubleshooting. Successful syncs keep full payloads only for a
+  configurable sample; the rest are compacted to identifiers and item
+  counts, which keeps sync_logs partitions small
+- SyncLogWriter buffers log rows in memory and writes them with one
+  multi-row INSERT per batch instead of one transaction per entry
+"""
+
+import asyncio
+import logging
+import random
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional, Any
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from config import get_sync_log_config
+from database.database import run_in_db_session
+from database.models import SyncLog, SyncStatus
+
+
+logger = logging.getLogger(__name__)
+
+
+def compact_payload(data: Optional[Dict]) -> Optional[Dict]:
+    """
+    Reduce a payload to its top-level scalar fields
+    Lists are replaced by their length and nested objects are dropped
+    """
+    if not isinstance(data, dict):
+        return data
+    
+    compacted = {}
+    for key, value in data.items():
+        if isinstance(value, list):
+            compacted[f"{key}_count"] = len(value)
+        elif not isinstance(value, dict):
+            compacted[key] = value
+    
+    compacted["compacted"] = True
+    return compacted
+
+
+def build_sync_log_values(
+    sync_type: str,
+    entity_type: str,
+    entity_id: str,
+    direction: str,
+    status: str,
+    pharmacy_id: Optional[str] = None,
+    request_data: Optional[Dict] = None,
+    response_data: Optional[Dict] = None,
+    error_message: Optional[str] = None,
+    processing_time_ms: Optional[int] = None,
+    retry_count: int = 0
+) -> Dict[str, Any]:
+    """
+    Build the column values of a SyncLog row, compacting payloads of
+    successful syncs outside the configured sample
+    """
+    if status == SyncStatus.COMPLETED and random.random() >= get_sync_log_config()["success_payload_sample_rate"]:
+        request_data = compact_payload(request_data)
+        response_data = compact_payload(response_data)
+    
+    now = datetime.utcnow()
+    return {
+        "id": uuid.uuid4(),
+        "pharmacy_id": pharmacy_id,
+        "sync_type": sync_type,
+        "entity_type": entity_type,
+        "entity_id": str(entity_id),
+        "direction": direction,
+        "status": status,
+        "request_data": request_data,
+        "response_data": response_data,
+        "error_message": error_message,
+        "processing_time_ms": processing_time_ms,
+        "retry_count": retry_count,
+        "created_at": now,
+        "completed_at": now if status in (SyncStatus.COMPLETED, SyncStatus.FAILED) else None
+    }
+
+
+class SyncLogWriter:
+    """
+    Buffered, batched writer for SyncLog rows
+    A batch is written when it reaches the configured size or when the
+    oldest buffered row has waited for the flush interval. Safe to share
+    between all tasks on one event loop
+    """
+    
+    def __init__(self, batch_size: Optional[int] = None, flush_interval_ms: Optional[int] = None):
+        config = get_sync_log_config()
+        self.batch_size = batch_size or config["batch_size"]
+        self.flush_interval_seconds = (flush_interval_ms or config["flush_interval_ms"]) / 1000
+        
+        self._buffer: List[Dict[str, Any]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._in_flight = set()
+    
+    def log(self, **fields) -> None:
+        """
+        Buffer a sync log entry; takes the arguments of build_sync_log_values
+        Returns immediately, the row is written with the next batch
+        """
+        self._buffer.append(build_sync_log_values(**fields))
+        
+        if len(self._buffer) >= self.batch_size:
+            self._flush_buffer()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(
+                self.flush_interval_seconds, self._flush_buffer
+            )
+    
+    def _flush_buffer(self):
+        """Start writing everything buffered"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        
+        rows, self._buffer = self._buffer, []
+        if rows:
+            task = asyncio.ensure_future(self._write(rows))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+    
+    async def _write(self, rows: List[Dict[str, Any]]):
+        try:
+            await run_in_db_session(_insert_sync_logs, rows)
+        except Exception as e:
+            # Audit rows are best effort; never fail the sync that produced them
+            logger.error(f"Failed to write {len(rows)} sync log rows: {e}")
+    
+    async def flush(self):
+        """Write everything buffered and wait for in-flight batches (call at shutdown)"""
+        self._flush_buffer()
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+
+def _insert_sync_logs(db: Session, rows: List[Dict[str, Any]]):
+    """Insert a batch of sync log rows as a multi-row INSERT"""
+    db.execute(insert(SyncLog), rows)
+
+
+# Singleton instance for global use
+sync_log_writer = SyncLogWriter()
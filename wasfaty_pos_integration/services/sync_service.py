@@ -7,28 +7,54 @@ It manages prescription dispensing, inventory updates, and maintains data consis
 
 import asyncio
 import logging
+import uuid
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_
+from sqlalchemy import and_, or_, tuple_, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import DataError
 
-from database.database import get_db_session
+from config import get_sync_config
+from database.database import run_in_db_session, run_in_read_session
+from database.locks import try_advisory_xact_lock
 from database.models import (
     Prescription, PrescriptionItem, Transaction, TransactionItem,
-    InventoryItem, Drug, Pharmacy, SyncLog, 
+    InventoryItem, Drug, Pharmacy, SyncLog, SyncLogHourlySummary,
     PrescriptionStatus, TransactionStatus, SyncStatus
 )
-from services.wasfaty_client import wasfaty_client, WasfatyAPIError
+from services.wasfaty_client import (
+    wasfaty_client, is_transient_error, WasfatyAPIError, WasfatyCircuitOpenError
+)
+from services.wasfaty_batcher import wasfaty_batcher
+from services.outbox_service import build_idempotency_key
+from services.transaction_numbers import generate_transaction_number
+from services.query_builders import (
+    prescription_graph_query, transaction_graph_query, load_inventory_by_drug,
+    load_drugs_by_wasfaty_id
+)
+from services.ingestion_guard import (
+    ingestion_guard, claim_ingestion, complete_ingestion, release_ingestion,
+    PRESCRIPTION_SOURCE
+)
 
 
 logger = logging.getLogger(__name__)
 
+# Advisory lock serializing sync log rollups across workers
+SYNC_LOG_ROLLUP_LOCK = "sync_log_rollup"
+
 
 class SyncServiceError(Exception):
     """Custom exception for sync service errors"""
     pass
 
 
+class PrescriptionValidationError(SyncServiceError):
+    """Raised when prescription data is malformed, so redelivering it cannot succeed"""
+    pass
+
+
 class SyncService:
     """
     Synchronization service for bi-directional data sync
@@ -38,6 +64,13 @@ class SyncService:
     def __init__(self):
         self.max_retry_attempts = 3
         self.retry_delay_seconds = 60
+        
+        sync_config = get_sync_config()
+        self.sync_concurrency = sync_config["concurrency"]
+        self.sync_per_pharmacy_concurrency = sync_config["per_pharmacy_concurrency"]
+        self.sync_batch_size = sync_config["batch_size"]
+        self.report_use_summaries = sync_config["report_use_summaries"]
+        self.rollup_backfill_hours = sync_config["rollup_backfill_hours"]
     
     async def process_wasfaty_prescription(
         self, 
@@ -46,72 +79,193 @@ class SyncService:
         """
         Process prescription dispensing from Wasfaty and update POS inventory
         
+        Each prescription is dispensed once; duplicate webhooks get the
+        original result back, flagged as duplicate, before any validation
+        call to Wasfaty.
+        
+        The Wasfaty validation call, the prescription detail fetch and the
+        local drug and stock preload run concurrently, so intake costs about
+        one network round trip before the DB write.
+        
         Args:
             prescription_data: Prescription data from Wasfaty webhook
             
         Returns:
             Dict containing processing result
+            
+        Raises:
+            PrescriptionValidationError: If the prescription data is malformed
+            SyncServiceError: If the prescription could not be processed right now
         """
+        external_id = str(prescription_data.get("prescription_id") or "")
+        if not external_id or not prescription_data.get("pharmacy_id"):
+            raise PrescriptionValidationError("Prescription must have prescription_id and pharmacy_id")
+        
         try:
-            with get_db_session() as db:
-                # Validate prescription
-                validation_result = await self._validate_prescription(
-                    prescription_data
-                )
-                
-                if not validation_result["is_valid"]:
-                    return {
-                        "success": False,
-                        "error": "Prescription validation failed",
-                        "details": validation_result["errors"]
-                    }
-                
-                # Create or update prescription record
-                prescription = await self._create_or_update_prescription(
-                    db, prescription_data
-                )
-                
-                # Check inventory availability
-                availability_check = await self._check_inventory_availability(
-                    db, prescription
-                )
-                
-                if not availability_check["available"]:
-                    return {
-                        "success": False,
-                        "error": "Insufficient inventory",
-                        "details": availability_check["missing_items"]
-                    }
-                
-                # Create dispensing transaction
-                transaction = await self._create_dispensing_transaction(
-                    db, prescription, prescription_data
-                )
-                
-                # Update inventory
-                inventory_updates = await self._update_inventory_for_dispensing(
-                    db, prescription, transaction
-                )
-                
-                # Mark prescription as dispensed
-                prescription.status = PrescriptionStatus.DISPENSED
-                prescription.dispensed_date = datetime.utcnow()
-                
-                db.commit()
-                
-                logger.info(f"Successfully processed Wasfaty prescription {prescription.wasfaty_prescription_id}")
-                
+            replay = await ingestion_guard.lookup(PRESCRIPTION_SOURCE, external_id)
+            if replay:
+                return replay
+            
+            # Validate, fetch details and preload stock concurrently
+            validation_result, prescription_details, preload = await asyncio.gather(
+                self._validate_prescription(prescription_data),
+                self._fetch_prescription_details(external_id),
+                run_in_db_session(self._preload_dispense_context, prescription_data)
+            )
+            
+            if not validation_result["is_valid"]:
                 return {
-                    "success": True,
-                    "prescription_id": str(prescription.id),
-                    "transaction_id": str(transaction.id),
-                    "inventory_updates": len(inventory_updates)
+                    "success": False,
+                    "error": "Prescription validation failed",
+                    "details": validation_result["errors"]
                 }
-                
+            
+            if preload["missing_items"]:
+                return {
+                    "success": False,
+                    "error": "Insufficient inventory",
+                    "details": preload["missing_items"]
+                }
+            
+            # Webhook fields win; details only fill in what the webhook left out
+            if prescription_details:
+                prescription_data = {**prescription_details, **prescription_data}
+            
+            result = await run_in_db_session(
+                self._dispense_prescription, prescription_data, external_id
+            )
+            
+            if result.get("success"):
+                await ingestion_guard.remember(PRESCRIPTION_SOURCE, external_id, result)
+            
+            return result
+        
+        except PrescriptionValidationError:
+            raise
+        
+        except (AttributeError, KeyError, TypeError, ValueError, DataError) as e:
+            logger.warning(f"Rejected malformed Wasfaty prescription {external_id}: {e}")
+            raise PrescriptionValidationError(f"Invalid prescription: {e}")
+        
         except Exception as e:
             logger.error(f"Failed to process Wasfaty prescription: {e}")
             raise SyncServiceError(f"Prescription processing failed: {e}")
     
+    async def _fetch_prescription_details(self, prescription_id: str) -> Optional[Dict[str, Any]]:
+        """Fetch full prescription details, or None if unavailable"""
+        if not prescription_id:
+            return None
+        
+        try:
+            return await wasfaty_client.get_prescription_details(prescription_id)
+        except Exception as e:
+            # Details are supplementary; the webhook payload is enough to dispense
+            logger.warning(f"Could not fetch details for prescription {prescription_id}: {e}")
+            return None
+    
+    def _preload_dispense_context(self, db: Session, prescription_data: Dict) -> Dict[str, Any]:
+        """
+        Read-only stock check for the webhook's items, run alongside the
+        Wasfaty calls so an unfillable prescription is rejected without a
+        write transaction. The write path re-checks stock authoritatively.
+        """
+        pharmacy_exists = db.query(Pharmacy.id).filter(
+            Pharmacy.id == prescription_data["pharmacy_id"]
+        ).first()
+        if not pharmacy_exists:
+            raise PrescriptionValidationError(f"Unknown pharmacy {prescription_data['pharmacy_id']}")
+        
+        items_data = prescription_data.get("items") or []
+        drugs = load_drugs_by_wasfaty_id(db, (item.get("wasfaty_drug_id") for item in items_data))
+        inventory_by_drug = load_inventory_by_drug(
+            db, prescription_data.get("pharmacy_id"), (drug.id for drug in drugs.values())
+        )
+        
+        missing_items = []
+        for item_data in items_data:
+            drug = drugs.get(item_data.get("wasfaty_drug_id"))
+            if not drug:
+                # Unknown drugs are skipped when the prescription is recorded
+                continue
+            
+            inventory = inventory_by_drug.get(drug.id)
+            available_quantity = inventory.current_stock if inventory else 0
+            if available_quantity < item_data.get("quantity", 0):
+                missing_items.append({
+                    "drug_name": drug.name,
+                    "required_quantity": item_data.get("quantity", 0),
+                    "available_quantity": available_quantity
+                })
+        
+        return {"missing_items": missing_items}
+    
+    def _dispense_prescription(
+        self, 
+        db: Session, 
+        prescription_data: Dict,
+        external_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Record the prescription, dispensing transaction and stock changes"""
+        
+        if external_id:
+            stored_result = claim_ingestion(
+                db, PRESCRIPTION_SOURCE, external_id, prescription_data.get("pharmacy_id")
+            )
+            if stored_result is not None:
+                logger.info(f"Ignoring duplicate Wasfaty prescription {external_id}")
+                return {**stored_result, "duplicate": True}
+        
+        # Create or update prescription record
+        prescription = self._create_or_update_prescription(
+            db, prescription_data
+        )
+        
+        # Check inventory availability
+        availability_check = self._check_inventory_availability(
+            db, prescription
+        )
+        
+        if not availability_check["available"]:
+            # Let a redelivery try again once stock arrives
+            if external_id:
+                release_ingestion(db, PRESCRIPTION_SOURCE, external_id)
+            
+            return {
+                "success": False,
+                "error": "Insufficient inventory",
+                "details": availability_check["missing_items"]
+            }
+        
+        # Create dispensing transaction
+        transaction = self._create_dispensing_transaction(
+            db, prescription, prescription_data
+        )
+        
+        # Update inventory
+        inventory_updates = self._update_inventory_for_dispensing(
+            db, prescription, transaction
+        )
+        
+        # Mark prescription as dispensed
+        prescription.status = PrescriptionStatus.DISPENSED
+        prescription.dispensed_date = datetime.utcnow()
+        
+        result = {
+            "success": True,
+            "prescription_id": str(prescription.id),
+            "transaction_id": str(transaction.id),
+            "inventory_updates": len(inventory_updates)
+        }
+        
+        if external_id:
+            complete_ingestion(db, PRESCRIPTION_SOURCE, external_id, result)
+        
+        db.commit()
+        
+        logger.info(f"Successfully processed Wasfaty prescription {prescription.wasfaty_prescription_id}")
+        
+        return result
+    
     async def _validate_prescription(
         self, 
         prescription_data: Dict
@@ -151,6 +305,9 @@ class SyncService:
             return validation_result
             
         except WasfatyAPIError as e:
+            if is_transient_error(e):
+                # Wasfaty could not answer; fail the delivery so it is redelivered
+                raise
             validation_result["is_valid"] = False
             validation_result["errors"].append(f"Wasfaty validation failed: {e}")
             return validation_result
@@ -161,7 +318,7 @@ class SyncService:
             validation_result["errors"].append(f"Validation error: {e}")
             return validation_result
     
-    async def _create_or_update_prescription(
+    def _create_or_update_prescription(
         self, 
         db: Session, 
         prescription_data: Dict
@@ -169,7 +326,7 @@ class SyncService:
         """Create or update prescription record"""
         
         # Check if prescription already exists
-        existing_prescription = db.query(Prescription).filter(
+        existing_prescription = prescription_graph_query(db).filter(
             Prescription.wasfaty_prescription_id == prescription_data["prescription_id"]
         ).first()
         
@@ -199,23 +356,21 @@ class SyncService:
             notes=prescription_data.get("notes")
         )
         
-        db.add(prescription)
-        db.flush()  # Get the ID
+        # Find all drugs by Wasfaty ID in one query
+        items_data = prescription_data.get("items", [])
+        drugs = load_drugs_by_wasfaty_id(db, (item_data["wasfaty_drug_id"] for item_data in items_data))
         
-        # Create prescription items
-        for item_data in prescription_data.get("items", []):
-            # Find drug by Wasfaty ID
-            drug = db.query(Drug).filter(
-                Drug.wasfaty_drug_id == item_data["wasfaty_drug_id"]
-            ).first()
+        # Create prescription items; built through the relationship so the
+        # item graph stays in memory for the availability and stock steps
+        for item_data in items_data:
+            drug = drugs.get(item_data["wasfaty_drug_id"])
             
             if not drug:
                 logger.warning(f"Drug not found for Wasfaty ID: {item_data['wasfaty_drug_id']}")
                 continue
             
             prescription_item = PrescriptionItem(
-                prescription_id=prescription.id,
-                drug_id=drug.id,
+                drug=drug,
                 prescribed_quantity=item_data["quantity"],
                 unit_price=item_data.get("unit_price", drug.unit_price),
                 total_price=item_data["quantity"] * item_data.get("unit_price", drug.unit_price or 0),
@@ -223,11 +378,14 @@ class SyncService:
                 is_substitutable=item_data.get("is_substitutable", False)
             )
             
-            db.add(prescription_item)
+            prescription.prescription_items.append(prescription_item)
+        
+        db.add(prescription)
+        db.flush()  # Get the IDs
         
         return prescription
     
-    async def _check_inventory_availability(
+    def _check_inventory_availability(
         self, 
         db: Session, 
         prescription: Prescription
@@ -240,11 +398,12 @@ class SyncService:
             "low_stock_items": []
         }
         
+        inventory_by_drug = load_inventory_by_drug(
+            db, prescription.pharmacy_id, (item.drug_id for item in prescription.prescription_items)
+        )
+        
         for item in prescription.prescription_items:
-            inventory = db.query(InventoryItem).filter(
-                InventoryItem.pharmacy_id == prescription.pharmacy_id,
-                InventoryItem.drug_id == item.drug_id
-            ).first()
+            inventory = inventory_by_drug.get(item.drug_id)
             
             if not inventory:
                 availability_result["available"] = False
@@ -269,7 +428,7 @@ class SyncService:
         
         return availability_result
     
-    async def _create_dispensing_transaction(
+    def _create_dispensing_transaction(
         self, 
         db: Session, 
         prescription: Prescription, 
@@ -278,7 +437,7 @@ class SyncService:
         """Create transaction record for prescription dispensing"""
         
         transaction_number = self._generate_transaction_number(
-            str(prescription.pharmacy_id), "WASFATY"
+            db, str(prescription.pharmacy_id), "WASFATY"
         )
         
         transaction = Transaction(
@@ -316,7 +475,7 @@ class SyncService:
         
         return transaction
     
-    async def _update_inventory_for_dispensing(
+    def _update_inventory_for_dispensing(
         self, 
         db: Session, 
         prescription: Prescription, 
@@ -326,11 +485,12 @@ class SyncService:
         
         inventory_updates = []
         
+        inventory_by_drug = load_inventory_by_drug(
+            db, prescription.pharmacy_id, (item.drug_id for item in prescription.prescription_items)
+        )
+        
         for item in prescription.prescription_items:
-            inventory = db.query(InventoryItem).filter(
-                InventoryItem.pharmacy_id == prescription.pharmacy_id,
-                InventoryItem.drug_id == item.drug_id
-            ).first()
+            inventory = inventory_by_drug.get(item.drug_id)
             
             if inventory:
                 old_stock = inventory.current_stock
@@ -349,10 +509,30 @@ class SyncService:
         
         return inventory_updates
     
-    async def sync_pending_transactions(self) -> Dict[str, Any]:
+    async def sync_pending_transactions(
+        self,
+        concurrency: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        pharmacy_ids: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
         """
         Sync all pending transactions with Wasfaty
         Called periodically to handle failed syncs
+        
+        The backlog is walked with keyset pagination on (created_at, id) so
+        every page is an index range scan, and each transaction is synced in
+        its own task. A global semaphore bounds concurrent Wasfaty round trips
+        and a per-pharmacy semaphore keeps one busy branch from occupying
+        every slot.
+        
+        Args:
+            concurrency: Maximum concurrent syncs (defaults to settings)
+            batch_size: Rows fetched per keyset page (defaults to settings)
+            pharmacy_ids: Only sweep these pharmacies, e.g. the ones whose
+                shards this worker owns (defaults to all pharmacies)
+            
+        Returns:
+            Dict containing processing counts and per-transaction errors
         """
         sync_results = {
             "processed": 0,
@@ -361,117 +541,297 @@ class SyncService:
             "errors": []
         }
         
+        concurrency = concurrency or self.sync_concurrency
+        batch_size = batch_size or self.sync_batch_size
+        global_slots = asyncio.Semaphore(concurrency)
+        pharmacy_slots: Dict[str, asyncio.Semaphore] = {}
+        in_flight = set()
+        
+        def record_outcome(task: asyncio.Task):
+            in_flight.discard(task)
+            if task.cancelled():
+                return
+            transaction_id, error = task.result()
+            sync_results["processed"] += 1
+            if error is None:
+                sync_results["successful"] += 1
+            else:
+                sync_results["failed"] += 1
+                sync_results["errors"].append({
+                    "transaction_id": transaction_id,
+                    "error": error
+                })
+        
+        async def sync_with_limits(transaction_id, pharmacy_id):
+            # Wait for the pharmacy slot first so queued work for a busy
+            # pharmacy never holds a global slot while it waits
+            pharmacy_slot = pharmacy_slots.setdefault(
+                pharmacy_id, asyncio.Semaphore(self.sync_per_pharmacy_concurrency)
+            )
+            async with pharmacy_slot:
+                async with global_slots:
+                    return await self._sync_pending_transaction(transaction_id)
+        
         try:
-            with get_db_session() as db:
-                # Get pending transactions
-                pending_transactions = db.query(Transaction).filter(
-                    and_(
-                        Transaction.sync_status == SyncStatus.PENDING,
-                        Transaction.sync_attempts < self.max_retry_attempts
+            cursor = None
+            while True:
+                page = await run_in_db_session(
+                    self._fetch_pending_page, cursor, batch_size, pharmacy_ids
+                )
+                if not page:
+                    break
+                
+                cursor = (page[-1].created_at, page[-1].id)
+                
+                for row in self._interleave_by_pharmacy(page):
+                    task = asyncio.create_task(
+                        sync_with_limits(row.id, str(row.pharmacy_id))
                     )
-                ).limit(50).all()  # Process in batches
+                    task.add_done_callback(record_outcome)
+                    in_flight.add(task)
                 
-                for transaction in pending_transactions:
-                    sync_results["processed"] += 1
-                    
-                    try:
-                        if transaction.transaction_type == "pos_sale":
-                            await self._retry_pos_sale_sync(transaction)
-                        elif transaction.transaction_type == "wasfaty_dispense":
-                            await self._retry_wasfaty_dispense_sync(transaction)
-                        
-                        sync_results["successful"] += 1
-                        
-                    except Exception as e:
-                        sync_results["failed"] += 1
-                        sync_results["errors"].append({
-                            "transaction_id": str(transaction.id),
-                            "error": str(e)
-                        })
-                        
-                        # Update retry count
-                        transaction.sync_attempts += 1
-                        transaction.error_message = str(e)
-                        
-                        if transaction.sync_attempts >= self.max_retry_attempts:
-                            transaction.sync_status = SyncStatus.FAILED
+                # Keep roughly one page queued ahead of the workers so the
+                # semaphore stays saturated without loading the whole backlog
+                while len(in_flight) > batch_size:
+                    await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
                 
-                db.commit()
+                if len(page) < batch_size:
+                    break
                 
         except Exception as e:
             logger.error(f"Sync pending transactions failed: {e}")
             sync_results["errors"].append({"general_error": str(e)})
         
+        finally:
+            if in_flight:
+                await asyncio.wait(in_flight)
+        
         return sync_results
     
-    async def _retry_pos_sale_sync(self, transaction: Transaction):
-        """Retry POS sale synchronization with Wasfaty"""
+    def _fetch_pending_page(
+        self, 
+        db: Session, 
+        cursor: Optional[tuple], 
+        batch_size: int,
+        pharmacy_ids: Optional[List[str]] = None
+    ) -> List:
+        """Fetch the next keyset page of pending transaction keys"""
         
-        # Prepare transaction data for Wasfaty
-        wasfaty_data = {
-            "pharmacy_id": str(transaction.pharmacy_id),
+        query = db.query(
+            Transaction.id, Transaction.pharmacy_id, Transaction.created_at
+        ).filter(
+            and_(
+                Transaction.sync_status == SyncStatus.PENDING,
+                Transaction.sync_attempts < self.max_retry_attempts
+            )
+        )
+        
+        if pharmacy_ids is not None:
+            query = query.filter(Transaction.pharmacy_id.in_(pharmacy_ids))
+        
+        if cursor:
+            query = query.filter(
+                tuple_(Transaction.created_at, Transaction.id) > cursor
+            )
+        
+        return query.order_by(
+            Transaction.created_at, Transaction.id
+        ).limit(batch_size).all()
+    
+    def _interleave_by_pharmacy(self, rows: List) -> List:
+        """Order a page round-robin across pharmacies"""
+        
+        per_pharmacy: Dict[str, List] = {}
+        for row in rows:
+            per_pharmacy.setdefault(str(row.pharmacy_id), []).append(row)
+        
+        interleaved = []
+        queues = list(per_pharmacy.values())
+        while queues:
+            for queue in queues:
+                interleaved.append(queue.pop(0))
+            queues = [queue for queue in queues if queue]
+        
+        return interleaved
+    
+    async def _sync_pending_transaction(self, transaction_id) -> tuple:
+        """
+        Sync a single pending transaction
+        
+        Returns:
+            Tuple of (transaction_id, error message or None)
+        """
+        try:
+            sync_request = await run_in_db_session(self._load_sync_request, transaction_id)
+            
+            if not sync_request or sync_request["sync_status"] != SyncStatus.PENDING:
+                return str(transaction_id), None
+            
+            try:
+                if sync_request["transaction_type"] == "pos_sale":
+                    await self._retry_pos_sale_sync(sync_request)
+                elif sync_request["transaction_type"] == "wasfaty_dispense":
+                    await self._retry_wasfaty_dispense_sync(sync_request)
+                
+                return str(transaction_id), None
+                
+            except WasfatyCircuitOpenError as e:
+                # Upstream outage: park without spending a retry attempt
+                return str(transaction_id), str(e)
+                
+            except Exception as e:
+                # Update retry count
+                await run_in_db_session(self._record_sync_attempt_failure, transaction_id, str(e))
+                return str(transaction_id), str(e)
+                    
+        except Exception as e:
+            logger.error(f"Failed to sync transaction {transaction_id}: {e}")
+            return str(transaction_id), str(e)
+    
+    def _load_sync_request(self, db: Session, transaction_id) -> Optional[Dict[str, Any]]:
+        """
+        Load everything needed to resend a transaction to Wasfaty
+        
+        Returns:
+            Dict of plain values, or None if the transaction does not exist
+        """
+        transaction = transaction_graph_query(db).filter(
+            Transaction.id == transaction_id
+        ).first()
+        
+        if not transaction:
+            return None
+        
+        sync_request = {
             "transaction_id": str(transaction.id),
-            "transaction_type": "pos_sale",
-            "timestamp": transaction.created_at.isoformat(),
-            "items": []
+            "transaction_type": transaction.transaction_type,
+            "sync_status": transaction.sync_status,
+            "pharmacy_id": str(transaction.pharmacy_id)
         }
         
-        # Add transaction items
-        for item in transaction.transaction_items:
-            if item.drug.wasfaty_drug_id:
-                wasfaty_data["items"].append({
-                    "wasfaty_drug_id": item.drug.wasfaty_drug_id,
-                    "quantity_sold": item.quantity,
-                    "unit_price": float(item.unit_price),
-                    "batch_number": item.batch_number
-                })
+        if transaction.transaction_type == "pos_sale":
+            # Prepare transaction data for Wasfaty
+            wasfaty_data = {
+                "pharmacy_id": str(transaction.pharmacy_id),
+                "transaction_id": str(transaction.id),
+                "transaction_type": "pos_sale",
+                "timestamp": transaction.created_at.isoformat(),
+                "items": []
+            }
+            
+            # Add transaction items
+            for item in transaction.transaction_items:
+                if item.drug.wasfaty_drug_id:
+                    wasfaty_data["items"].append({
+                        "wasfaty_drug_id": item.drug.wasfaty_drug_id,
+                        "quantity_sold": item.quantity,
+                        "unit_price": float(item.unit_price),
+                        "batch_number": item.batch_number
+                    })
+            
+            sync_request["wasfaty_data"] = wasfaty_data
         
-        # Send to Wasfaty
-        async with wasfaty_client as client:
-            response = await client.report_pos_transaction(wasfaty_data)
+        elif transaction.transaction_type == "wasfaty_dispense":
+            # Prepare dispensed items data
+            dispensed_items = []
+            for item in transaction.transaction_items:
+                if item.drug.wasfaty_drug_id:
+                    dispensed_items.append({
+                        "wasfaty_drug_id": item.drug.wasfaty_drug_id,
+                        "quantity_dispensed": item.quantity,
+                        "unit_price": float(item.unit_price),
+                        "batch_number": item.batch_number
+                    })
+            
+            sync_request["wasfaty_prescription_id"] = (
+                transaction.prescription.wasfaty_prescription_id
+                if transaction.prescription else None
+            )
+            sync_request["dispensed_items"] = dispensed_items
+        
+        return sync_request
+    
+    def _record_sync_attempt_failure(self, db: Session, transaction_id, error_message: str):
+        """Count a failed retry, marking the transaction failed once retries run out"""
+        
+        transaction = db.query(Transaction).filter(
+            Transaction.id == transaction_id
+        ).first()
+        
+        if not transaction:
+            return
+        
+        transaction.sync_attempts += 1
+        transaction.error_message = error_message
+        
+        if transaction.sync_attempts >= self.max_retry_attempts:
+            transaction.sync_status = SyncStatus.FAILED
+    
+    def _mark_transaction_synced(
+        self, 
+        db: Session, 
+        transaction_id: str, 
+        wasfaty_transaction_id: Optional[str] = None
+    ):
+        """Mark a transaction as synced with Wasfaty"""
+        
+        transaction = db.query(Transaction).filter(
+            Transaction.id == transaction_id
+        ).first()
+        
+        if not transaction:
+            return
         
-        # Update transaction
         transaction.sync_status = SyncStatus.COMPLETED
         transaction.last_sync_at = datetime.utcnow()
-        transaction.wasfaty_transaction_id = response.get("wasfaty_transaction_id")
+        if wasfaty_transaction_id:
+            transaction.wasfaty_transaction_id = wasfaty_transaction_id
         transaction.error_message = None
     
-    async def _retry_wasfaty_dispense_sync(self, transaction: Transaction):
+    async def _retry_pos_sale_sync(self, sync_request: Dict[str, Any]):
+        """Retry POS sale synchronization with Wasfaty"""
+        
+        # Send to Wasfaty, batched with other concurrent retries
+        response = await wasfaty_batcher.report_pos_transaction(
+            sync_request["wasfaty_data"],
+            idempotency_key=build_idempotency_key("pos_sale_sync", sync_request["transaction_id"])
+        )
+        
+        # Update transaction
+        await run_in_db_session(
+            self._mark_transaction_synced,
+            sync_request["transaction_id"],
+            response.get("wasfaty_transaction_id")
+        )
+    
+    async def _retry_wasfaty_dispense_sync(
+        self, 
+        sync_request: Dict[str, Any],
+        idempotency_key: Optional[str] = None
+    ):
         """Retry Wasfaty dispense synchronization"""
         
-        if not transaction.prescription:
+        if not sync_request["wasfaty_prescription_id"]:
             raise SyncServiceError("No prescription associated with transaction")
         
-        # Prepare dispensed items data
-        dispensed_items = []
-        for item in transaction.transaction_items:
-            if item.drug.wasfaty_drug_id:
-                dispensed_items.append({
-                    "wasfaty_drug_id": item.drug.wasfaty_drug_id,
-                    "quantity_dispensed": item.quantity,
-                    "unit_price": float(item.unit_price),
-                    "batch_number": item.batch_number
-                })
-        
         # Mark as dispensed in Wasfaty
         async with wasfaty_client as client:
             response = await client.mark_prescription_dispensed(
-                transaction.prescription.wasfaty_prescription_id,
-                dispensed_items,
-                str(transaction.pharmacy_id),
-                str(transaction.id)
+                sync_request["wasfaty_prescription_id"],
+                sync_request["dispensed_items"],
+                sync_request["pharmacy_id"],
+                sync_request["transaction_id"],
+                idempotency_key=idempotency_key or build_idempotency_key(
+                    "wasfaty_dispense_sync", sync_request["transaction_id"]
+                )
             )
         
         # Update transaction
-        transaction.sync_status = SyncStatus.COMPLETED
-        transaction.last_sync_at = datetime.utcnow()
-        transaction.error_message = None
+        await run_in_db_session(self._mark_transaction_synced, sync_request["transaction_id"])
     
-    def _generate_transaction_number(self, pharmacy_id: str, prefix: str) -> str:
+    def _generate_transaction_number(self, db: Session, pharmacy_id: str, prefix: str) -> str:
         """Generate unique transaction number"""
-        timestamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
-        pharmacy_code = pharmacy_id[-4:].upper()
-        return f"{prefix}-{pharmacy_code}-{timestamp}"
+        return generate_transaction_number(db, pharmacy_id, prefix)
     
     async def get_sync_status_report(
         self, 
@@ -489,50 +849,186 @@ class SyncService:
             Dict containing sync status report
         """
         try:
-            with get_db_session() as db:
-                # Base query
-                query = db.query(SyncLog)
+            return await run_in_read_session(self._build_sync_status_report, pharmacy_id, hours)
                 
-                # Apply filters
+        except Exception as e:
+            logger.error(f"Failed to generate sync status report: {e}")
+            return {"error": str(e)}
+    
+    def _build_sync_status_report(
+        self, 
+        db: Session, 
+        pharmacy_id: Optional[str], 
+        hours: int
+    ) -> Dict[str, Any]:
+        """Compute sync status statistics with SQL aggregation"""
+        
+        now = datetime.utcnow()
+        since_time = now - timedelta(hours=hours)
+        
+        # (sync_type, status) -> count
+        counts: Dict[tuple, int] = {}
+        raw_since = since_time
+        
+        if self.report_use_summaries:
+            # Whole hours already rolled up are read from the summary table;
+            # the partial first hour and anything after the watermark from raw logs
+            first_full_hour = _truncate_to_hour(since_time)
+            if first_full_hour < since_time:
+                first_full_hour += timedelta(hours=1)
+            
+            # Summaries are only guaranteed back to the backfill horizon;
+            # longer windows read their older hours from raw logs
+            backfill_horizon = _truncate_to_hour(now) - timedelta(hours=self.rollup_backfill_hours)
+            first_full_hour = max(first_full_hour, backfill_horizon)
+            
+            rolled_up_until = self._get_rollup_watermark(db)
+            if rolled_up_until and rolled_up_until > first_full_hour:
+                summary_query = db.query(
+                    SyncLogHourlySummary.sync_type,
+                    SyncLogHourlySummary.status,
+                    func.sum(SyncLogHourlySummary.sync_count)
+                ).filter(
+                    SyncLogHourlySummary.hour >= first_full_hour,
+                    SyncLogHourlySummary.hour < rolled_up_until
+                )
                 if pharmacy_id:
-                    query = query.filter(SyncLog.pharmacy_id == pharmacy_id)
-                
-                # Time filter
-                since_time = datetime.utcnow() - timedelta(hours=hours)
-                query = query.filter(SyncLog.created_at >= since_time)
-                
-                sync_logs = query.all()
-                
-                # Calculate statistics
-                total_syncs = len(sync_logs)
-                successful_syncs = len([log for log in sync_logs if log.status == SyncStatus.COMPLETED])
-                failed_syncs = len([log for log in sync_logs if log.status == SyncStatus.FAILED])
-                pending_syncs = len([log for log in sync_logs if log.status == SyncStatus.PENDING])
-                
-                # Group by sync type
-                sync_types = {}
-                for log in sync_logs:
-                    if log.sync_type not in sync_types:
-                        sync_types[log.sync_type] = {"total": 0, "successful": 0, "failed": 0}
-                    
-                    sync_types[log.sync_type]["total"] += 1
-                    if log.status == SyncStatus.COMPLETED:
-                        sync_types[log.sync_type]["successful"] += 1
-                    elif log.status == SyncStatus.FAILED:
-                        sync_types[log.sync_type]["failed"] += 1
+                    summary_query = summary_query.filter(SyncLogHourlySummary.pharmacy_id == pharmacy_id)
                 
-                return {
-                    "report_period_hours": hours,
-                    "pharmacy_id": pharmacy_id,
-                    "total_syncs": total_syncs,
-                    "successful_syncs": successful_syncs,
-                    "failed_syncs": failed_syncs,
-                    "pending_syncs": pending_syncs,
-                    "success_rate": (successful_syncs / total_syncs * 100) if total_syncs > 0 else 0,
-                    "sync_types": sync_types,
-                    "generated_at": datetime.utcnow().isoformat()
-                }
+                for sync_type, status, count in summary_query.group_by(
+                    SyncLogHourlySummary.sync_type, SyncLogHourlySummary.status
+                ):
+                    counts[(sync_type, status)] = counts.get((sync_type, status), 0) + int(count)
                 
+                # Raw rows: the head before the first full hour, and the tail after the watermark
+                self._count_sync_logs(db, counts, pharmacy_id, since_time, first_full_hour)
+                raw_since = rolled_up_until
+        
+        self._count_sync_logs(db, counts, pharmacy_id, raw_since, None)
+        
+        # Calculate statistics
+        total_syncs = sum(counts.values())
+        successful_syncs = sum(c for (_, status), c in counts.items() if status == SyncStatus.COMPLETED)
+        failed_syncs = sum(c for (_, status), c in counts.items() if status == SyncStatus.FAILED)
+        pending_syncs = sum(c for (_, status), c in counts.items() if status == SyncStatus.PENDING)
+        
+        # Group by sync type
+        sync_types = {}
+        for (sync_type, status), count in counts.items():
+            if sync_type not in sync_types:
+                sync_types[sync_type] = {"total": 0, "successful": 0, "failed": 0}
+            
+            sync_types[sync_type]["total"] += count
+            if status == SyncStatus.COMPLETED:
+                sync_types[sync_type]["successful"] += count
+            elif status == SyncStatus.FAILED:
+                sync_types[sync_type]["failed"] += count
+        
+        return {
+            "report_period_hours": hours,
+            "pharmacy_id": pharmacy_id,
+            "total_syncs": total_syncs,
+            "successful_syncs": successful_syncs,
+            "failed_syncs": failed_syncs,
+            "pending_syncs": pending_syncs,
+            "success_rate": (successful_syncs / total_syncs * 100) if total_syncs > 0 else 0,
+            "sync_types": sync_types,
+            "generated_at": now.isoformat()
+        }
+    
+    def _count_sync_logs(
+        self, 
+        db: Session, 
+        counts: Dict[tuple, int], 
+        pharmacy_id: Optional[str], 
+        start: datetime, 
+        end: Optional[datetime]
+    ):
+        """Add raw sync log counts per (sync_type, status) for [start, end) into counts"""
+        
+        query = db.query(
+            SyncLog.sync_type, SyncLog.status, func.count(SyncLog.id)
+        ).filter(SyncLog.created_at >= start)
+        
+        if end is not None:
+            query = query.filter(SyncLog.created_at < end)
+        if pharmacy_id:
+            query = query.filter(SyncLog.pharmacy_id == pharmacy_id)
+        
+        for sync_type, status, count in query.group_by(SyncLog.sync_type, SyncLog.status):
+            counts[(sync_type, status)] = counts.get((sync_type, status), 0) + count
+    
+    def _get_rollup_watermark(self, db: Session) -> Optional[datetime]:
+        """End of the contiguous range of hours rolled up into the summary table"""
+        last_hour = db.query(func.max(SyncLogHourlySummary.hour)).scalar()
+        return last_hour + timedelta(hours=1) if last_hour else None
+    
+    async def roll_up_sync_logs(self) -> int:
+        """
+        Roll completed hours of sync logs up into hourly summaries
+        
+        Re-aggregates from the last rolled-up hour (or the backfill window on
+        first run) up to the start of the current hour, so late log rows are
+        picked up. Safe to run repeatedly and from several workers: a run
+        holds an advisory lock (others skip while it is held) and upserts
+        one row per hour and group.
+        
+        Returns:
+            Number of summary rows written
+        """
+        try:
+            return await run_in_db_session(self._roll_up_sync_logs)
         except Exception as e:
-            logger.error(f"Failed to generate sync status report: {e}")
-            return {"error": str(e)}
+            logger.error(f"Failed to roll up sync logs: {e}")
+            return 0
+    
+    def _roll_up_sync_logs(self, db: Session) -> int:
+        if not try_advisory_xact_lock(db, SYNC_LOG_ROLLUP_LOCK):
+            logger.debug("Sync log rollup already running elsewhere")
+            return 0
+        
+        end = _truncate_to_hour(datetime.utcnow())
+        
+        watermark = self._get_rollup_watermark(db)
+        start = end - timedelta(hours=self.rollup_backfill_hours)
+        if watermark:
+            start = max(start, min(watermark, end) - timedelta(hours=1))
+        
+        if start >= end:
+            return 0
+        
+        hour = func.date_trunc('hour', SyncLog.created_at)
+        rows = db.query(
+            hour, SyncLog.pharmacy_id, SyncLog.sync_type, SyncLog.status, func.count(SyncLog.id)
+        ).filter(
+            SyncLog.created_at >= start,
+            SyncLog.created_at < end
+        ).group_by(
+            hour, SyncLog.pharmacy_id, SyncLog.sync_type, SyncLog.status
+        ).all()
+        
+        # Sync logs are append-only, so a re-aggregated group only ever grows
+        if rows:
+            statement = insert(SyncLogHourlySummary).values([
+                {
+                    "id": uuid.uuid4(),
+                    "hour": row_hour,
+                    "pharmacy_id": row_pharmacy_id,
+                    "sync_type": sync_type,
+                    "status": status,
+                    "sync_count": count,
+                    "created_at": datetime.utcnow()
+                }
+                for row_hour, row_pharmacy_id, sync_type, status, count in rows
+            ])
+            db.execute(statement.on_conflict_do_update(
+                constraint="unique_sync_summary_group",
+                set_={"sync_count": statement.excluded.sync_count}
+            ))
+        
+        logger.info(f"Rolled up sync logs from {start.isoformat()} to {end.isoformat()} ({len(rows)} rows)")
+        return len(rows)
+
+
+def _truncate_to_hour(value: datetime) -> datetime:
+    return value.replace(minute=0, second=0, microsecond=0)
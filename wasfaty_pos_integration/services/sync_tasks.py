@@ -0,0 +1,214 @@
+"""
+Celery Sync Tasks
+
+This module runs sync work as distributed Celery tasks, so sync capacity
+scales with Celery worker nodes independently of the API nodes. It is used
+when sync_task_backend is "celery": outbox workers still claim due jobs
+from the outbox (which stays the source of truth) but hand them to Celery
+instead of running them in-process. Start worker nodes with:
+
+    celery -A services.sync_tasks worker -Q sync.pos_sales,sync.dispense,sync.inventory
+
+Each job type has its own queue, so nodes can be dedicated to one kind of
+work, and its own rate limit so the nodes stay inside Wasfaty's quotas.
+Celery rate limits apply per worker node, so size them as quota divided
+by node count.
+
+A task first renews the lease its outbox worker took on the job. If the
+job was reclaimed and dispatched again in the meantime (it waited in the
+queue longer than the visibility timeout), the stale copy does nothing.
+Outcomes are recorded in the outbox exactly as the in-process worker does,
+including backoff and dead-lettering, so tasks never retry through Celery.
+
+With celery_always_eager set, tasks run inline in the caller, which is
+meant for local tests; outbox workers then run jobs in-process.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime
+from typing import Dict, List, Optional, Any
+from celery import Celery
+from celery.signals import worker_process_shutdown
+from sqlalchemy.orm import Session
+
+from config import get_celery_config
+from database.database import run_in_db_session, shutdown_db_executor
+from database.models import SyncJob, OutboxStatus
+from services.inventory_sync import InventorySyncService
+from services.sync_audit import sync_log_writer
+from services.wasfaty_batcher import wasfaty_batcher
+from services.wasfaty_client import wasfaty_client
+
+
+logger = logging.getLogger(__name__)
+
+# Queue each kind of sync work is routed to
+SYNC_QUEUES = {
+    "pos_sale_sync": "sync.pos_sales",
+    "wasfaty_dispense_sync": "sync.dispense",
+    "inventory_sync": "sync.inventory"
+}
+
+config = get_celery_config()
+
+celery_app = Celery(
+    "wasfaty_pos_integration",
+    broker=config["broker_url"],
+    backend=config["result_backend"]
+)
+
+celery_app.conf.update(
+    task_serializer="json",
+    result_serializer="json",
+    accept_content=["json"],
+    task_routes={
+        "sync.pos_sale": {"queue": SYNC_QUEUES["pos_sale_sync"]},
+        "sync.wasfaty_dispense": {"queue": SYNC_QUEUES["wasfaty_dispense_sync"]},
+        "sync.inventory": {"queue": SYNC_QUEUES["inventory_sync"]}
+    },
+    # Acknowledge after the task ran, so a crashed node's tasks are redelivered
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    worker_prefetch_multiplier=config["prefetch_multiplier"],
+    task_time_limit=config["task_time_limit_seconds"],
+    result_expires=config["result_expires_seconds"],
+    broker_transport_options={"visibility_timeout": config["visibility_timeout_seconds"]},
+    task_always_eager=config["always_eager"],
+    task_eager_propagates=True,
+    # Tasks share one event loop per process, which needs process-per-task pools
+    worker_pool="prefork"
+)
+
+
+class SyncTaskError(Exception):
+    """Custom exception for Celery sync task errors"""
+    pass
+
+
+# Event Loop
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_executor = None
+
+
+def _run(coro):
+    """
+    Run a coroutine on this process's event loop
+    
+    The loop lives as long as the worker process, so the Wasfaty connection
+    pool and token opened on first use are reused by every later task.
+    """
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+        _loop.run_until_complete(wasfaty_client.start())
+    return _loop.run_until_complete(coro)
+
+
+def _job_executor():
+    """Outbox worker used to run and record jobs in this process"""
+    global _executor
+    if _executor is None:
+        # Imported here; the outbox worker imports this module when dispatching
+        from services.outbox_worker import OutboxWorker
+        _executor = OutboxWorker(worker_id=f"celery-{socket.gethostname()}-{os.getpid()}")
+    return _executor
+
+
+@worker_process_shutdown.connect
+def _close_worker_process(**kwargs):
+    """Flush buffered writes and close shared clients when a worker process exits"""
+    global _loop
+    if _loop is not None and not _loop.is_closed():
+        _loop.run_until_complete(_drain())
+        _loop.close()
+    _loop = None
+    shutdown_db_executor()
+
+
+async def _drain():
+    await wasfaty_batcher.flush()
+    await wasfaty_client.close()
+    await sync_log_writer.flush()
+
+
+# Tasks
+
+@celery_app.task(name="sync.pos_sale", rate_limit=config["rate_limits"]["pos_sale_sync"])
+def sync_pos_sale(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Report a POS sale to Wasfaty for a claimed pos_sale_sync job"""
+    return _run(_run_claimed_job(job))
+
+
+@celery_app.task(name="sync.wasfaty_dispense", rate_limit=config["rate_limits"]["wasfaty_dispense_sync"])
+def sync_wasfaty_dispense(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Mark a prescription dispensed in Wasfaty for a claimed wasfaty_dispense_sync job"""
+    return _run(_run_claimed_job(job))
+
+
+@celery_app.task(name="sync.inventory", rate_limit=config["rate_limits"]["inventory_sync"])
+def sync_inventory(shards: Optional[List[int]] = None) -> Dict[str, Any]:
+    """Push pending inventory changes for pharmacies in the given shards"""
+    return _run(InventorySyncService().sync_pending_inventory(shards=shards))
+
+
+JOB_TASKS = {
+    "pos_sale_sync": sync_pos_sale,
+    "wasfaty_dispense_sync": sync_wasfaty_dispense
+}
+
+
+async def _run_claimed_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Run a dispatched outbox job unless its lease has moved on"""
+    
+    if not await run_in_db_session(_renew_lease, job):
+        logger.warning(f"Skipping outbox job {job['id']}: it was reclaimed after dispatch")
+        return {"job_id": job["id"], "status": "skipped"}
+    
+    # Records success, backoff or dead-letter in the outbox itself
+    await _job_executor()._run_job(job)
+    return {"job_id": job["id"], "status": "processed"}
+
+
+def _renew_lease(db: Session, job: Dict[str, Any]) -> bool:
+    """Restart the visibility timeout if the job still holds the dispatched lease"""
+    
+    renewed = db.query(SyncJob).filter(
+        SyncJob.id == job["id"],
+        SyncJob.status == OutboxStatus.IN_PROGRESS,
+        SyncJob.locked_by == job["locked_by"],
+        SyncJob.locked_at == datetime.fromisoformat(job["locked_at"])
+    ).update({
+        SyncJob.locked_at: datetime.utcnow()
+    }, synchronize_session=False)
+    
+    return renewed == 1
+
+
+# Dispatch
+
+def dispatch_sync_job(job: Dict[str, Any]):
+    """
+    Send a claimed outbox job to its Celery queue
+    
+    Raises:
+        SyncTaskError: If the job type has no task
+    """
+    task = JOB_TASKS.get(job["job_type"])
+    if task is None:
+        raise SyncTaskError(f"No task for job type {job['job_type']}")
+    
+    task.apply_async(args=[{**job, "id": str(job["id"])}])
+
+
+def dispatch_inventory_sync(shards: List[int], expires_seconds: float):
+    """
+    Queue an inventory sync for the given shards
+    
+    The task expires when the next one would be queued, so a backed-up
+    queue never runs overlapping syncs for the same pharmacies.
+    """
+    sync_inventory.apply_async(args=[list(shards)], expires=expires_seconds)
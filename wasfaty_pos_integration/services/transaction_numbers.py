@@ -0,0 +1,62 @@
+"""
+Transaction number generation
+
+Transaction numbers look like POS-1A2B-20240301120000-000000012345: a type
+prefix, the pharmacy code and a timestamp for readability, then a value
+from transaction_number_seq that makes the number unique across every
+process and keeps numbers roughly in creation order.
+
+The sequence increments by TRANSACTION_NUMBER_BLOCK_SIZE, so each nextval()
+reserves a block of values that this process hands out without further
+round trips (hi/lo allocation). Numbers left in a block at shutdown are
+simply skipped.
+"""
+
+import threading
+from datetime import datetime
+from sqlalchemy.orm import Session
+
+from database.models import TRANSACTION_NUMBER_BLOCK_SIZE, transaction_number_seq
+
+
+class TransactionNumberAllocator:
+    """
+    Thread-safe block allocator on top of transaction_number_seq
+    DB work runs on a thread pool, so allocation is guarded by a lock
+    """
+    
+    def __init__(self, block_size: int = TRANSACTION_NUMBER_BLOCK_SIZE):
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._next_value = 0
+        self._block_end = 0
+    
+    def next_value(self, db: Session) -> int:
+        """Return the next unique sequence value, reserving a new block when needed"""
+        with self._lock:
+            if self._next_value >= self._block_end:
+                block_start = db.execute(transaction_number_seq.next_value()).scalar()
+                self._next_value = block_start
+                self._block_end = block_start + self.block_size
+            
+            value = self._next_value
+            self._next_value += 1
+            return value
+    
+    def reset(self):
+        """Forget the current block (e.g. after forking a worker process)"""
+        with self._lock:
+            self._next_value = 0
+            self._block_end = 0
+
+
+def generate_transaction_number(db: Session, pharmacy_id: str, prefix: str) -> str:
+    """Generate a unique, roughly ordered transaction number"""
+    timestamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+    pharmacy_code = str(pharmacy_id)[-4:].upper()  # Last 4 chars of pharmacy ID
+    sequence_value = transaction_number_allocator.next_value(db)
+    return f"{prefix}-{pharmacy_code}-{timestamp}-{sequence_value:012d}"
+
+
+# Singleton instance for global use
+transaction_number_allocator = TransactionNumberAllocator()
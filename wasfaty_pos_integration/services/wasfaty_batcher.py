@@ -0,0 +1,264 @@
+"""
+Wasfaty Request Batching Service
+
+This module coalesces outbound Wasfaty calls made by concurrent tasks:
+- POS transaction reports are gathered and sent as one batch request
+- Inventory deltas are merged per pharmacy and drug before sending
+
+A batch is sent when it reaches the configured size or when the oldest
+queued item has waited for the configured window, whichever comes first.
+Each caller still awaits its own result, mapped back from the batch response.
+"""
+
+import asyncio
+import hashlib
+import logging
+from typing import Dict, List, Optional, Any, Tuple
+
+from config import get_batching_config
+from services.wasfaty_client import wasfaty_client, WasfatyClient, WasfatyAPIError
+
+
+logger = logging.getLogger(__name__)
+
+
+# Inventory update fields that are deltas and add up when merged;
+# every other field keeps the most recent value
+ADDITIVE_INVENTORY_FIELDS = ("quantity_change", "quantity_sold", "quantity_dispensed")
+
+
+class WasfatyBatcher:
+    """
+    Size- and time-triggered batching in front of WasfatyClient
+    Safe to share between all tasks on one event loop
+    """
+    
+    def __init__(self, client: Optional[WasfatyClient] = None):
+        config = get_batching_config()
+        self.client = client or wasfaty_client
+        self.max_batch_size = config["max_batch_size"]
+        self.max_wait_seconds = config["max_wait_ms"] / 1000
+        
+        self._pending_reports: List[Tuple[Dict, Optional[str], asyncio.Future]] = []
+        self._report_timer: Optional[asyncio.TimerHandle] = None
+        
+        self._pending_inventory: Dict[str, Dict[str, Any]] = {}
+        self._inventory_timers: Dict[str, asyncio.TimerHandle] = {}
+        
+        self._in_flight = set()
+    
+    # Transaction Reporting
+    
+    async def report_pos_transaction(
+        self,
+        transaction_data: Dict,
+        idempotency_key: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Queue a POS transaction report and wait for its result
+        
+        Args:
+            transaction_data: Complete transaction information
+            idempotency_key: Optional key letting Wasfaty drop replays
+            
+        Returns:
+            Dict containing this transaction's reporting confirmation
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending_reports.append((transaction_data, idempotency_key, future))
+        
+        if len(self._pending_reports) >= self.max_batch_size:
+            self._flush_reports()
+        elif self._report_timer is None:
+            self._report_timer = loop.call_later(self.max_wait_seconds, self._flush_reports)
+        
+        return await future
+    
+    def _flush_reports(self):
+        """Send everything queued for transaction reporting"""
+        if self._report_timer is not None:
+            self._report_timer.cancel()
+            self._report_timer = None
+        
+        batch, self._pending_reports = self._pending_reports, []
+        if batch:
+            self._track(self._send_reports(batch))
+    
+    async def _send_reports(self, batch: List[Tuple[Dict, Optional[str], asyncio.Future]]):
+        """Send a report batch and resolve each caller's future"""
+        
+        if len(batch) == 1:
+            transaction_data, idempotency_key, future = batch[0]
+            try:
+                response = await self.client.report_pos_transaction(
+                    transaction_data, idempotency_key=idempotency_key
+                )
+                _resolve(future, response)
+            except Exception as e:
+                _reject(future, e)
+            return
+        
+        items = []
+        for transaction_data, idempotency_key, _ in batch:
+            item = dict(transaction_data)
+            if idempotency_key:
+                item["idempotency_key"] = idempotency_key
+            items.append(item)
+        
+        try:
+            response = await self.client.report_pos_transactions_batch(
+                items,
+                idempotency_key=batch_idempotency_key([key for _, key, _ in batch])
+            )
+        except Exception as e:
+            for _, _, future in batch:
+                _reject(future, e)
+            return
+        
+        results = {
+            str(result.get("transaction_id")): result
+            for result in response.get("results", [])
+        }
+        
+        for transaction_data, _, future in batch:
+            transaction_id = str(transaction_data.get("transaction_id"))
+            result = results.get(transaction_id)
+            
+            if result is None:
+                _reject(future, WasfatyAPIError(
+                    f"No batch result for transaction {transaction_id}",
+                    response_data=response
+                ))
+            elif result.get("success") is False:
+                _reject(future, WasfatyAPIError(
+                    f"API request failed: {result.get('error', 'rejected in batch')}",
+                    status_code=result.get("status_code"),
+                    response_data=result
+                ))
+            else:
+                _resolve(future, result)
+    
+    # Inventory Synchronization
+    
+    async def sync_inventory_update(
+        self,
+        pharmacy_id: str,
+        drug_updates: List[Dict]
+    ) -> Dict[str, Any]:
+        """
+        Queue inventory deltas for a pharmacy and wait for the sync result
+        
+        Deltas for the same drug are merged before sending, so several
+        sales of one item within the window become a single update.
+        
+        Args:
+            pharmacy_id: Pharmacy identifier
+            drug_updates: List of drug stock updates
+            
+        Returns:
+            Dict containing the sync confirmation for the merged batch
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        
+        bucket = self._pending_inventory.setdefault(
+            pharmacy_id, {"updates": {}, "futures": []}
+        )
+        for update in drug_updates:
+            merge_inventory_delta(bucket["updates"], update)
+        bucket["futures"].append(future)
+        
+        if len(bucket["updates"]) >= self.max_batch_size:
+            self._flush_inventory(pharmacy_id)
+        elif pharmacy_id not in self._inventory_timers:
+            self._inventory_timers[pharmacy_id] = loop.call_later(
+                self.max_wait_seconds, self._flush_inventory, pharmacy_id
+            )
+        
+        return await future
+    
+    def _flush_inventory(self, pharmacy_id: str):
+        """Send the merged deltas queued for one pharmacy"""
+        timer = self._inventory_timers.pop(pharmacy_id, None)
+        if timer is not None:
+            timer.cancel()
+        
+        bucket = self._pending_inventory.pop(pharmacy_id, None)
+        if bucket:
+            self._track(self._send_inventory(pharmacy_id, bucket))
+    
+    async def _send_inventory(self, pharmacy_id: str, bucket: Dict[str, Any]):
+        """Send merged inventory deltas and resolve every waiting caller"""
+        updates = list(bucket["updates"].values())
+        
+        try:
+            response = await self.client.sync_inventory_update(pharmacy_id, updates)
+        except Exception as e:
+            for future in bucket["futures"]:
+                _reject(future, e)
+            return
+        
+        for future in bucket["futures"]:
+            _resolve(future, response)
+    
+    # Lifecycle
+    
+    async def flush(self):
+        """Send everything queued and wait for in-flight batches (call at shutdown)"""
+        self._flush_reports()
+        for pharmacy_id in list(self._pending_inventory):
+            self._flush_inventory(pharmacy_id)
+        
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+    
+    def _track(self, coroutine):
+        """Run a send coroutine and keep a handle until it finishes"""
+        task = asyncio.ensure_future(coroutine)
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+
+def batch_idempotency_key(idempotency_keys: List[Optional[str]]) -> Optional[str]:
+    """
+    Idempotency key for a report batch, derived from its items' keys
+    
+    The same items always give the same key, so a retried batch is
+    recognised as a replay. A batch with any unkeyed item gets no key and
+    is therefore not retried.
+    """
+    if not idempotency_keys or not all(idempotency_keys):
+        return None
+    digest = hashlib.sha256("\n".join(sorted(idempotency_keys)).encode()).hexdigest()
+    return f"pos_sale_batch:{digest}"
+
+
+def merge_inventory_delta(merged: Dict[str, Dict], update: Dict):
+    """Fold one drug update into the per-drug map of pending updates"""
+    drug_key = str(update.get("wasfaty_drug_id") or update.get("drug_id"))
+    
+    existing = merged.get(drug_key)
+    if existing is None:
+        merged[drug_key] = dict(update)
+        return
+    
+    for field, value in update.items():
+        if field in ADDITIVE_INVENTORY_FIELDS:
+            existing[field] = existing.get(field, 0) + value
+        else:
+            existing[field] = value
+
+
+def _resolve(future: asyncio.Future, result: Any):
+    if not future.done():
+        future.set_result(result)
+
+
+def _reject(future: asyncio.Future, error: Exception):
+    if not future.done():
+        future.set_exception(error)
+
+
+# Singleton instance for global use
+wasfaty_batcher = WasfatyBatcher()
@@ -8,20 +8,30 @@ This module handles all communication with the Wasfaty system including:
 - Secure authentication and encryption
 """
 
+import asyncio
 import httpx
 import json
 import logging
+import os
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
-from cryptography.fernet import Fernet
 from jose import jwt
 
 from config import get_wasfaty_config, get_security_config
 from database.models import Prescription, Drug, InventoryItem, Transaction
+from services.resilience import CircuitBreaker, RetryPolicy
+from services.response_cache import ResponseCache
+from services.field_crypto import FieldCipher
 
 
 logger = logging.getLogger(__name__)
 
+# Methods that are safe to retry without an idempotency key
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+# Responses that indicate a transient upstream problem
+RETRYABLE_STATUS_CODES = {429, 502, 503, 504}
+
 
 class WasfatyAPIError(Exception):
     """Custom exception for Wasfaty API errors"""
@@ -32,12 +42,31 @@ class WasfatyAPIError(Exception):
         super().__init__(self.message)
 
 
+class WasfatyCircuitOpenError(WasfatyAPIError):
+    """Raised without calling the API while its circuit breaker is open"""
+    def __init__(self, message: str, retry_after: float = 0.0):
+        self.retry_after = retry_after
+        super().__init__(message, status_code=503)
+
+
+def is_transient_error(error: WasfatyAPIError) -> bool:
+    """Whether a failed call may succeed later: no answer, a 5xx or rate limiting"""
+    status_code = error.status_code
+    return status_code is None or status_code >= 500 or status_code in RETRYABLE_STATUS_CODES
+
+
 class WasfatyClient:
     """
     Wasfaty API client with secure authentication and encryption
     Handles all interactions with the Saudi Arabia Wasfaty system
+    
+    The underlying httpx connection pool is shared by every task in the
+    process and kept alive between calls. Open it with start() at startup
+    and release it with close() at shutdown; `async with` only borrows it.
     """
     
+    TOKEN_RETRY_SECONDS = 10
+    
     def __init__(self):
         self.config = get_wasfaty_config()
         self.security_config = get_security_config()
@@ -46,30 +75,119 @@ class WasfatyClient:
         self.client_secret = self.config["client_secret"]
         self.api_version = self.config["api_version"]
         
-        # Initialize encryption
-        self.cipher_suite = Fernet(self.security_config["secret_key"].encode()[:32].ljust(32, b'0'))
+        # Initialize encryption (derived keys are cached)
+        self.field_cipher = FieldCipher()
         
-        # HTTP client with timeout and retry configuration
-        self.client = httpx.AsyncClient(
-            timeout=30.0,
-            limits=httpx.Limits(max_keepalive_connections=5, max_connections=10)
-        )
+        # Pooled HTTP client, created lazily once per process
+        self._client: Optional[httpx.AsyncClient] = None
+        self._client_pid: Optional[int] = None
         
         self._access_token = None
         self._token_expires_at = None
+        self._token_renew_at = None
+        self._token_lock = asyncio.Lock()
+        self._token_refresh_margin = timedelta(seconds=self.config["token_refresh_margin_seconds"])
+        self._token_refresh_task: Optional[asyncio.Task] = None
+        self._token_renewal_task: Optional[asyncio.Task] = None
+        self._token_cache = None
+        self._token_cache_key = f"wasfaty:access_token:{self.client_id}"
+        
+        # Resilience: per-endpoint circuit breakers and retry schedule
+        self._circuit_breakers: Dict[str, CircuitBreaker] = {}
+        self.retry_policy = RetryPolicy(
+            max_attempts=self.config["retry_max_attempts"],
+            base_delay_seconds=self.config["retry_base_delay_seconds"],
+            max_delay_seconds=self.config["retry_max_delay_seconds"]
+        )
+        
+        # Lookup cache for prescriptions and drug information
+        self.response_cache = ResponseCache(max_entries=self.config["cache_max_entries"])
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Shared keep-alive HTTP client for this process"""
+        # A forked worker must not reuse sockets inherited from its parent
+        if self._client is None or self._client.is_closed or self._client_pid != os.getpid():
+            self._client = self._build_http_client()
+            self._client_pid = os.getpid()
+        return self._client
+    
+    def _build_http_client(self) -> httpx.AsyncClient:
+        """Create the pooled HTTP client from configuration"""
+        return httpx.AsyncClient(
+            http2=self.config["http2"],
+            timeout=httpx.Timeout(
+                self.config["timeout_seconds"],
+                connect=self.config["connect_timeout_seconds"],
+                read=self.config["read_timeout_seconds"]
+            ),
+            limits=httpx.Limits(
+                max_connections=self.config["max_connections"],
+                max_keepalive_connections=self.config["max_keepalive_connections"],
+                keepalive_expiry=self.config["keepalive_expiry_seconds"]
+            )
+        )
+    
+    async def start(self):
+        """Open the connection pool and start token renewal (call once at startup)"""
+        self.client
+        if self._token_renewal_task is None or self._token_renewal_task.done():
+            self._token_renewal_task = asyncio.create_task(self._token_renewal_loop())
+        logger.info("Wasfaty HTTP client started")
+    
+    async def close(self):
+        """Close the connection pool (call once at process shutdown)"""
+        for task in (self._token_renewal_task, self._token_refresh_task):
+            if task is not None and not task.done():
+                task.cancel()
+        self._token_renewal_task = None
+        self._token_refresh_task = None
+        
+        if self._token_cache is not None:
+            await self._token_cache.close()
+            self._token_cache = None
+        
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+            logger.info("Wasfaty HTTP client closed")
+        self._client = None
+        self._client_pid = None
     
     async def __aenter__(self):
         return self
     
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        await self.client.aclose()
+        # The pool is process-wide; it is closed by close() at shutdown
+        pass
     
     async def _get_access_token(self) -> str:
         """
         Get or refresh access token for Wasfaty API
         Implements OAuth2 client credentials flow
+        
+        Refresh is single-flight: concurrent callers wait on one request to
+        /oauth/token instead of each posting their own. A token inside the
+        renewal margin is still returned while a background task replaces it.
         """
-        if self._access_token and self._token_expires_at > datetime.utcnow():
+        now = datetime.utcnow()
+        if self._access_token and self._token_expires_at > now:
+            if now >= self._token_renew_at:
+                self._schedule_token_refresh()
+            return self._access_token
+        
+        async with self._token_lock:
+            # Another task may have refreshed the token while we waited
+            if self._access_token and self._token_expires_at > datetime.utcnow():
+                return self._access_token
+            
+            return await self._refresh_access_token()
+    
+    async def _refresh_access_token(self) -> str:
+        """Fetch a new access token (caller must hold _token_lock)"""
+        
+        cached_token = await self._read_shared_token()
+        if cached_token:
+            self._access_token, self._token_expires_at, self._token_renew_at = cached_token
             return self._access_token
         
         try:
@@ -87,7 +205,14 @@ class WasfatyClient:
             token_data = response.json()
             self._access_token = token_data["access_token"]
             expires_in = token_data.get("expires_in", 3600)
-            self._token_expires_at = datetime.utcnow() + timedelta(seconds=expires_in - 60)
+            lifetime = timedelta(seconds=expires_in - 60)
+            self._token_expires_at = datetime.utcnow() + lifetime
+            # Short-lived tokens are renewed halfway through, not on every loop
+            self._token_renew_at = self._token_expires_at - min(self._token_refresh_margin, lifetime / 2)
+            
+            await self._write_shared_token(
+                self._access_token, self._token_expires_at, self._token_renew_at
+            )
             
             logger.info("Successfully obtained Wasfaty access token")
             return self._access_token
@@ -96,17 +221,142 @@ class WasfatyClient:
             logger.error(f"Failed to obtain Wasfaty access token: {e}")
             raise WasfatyAPIError(f"Authentication failed: {e}")
     
+    def _token_needs_renewal(self) -> bool:
+        """Check whether the token is missing or inside the renewal margin"""
+        return (
+            not self._access_token
+            or datetime.utcnow() >= self._token_renew_at
+        )
+    
+    def _schedule_token_refresh(self):
+        """Start a background refresh unless one is already running"""
+        if self._token_refresh_task is None or self._token_refresh_task.done():
+            self._token_refresh_task = asyncio.create_task(self._renew_access_token())
+    
+    async def _renew_access_token(self):
+        """Refresh the token ahead of expiry without failing the caller"""
+        try:
+            async with self._token_lock:
+                if self._token_needs_renewal():
+                    await self._refresh_access_token()
+        except WasfatyAPIError as e:
+            logger.warning(f"Proactive token renewal failed: {e}")
+    
+    async def _token_renewal_loop(self):
+        """Keep the token fresh so request paths never wait on auth"""
+        while True:
+            if self._access_token:
+                delay = (self._token_renew_at - datetime.utcnow()).total_seconds()
+            else:
+                delay = 0
+            
+            if delay > 0:
+                await asyncio.sleep(delay)
+            
+            await self._renew_access_token()
+            
+            if self._token_needs_renewal():
+                # Renewal failed; back off before trying again
+                await asyncio.sleep(self.TOKEN_RETRY_SECONDS)
+    
+    async def _read_shared_token(self) -> Optional[tuple]:
+        """Read a token another worker process cached, if sharing is enabled"""
+        cache = self._get_token_cache()
+        if cache is None:
+            return None
+        
+        try:
+            cached = await cache.get(self._token_cache_key)
+            if not cached:
+                return None
+            
+            token_data = json.loads(cached)
+            expires_at = datetime.fromisoformat(token_data["expires_at"])
+            if "renew_at" in token_data:
+                renew_at = datetime.fromisoformat(token_data["renew_at"])
+            else:
+                renew_at = expires_at - self._token_refresh_margin
+            if datetime.utcnow() >= renew_at:
+                return None
+            
+            return token_data["access_token"], expires_at, renew_at
+            
+        except Exception as e:
+            logger.warning(f"Failed to read shared Wasfaty token: {e}")
+            return None
+    
+    async def _write_shared_token(self, access_token: str, expires_at: datetime, renew_at: datetime):
+        """Publish a fresh token to other worker processes"""
+        cache = self._get_token_cache()
+        if cache is None:
+            return
+        
+        ttl = int((expires_at - datetime.utcnow()).total_seconds())
+        if ttl <= 0:
+            return
+        
+        try:
+            await cache.set(
+                self._token_cache_key,
+                json.dumps({
+                    "access_token": access_token,
+                    "expires_at": expires_at.isoformat(),
+                    "renew_at": renew_at.isoformat()
+                }),
+                ex=ttl
+            )
+        except Exception as e:
+            logger.warning(f"Failed to share Wasfaty token: {e}")
+    
+    def _get_token_cache(self):
+        """Redis client for the shared token cache, or None when disabled"""
+        if not self.config["token_cache_url"]:
+            return None
+        
+        if self._token_cache is None:
+            import redis.asyncio as redis
+            self._token_cache = redis.from_url(self.config["token_cache_url"])
+        return self._token_cache
+    
     async def _make_request(
         self, 
         method: str, 
         endpoint: str, 
         data: Dict = None, 
-        params: Dict = None
+        params: Dict = None,
+        idempotency_key: Optional[str] = None,
+        retryable: Optional[bool] = None,
+        response_meta: Optional[Dict] = None
     ) -> Dict:
         """
         Make authenticated request to Wasfaty API with encryption
+        
+        Calls go through a circuit breaker per endpoint group (the first
+        path segment) and fail fast with WasfatyCircuitOpenError while it is
+        open. Idempotent calls (GET, or requests carrying an idempotency
+        key) are retried on connection errors and 429, 502, 503 and 504
+        responses with jittered exponential backoff; every 5xx, and a failed
+        token fetch, counts against the breaker. When response_meta is given, the
+        response's Cache-Control header is stored in it.
         """
-        token = await self._get_access_token()
+        breaker = self._get_circuit_breaker(endpoint.split("/")[0])
+        if not breaker.allow_request():
+            raise WasfatyCircuitOpenError(
+                f"Circuit open for Wasfaty {breaker.name} endpoints",
+                retry_after=breaker.retry_after()
+            )
+        
+        if retryable is None:
+            retryable = method.upper() in IDEMPOTENT_METHODS or idempotency_key is not None
+        max_attempts = self.retry_policy.max_attempts if retryable else 1
+        
+        try:
+            token = await self._get_access_token()
+        except WasfatyAPIError:
+            # An auth outage counts against the breaker and frees a probe slot
+            breaker.record_failure()
+            raise
+        
         headers = {
             "Authorization": f"Bearer {token}",
             "Content-Type": "application/json",
@@ -114,81 +364,119 @@ class WasfatyClient:
             "X-Client-ID": self.client_id
         }
         
+        if idempotency_key:
+            headers["Idempotency-Key"] = idempotency_key
+        
         url = f"{self.base_url}/api/{self.api_version}/{endpoint}"
         
         # Encrypt sensitive data if present
         if data and any(key in data for key in ['patient_id', 'prescription_id']):
-            data = self._encrypt_sensitive_data(data)
+            data = self.field_cipher.encrypt_payload(data)
         
-        try:
-            response = await self.client.request(
-                method=method,
-                url=url,
-                headers=headers,
-                json=data,
-                params=params
-            )
-            
-            response.raise_for_status()
-            response_data = response.json()
-            
-            # Decrypt response if needed
-            if 'encrypted_data' in response_data:
-                response_data = self._decrypt_response_data(response_data)
-            
-            return response_data
-            
-        except httpx.HTTPStatusError as e:
-            error_data = {}
+        attempt = 0
+        while True:
+            attempt += 1
             try:
-                error_data = e.response.json()
-            except:
-                pass
-            
-            logger.error(f"Wasfaty API error {e.response.status_code}: {error_data}")
-            raise WasfatyAPIError(
-                f"API request failed: {error_data.get('message', str(e))}",
-                status_code=e.response.status_code,
-                response_data=error_data
-            )
-        
-        except httpx.RequestError as e:
-            logger.error(f"Wasfaty API request error: {e}")
-            raise WasfatyAPIError(f"Request failed: {e}")
+                response = await self.client.request(
+                    method=method,
+                    url=url,
+                    headers=headers,
+                    json=data,
+                    params=params
+                )
+                
+                response.raise_for_status()
+                response_data = response.json()
+                breaker.record_success()
+                
+                if response_meta is not None:
+                    response_meta["cache_control"] = response.headers.get("Cache-Control")
+                
+                # Decrypt response if needed
+                if 'encrypted_data' in response_data:
+                    response_data = self.field_cipher.decrypt_payload(response_data)
+                
+                return response_data
+                
+            except httpx.HTTPStatusError as e:
+                status_code = e.response.status_code
+                if status_code >= 500 or status_code in RETRYABLE_STATUS_CODES:
+                    breaker.record_failure()
+                    if (
+                        status_code in RETRYABLE_STATUS_CODES
+                        and attempt < max_attempts
+                        and not breaker.is_open()
+                    ):
+                        await asyncio.sleep(self.retry_policy.delay(attempt))
+                        continue
+                else:
+                    # The upstream answered; a 4xx says nothing about its health
+                    breaker.record_success()
+                
+                error_data = {}
+                try:
+                    error_data = e.response.json()
+                except:
+                    pass
+                
+                logger.error(f"Wasfaty API error {status_code}: {error_data}")
+                raise WasfatyAPIError(
+                    f"API request failed: {error_data.get('message', str(e))}",
+                    status_code=status_code,
+                    response_data=error_data
+                )
+            
+            except httpx.RequestError as e:
+                breaker.record_failure()
+                if attempt < max_attempts and not breaker.is_open():
+                    await asyncio.sleep(self.retry_policy.delay(attempt))
+                    continue
+                
+                logger.error(f"Wasfaty API request error: {e}")
+                raise WasfatyAPIError(f"Request failed: {e}")
     
-    def _encrypt_sensitive_data(self, data: Dict) -> Dict:
-        """Encrypt sensitive data before sending to API"""
-        encrypted_data = data.copy()
-        sensitive_fields = ['patient_id', 'prescription_id', 'patient_phone']
+    async def _cached_request(
+        self,
+        cache_key: tuple,
+        method: str,
+        endpoint: str,
+        ttl_seconds: float,
+        stale_seconds: float = 0,
+        data: Dict = None,
+        retryable: Optional[bool] = None
+    ) -> Dict:
+        """Serve a lookup from the response cache, fetching it at most once"""
         
-        for field in sensitive_fields:
-            if field in encrypted_data:
-                encrypted_value = self.cipher_suite.encrypt(
-                    str(encrypted_data[field]).encode()
-                ).decode()
-                encrypted_data[f"encrypted_{field}"] = encrypted_value
-                del encrypted_data[field]
+        async def fetch():
+            response_meta = {}
+            response_data = await self._make_request(
+                method, endpoint, data=data, retryable=retryable, response_meta=response_meta
+            )
+            return response_data, response_meta.get("cache_control")
         
-        return encrypted_data
+        return await self.response_cache.get_or_fetch(
+            cache_key, fetch, ttl_seconds, stale_seconds
+        )
     
-    def _decrypt_response_data(self, response_data: Dict) -> Dict:
-        """Decrypt sensitive data from API response"""
-        decrypted_data = response_data.copy()
-        
-        if 'encrypted_data' in decrypted_data:
-            encrypted_fields = decrypted_data['encrypted_data']
-            for field, encrypted_value in encrypted_fields.items():
-                try:
-                    decrypted_value = self.cipher_suite.decrypt(
-                        encrypted_value.encode()
-                    ).decode()
-                    decrypted_data[field] = decrypted_value
-                except Exception as e:
-                    logger.warning(f"Failed to decrypt field {field}: {e}")
-            
-            del decrypted_data['encrypted_data']
-        
-        return decrypted_data
+    def _get_circuit_breaker(self, name: str) -> CircuitBreaker:
+        """Get the circuit breaker for an endpoint group"""
+        breaker = self._circuit_breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                name,
+                failure_threshold=self.config["circuit_failure_threshold"],
+                recovery_timeout_seconds=self.config["circuit_recovery_seconds"]
+            )
+            self._circuit_breakers[name] = breaker
+        return breaker
+    
+    def is_circuit_open(self, endpoint_group: str) -> bool:
+        """Check whether calls to an endpoint group are being rejected"""
+        return self._get_circuit_breaker(endpoint_group).is_open()
+    
+    def circuit_retry_after(self, endpoint_group: str) -> float:
+        """Seconds until an open circuit lets a probe call through"""
+        return self._get_circuit_breaker(endpoint_group).retry_after()
     
     # Prescription Management Methods
     
@@ -208,14 +496,17 @@ class WasfatyClient:
             Dict containing validation result and prescription details
         """
         try:
-            response = await self._make_request(
+            response = await self._cached_request(
+                ("prescriptions/validate", prescription_id, pharmacy_id),
                 "POST",
                 "prescriptions/validate",
+                ttl_seconds=self.config["validation_cache_ttl_seconds"],
                 data={
                     "prescription_id": prescription_id,
                     "pharmacy_id": pharmacy_id,
                     "validation_timestamp": datetime.utcnow().isoformat()
-                }
+                },
+                retryable=True  # Read-only despite being a POST
             )
             
             logger.info(f"Prescription {prescription_id} validation: {response.get('is_valid')}")
@@ -236,9 +527,11 @@ class WasfatyClient:
             Dict containing complete prescription details
         """
         try:
-            response = await self._make_request(
+            response = await self._cached_request(
+                ("prescriptions", prescription_id),
                 "GET",
-                f"prescriptions/{prescription_id}"
+                f"prescriptions/{prescription_id}",
+                ttl_seconds=self.config["prescription_cache_ttl_seconds"]
             )
             
             logger.info(f"Retrieved prescription details for {prescription_id}")
@@ -253,7 +546,8 @@ class WasfatyClient:
         prescription_id: str, 
         dispensed_items: List[Dict],
         pharmacy_id: str,
-        transaction_id: str
+        transaction_id: str,
+        idempotency_key: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Mark prescription as dispensed in Wasfaty system
@@ -263,6 +557,7 @@ class WasfatyClient:
             dispensed_items: List of dispensed items with quantities
             pharmacy_id: Pharmacy identifier
             transaction_id: Local transaction ID
+            idempotency_key: Optional key letting Wasfaty drop replays
             
         Returns:
             Dict containing dispense confirmation
@@ -276,9 +571,14 @@ class WasfatyClient:
                     "transaction_id": transaction_id,
                     "dispensed_items": dispensed_items,
                     "dispensed_at": datetime.utcnow().isoformat()
-                }
+                },
+                idempotency_key=idempotency_key
             )
             
+            # Cached lookups would still show the prescription as dispensable
+            self.response_cache.invalidate(("prescriptions", prescription_id))
+            self.response_cache.invalidate(("prescriptions/validate", prescription_id, pharmacy_id))
+            
             logger.info(f"Marked prescription {prescription_id} as dispensed")
             return response
             
@@ -322,6 +622,68 @@ class WasfatyClient:
             logger.error(f"Inventory sync failed: {e}")
             raise
     
+    async def get_inventory_checksums(self, pharmacy_id: str, bucket_count: int) -> Dict[str, Any]:
+        """
+        Get Wasfaty's per-bucket checksums of a pharmacy's stock levels
+        
+        Args:
+            pharmacy_id: Pharmacy identifier
+            bucket_count: Number of buckets drugs are hashed into
+            
+        Returns:
+            Dict containing checksums keyed by bucket number
+        """
+        try:
+            return await self._make_request(
+                "GET",
+                f"inventory/{pharmacy_id}/checksums",
+                params={"bucket_count": bucket_count}
+            )
+            
+        except WasfatyAPIError as e:
+            logger.error(f"Failed to get inventory checksums: {e}")
+            raise
+    
+    async def get_inventory_snapshot(
+        self,
+        pharmacy_id: str,
+        bucket_count: int,
+        buckets: List[int],
+        cursor: Optional[str] = None,
+        limit: int = 1000
+    ) -> Dict[str, Any]:
+        """
+        Get one page of Wasfaty's stock levels for some checksum buckets
+        
+        Args:
+            pharmacy_id: Pharmacy identifier
+            bucket_count: Number of buckets drugs are hashed into
+            buckets: Bucket numbers to return
+            cursor: next_cursor of the previous page
+            limit: Maximum items per page
+            
+        Returns:
+            Dict containing items and next_cursor (None on the last page)
+        """
+        params = {
+            "bucket_count": bucket_count,
+            "buckets": ",".join(str(bucket) for bucket in buckets),
+            "limit": limit
+        }
+        if cursor:
+            params["cursor"] = cursor
+        
+        try:
+            return await self._make_request(
+                "GET",
+                f"inventory/{pharmacy_id}/snapshot",
+                params=params
+            )
+            
+        except WasfatyAPIError as e:
+            logger.error(f"Failed to get inventory snapshot: {e}")
+            raise
+    
     async def get_drug_information(self, drug_identifier: str) -> Dict[str, Any]:
         """
         Get drug information from Wasfaty database
@@ -333,9 +695,14 @@ class WasfatyClient:
             Dict containing drug information
         """
         try:
-            response = await self._make_request(
+            # Drug master data changes rarely, so stale entries are served
+            # while they are refreshed in the background
+            response = await self._cached_request(
+                ("drugs/lookup", drug_identifier),
                 "GET",
-                f"drugs/lookup/{drug_identifier}"
+                f"drugs/lookup/{drug_identifier}",
+                ttl_seconds=self.config["drug_cache_ttl_seconds"],
+                stale_seconds=self.config["drug_cache_stale_seconds"]
             )
             
             logger.info(f"Retrieved drug information for {drug_identifier}")
@@ -349,13 +716,15 @@ class WasfatyClient:
     
     async def report_pos_transaction(
         self, 
-        transaction_data: Dict
+        transaction_data: Dict,
+        idempotency_key: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Report POS transaction to Wasfaty for inventory tracking
         
         Args:
             transaction_data: Complete transaction information
+            idempotency_key: Optional key letting Wasfaty drop replays
             
         Returns:
             Dict containing reporting confirmation
@@ -364,7 +733,8 @@ class WasfatyClient:
             response = await self._make_request(
                 "POST",
                 "transactions/report",
-                data=transaction_data
+                data=transaction_data,
+                idempotency_key=idempotency_key
             )
             
             logger.info(f"Reported POS transaction {transaction_data.get('transaction_id')}")
@@ -374,6 +744,39 @@ class WasfatyClient:
             logger.error(f"Transaction reporting failed: {e}")
             raise
     
+    async def report_pos_transactions_batch(
+        self, 
+        transactions: List[Dict],
+        idempotency_key: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Report several POS transactions in one request
+        
+        Args:
+            transactions: Transaction payloads, each with its transaction_id
+            idempotency_key: Optional key for the whole batch; retried only with one
+            
+        Returns:
+            Dict with a "results" list holding one entry per transaction_id
+        """
+        try:
+            # _make_request only encrypts top-level fields, so encrypt each item here
+            transactions = [self.field_cipher.encrypt_payload(transaction) for transaction in transactions]
+            
+            response = await self._make_request(
+                "POST",
+                "transactions/report/batch",
+                data={"transactions": transactions},
+                idempotency_key=idempotency_key
+            )
+            
+            logger.info(f"Reported batch of {len(transactions)} POS transactions")
+            return response
+            
+        except WasfatyAPIError as e:
+            logger.error(f"Batch transaction reporting failed: {e}")
+            raise
+    
     # Health Check and Status Methods
     
     async def health_check(self) -> Dict[str, Any]:
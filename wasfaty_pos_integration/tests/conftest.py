@@ -0,0 +1,137 @@
+"""
+Shared test fixtures
+
+Run from the package directory:
+
+    TEST_DATABASE_URL=postgresql://localhost:5432/wasfaty_test python -m pytest tests
+
+Wasfaty calls go to mock_wasfaty_server in-process. Database tests need a
+disposable PostgreSQL database in TEST_DATABASE_URL (its tables are
+dropped and recreated) and are skipped without one.
+"""
+
+import os
+import sys
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+if TEST_DATABASE_URL:
+    # Settings are read when config is first imported
+    os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+    os.environ["DATABASE_READ_URL"] = TEST_DATABASE_URL
+
+import httpx
+import pytest
+import pytest_asyncio
+from sqlalchemy import text
+
+import mock_wasfaty_server
+from database.database import SessionLocal, create_tables, engine, shutdown_db_executor
+from database.models import Base, Drug, InventoryItem, Pharmacy
+from services.wasfaty_client import WasfatyClient, wasfaty_client
+
+
+MOCK_BASE_URL = "http://wasfaty.test"
+
+
+@pytest.fixture
+def mock_server():
+    """The mock Wasfaty server module, reset before each test"""
+    mock_wasfaty_server.request_counts.clear()
+    mock_wasfaty_server.idempotent_responses.clear()
+    mock_wasfaty_server.inventory_levels.clear()
+    mock_wasfaty_server.mock_config.update(latency_ms=0, failure_rate=0.0, rejected_transaction_ids=[])
+    return mock_wasfaty_server
+
+
+@pytest_asyncio.fixture
+async def mock_wasfaty_client(mock_server):
+    """WasfatyClient whose requests are served by the mock in-process"""
+    client = WasfatyClient()
+    client.base_url = MOCK_BASE_URL
+    client._client = httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=mock_server.app),
+        base_url=MOCK_BASE_URL
+    )
+    client._client_pid = os.getpid()
+    yield client
+    await client.close()
+
+
+@pytest.fixture
+def mock_shared_wasfaty_client(mock_server, monkeypatch):
+    """Point the process-wide wasfaty_client at the mock"""
+    monkeypatch.setattr(wasfaty_client, "base_url", MOCK_BASE_URL)
+    monkeypatch.setattr(
+        wasfaty_client,
+        "_build_http_client",
+        lambda: httpx.AsyncClient(transport=httpx.ASGITransport(app=mock_server.app))
+    )
+    wasfaty_client._client = None
+    yield wasfaty_client
+    wasfaty_client._client = None
+
+
+@pytest.fixture(scope="session")
+def database():
+    """Fresh schema in the test database"""
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    
+    Base.metadata.drop_all(bind=engine)
+    create_tables()
+    yield engine
+    shutdown_db_executor()
+
+
+@pytest.fixture
+def db(database):
+    """Session for arranging and checking data; every table is emptied afterwards"""
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.rollback()
+        session.close()
+        table_names = ", ".join(table.name for table in Base.metadata.sorted_tables)
+        with database.begin() as conn:
+            conn.execute(text(f"TRUNCATE {table_names} CASCADE"))
+
+
+@pytest.fixture
+def make_pharmacy(db):
+    """
+    Factory for a pharmacy stocking drug_count drugs
+    
+    Returns the pharmacy ID and, per drug, a POS sale line selling one unit.
+    """
+    def make(drug_count: int = 1, stock: int = 100):
+        pharmacy = Pharmacy(name="Test Pharmacy", license_number=f"LIC-{os.urandom(4).hex()}")
+        db.add(pharmacy)
+        db.flush()
+        
+        sale_items = []
+        for index in range(drug_count):
+            code = os.urandom(4).hex()
+            drug = Drug(
+                name=f"Drug {index}",
+                barcode=f"BC-{code}",
+                wasfaty_drug_id=f"W-{code}",
+                unit_price=5
+            )
+            db.add(drug)
+            db.flush()
+            db.add(InventoryItem(pharmacy_id=pharmacy.id, drug_id=drug.id, current_stock=stock))
+            sale_items.append({
+                "barcode": drug.barcode,
+                "quantity": 1,
+                "unit_price": 5.0,
+                "total_price": 5.0
+            })
+        
+        db.commit()
+        return str(pharmacy.id), sale_items
+    
+    return make
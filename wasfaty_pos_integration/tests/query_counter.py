@@ -0,0 +1,54 @@
+"""
+SQL statement counting for tests
+
+Use to pin down how many queries a code path issues, so N+1 patterns are
+caught when someone reintroduces a lazy relationship walk:
+
+    with assert_max_queries(4):
+        sync_service._load_sync_request(db, transaction_id)
+"""
+
+from contextlib import contextmanager
+from typing import Generator, List, Optional
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from database.database import engine as default_engine
+
+
+class QueryCounter:
+    """Collects the SQL statements an engine executes while active"""
+    
+    def __init__(self):
+        self.statements: List[str] = []
+    
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+    
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+@contextmanager
+def count_queries(engine: Optional[Engine] = None) -> Generator[QueryCounter, None, None]:
+    """Count statements executed on engine (default: the primary engine)"""
+    engine = engine or default_engine
+    counter = QueryCounter()
+    
+    event.listen(engine, "before_cursor_execute", counter._before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, "before_cursor_execute", counter._before_cursor_execute)
+
+
+@contextmanager
+def assert_max_queries(limit: int, engine: Optional[Engine] = None) -> Generator[QueryCounter, None, None]:
+    """Fail with the offending statements if more than limit queries run"""
+    with count_queries(engine) as counter:
+        yield counter
+    
+    if counter.count > limit:
+        statements = "\n".join(f"  {statement}" for statement in counter.statements)
+        raise AssertionError(f"Expected at most {limit} queries, got {counter.count}:\n{statements}")
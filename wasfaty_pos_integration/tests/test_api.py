@@ -0,0 +1,132 @@
+"""
+Tests for the API's error mapping and streaming limits
+"""
+
+import hashlib
+import hmac
+import json
+
+import httpx
+import pytest
+import pytest_asyncio
+from sqlalchemy.exc import OperationalError
+
+import main
+from services.api_key_auth import create_api_key
+from services.wasfaty_client import WasfatyAPIError, wasfaty_client
+
+
+@pytest_asyncio.fixture
+async def api(db):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://api.test") as client:
+        yield client
+
+
+@pytest.fixture
+def pharmacy(db, make_pharmacy):
+    """A stocked pharmacy, its sale lines and API key headers"""
+    pharmacy_id, sale_items = make_pharmacy()
+    api_key = create_api_key(db, pharmacy_id, "till-1")
+    db.commit()
+    return pharmacy_id, sale_items, {"X-API-Key": api_key}
+
+
+def signed(payload):
+    body = json.dumps(payload).encode()
+    signature = hmac.new(
+        main.api_config["wasfaty_webhook_secret"].encode(), body, hashlib.sha256
+    ).hexdigest()
+    return body, {"X-Wasfaty-Signature": signature, "Content-Type": "application/json"}
+
+
+@pytest.mark.asyncio
+async def test_malformed_sale_is_rejected_as_unprocessable(api, pharmacy):
+    _, _, headers = pharmacy
+    
+    response = await api.post("/api/v1/pos/sales", json={"total_amount": 5.0}, headers=headers)
+    
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_database_outage_asks_the_till_to_retry(api, pharmacy, monkeypatch):
+    _, sale_items, headers = pharmacy
+    
+    def outage(*args, **kwargs):
+        raise OperationalError("INSERT", {}, Exception("connection refused"))
+    
+    monkeypatch.setattr(main.pos_service, "_record_pos_sale", outage)
+    
+    response = await api.post("/api/v1/pos/sales", json={"items": sale_items}, headers=headers)
+    
+    assert response.status_code == 503
+
+
+@pytest.mark.asyncio
+async def test_malformed_prescription_webhook_is_not_redelivered(api, pharmacy):
+    body, headers = signed({"prescription_id": "RX-1"})
+    
+    response = await api.post("/api/v1/webhooks/wasfaty/prescriptions", content=body, headers=headers)
+    
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_prescription_webhook_is_redelivered_when_wasfaty_is_down(api, pharmacy, monkeypatch):
+    pharmacy_id, _, _ = pharmacy
+    
+    async def unreachable(*args, **kwargs):
+        raise WasfatyAPIError("Request failed: connection reset")
+    
+    monkeypatch.setattr(wasfaty_client, "validate_prescription", unreachable)
+    monkeypatch.setattr(wasfaty_client, "get_prescription_details", unreachable)
+    body, headers = signed({"prescription_id": "RX-1", "pharmacy_id": pharmacy_id, "items": []})
+    
+    response = await api.post("/api/v1/webhooks/wasfaty/prescriptions", content=body, headers=headers)
+    
+    assert response.status_code == 503
+
+
+@pytest.mark.asyncio
+async def test_stream_stops_at_the_line_limit(api, pharmacy, monkeypatch):
+    _, sale_items, headers = pharmacy
+    monkeypatch.setitem(main.api_config, "stream_max_lines", 2)
+    lines = [json.dumps({"items": sale_items}), "not json", json.dumps({"items": sale_items}), "{}"]
+    
+    response = await api.post("/api/v1/pos/sales/stream", content="\n".join(lines), headers=headers)
+    
+    results = sorted((json.loads(line) for line in response.text.splitlines()), key=lambda result: result["index"])
+    assert [result["index"] for result in results] == [0, 1, 2]
+    assert results[0]["success"]
+    assert results[1]["retryable"] is False
+    assert results[2]["retryable"] is False
+    assert "limited to 2 lines" in results[2]["error"]
+
+
+@pytest.mark.asyncio
+async def test_pharmacy_sees_its_own_transaction(api, pharmacy):
+    pharmacy_id, sale_items, headers = pharmacy
+    sale = (await api.post("/api/v1/pos/sales", json={"items": sale_items}, headers=headers)).json()
+    
+    status = await api.get(f"/api/v1/transactions/{sale['transaction_id']}/status", headers=headers)
+    retry = await api.post(f"/api/v1/transactions/{sale['transaction_id']}/retry-sync", headers=headers)
+    
+    assert status.status_code == 200
+    assert status.json()["pharmacy_id"] == pharmacy_id
+    # Not failed, so there is nothing to retry
+    assert retry.status_code == 409
+
+
+@pytest.mark.asyncio
+async def test_other_pharmacies_transactions_are_not_found(api, pharmacy, db, make_pharmacy):
+    _, sale_items, headers = pharmacy
+    sale = (await api.post("/api/v1/pos/sales", json={"items": sale_items}, headers=headers)).json()
+    other_pharmacy_id, _ = make_pharmacy()
+    other_headers = {"X-API-Key": create_api_key(db, other_pharmacy_id, "till-2")}
+    db.commit()
+    
+    status = await api.get(f"/api/v1/transactions/{sale['transaction_id']}/status", headers=other_headers)
+    retry = await api.post(f"/api/v1/transactions/{sale['transaction_id']}/retry-sync", headers=other_headers)
+    
+    assert status.status_code == 404
+    assert retry.status_code == 404
@@ -0,0 +1,37 @@
+"""
+Tests for API key authentication
+"""
+
+import pytest
+
+import database.database
+from services.api_key_auth import ApiKeyAuthenticator, ApiKeyAuthError, create_api_key
+
+
+def lagging_replica():
+    raise AssertionError("API keys must not be verified against the read replica")
+
+
+@pytest.mark.asyncio
+async def test_new_key_is_verified_against_the_primary(db, make_pharmacy, monkeypatch):
+    pharmacy_id, _ = make_pharmacy()
+    api_key = create_api_key(db, pharmacy_id, "till-1")
+    db.commit()
+    monkeypatch.setattr(database.database, "ReadSessionLocal", lagging_replica)
+    authenticator = ApiKeyAuthenticator()
+    
+    principal = await authenticator.authenticate(api_key)
+    
+    assert principal["pharmacy_id"] == pharmacy_id
+    await authenticator.flush()
+
+
+@pytest.mark.asyncio
+async def test_wrong_secret_is_rejected(db, make_pharmacy):
+    pharmacy_id, _ = make_pharmacy()
+    api_key = create_api_key(db, pharmacy_id, "till-1")
+    db.commit()
+    authenticator = ApiKeyAuthenticator()
+    
+    with pytest.raises(ApiKeyAuthError):
+        await authenticator.authenticate(api_key[:-1] + ("A" if api_key[-1] != "A" else "B"))
@@ -0,0 +1,33 @@
+"""
+Tests for the expiry sweep
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from database.models import InventoryItem, Prescription, PrescriptionStatus
+from services.expiry_service import ExpiryService
+
+
+@pytest.mark.asyncio
+async def test_sweep_expires_overdue_prescriptions_and_leaves_stock_alone(db, make_pharmacy):
+    pharmacy_id, _ = make_pharmacy(stock=10)
+    now = datetime.utcnow()
+    for index, expiry_date in enumerate((now - timedelta(days=1), now + timedelta(days=1))):
+        db.add(Prescription(
+            wasfaty_prescription_id=f"RX-{index}",
+            pharmacy_id=pharmacy_id,
+            prescription_date=now - timedelta(days=30),
+            expiry_date=expiry_date,
+            status=PrescriptionStatus.ACTIVE
+        ))
+    db.commit()
+    
+    result = await ExpiryService().sweep()
+    
+    db.expire_all()
+    statuses = dict(db.query(Prescription.wasfaty_prescription_id, Prescription.status))
+    assert result["prescriptions_expired"] == 1
+    assert statuses == {"RX-0": PrescriptionStatus.EXPIRED, "RX-1": PrescriptionStatus.ACTIVE}
+    assert [(row.current_stock, row.reserved_stock) for row in db.query(InventoryItem)] == [(10, 0)]
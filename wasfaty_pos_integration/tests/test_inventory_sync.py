@@ -0,0 +1,48 @@
+"""
+Tests for InventorySyncService against the mock Wasfaty server
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from database.models import InventoryItem, SyncStatus
+from services.inventory_sync import InventorySyncService
+
+
+@pytest.mark.asyncio
+async def test_pending_row_is_synced_despite_a_slow_writer_clock(db, make_pharmacy, mock_shared_wasfaty_client, mock_server):
+    pharmacy_id, _ = make_pharmacy(stock=10)
+    inventory_item = db.query(InventoryItem).one()
+    now = datetime.utcnow()
+    # Last synced by a host whose clock runs ahead of the one that wrote the change
+    inventory_item.last_sync_at = now
+    inventory_item.updated_at = now - timedelta(minutes=5)
+    inventory_item.current_stock = 7
+    inventory_item.sync_status = SyncStatus.PENDING
+    db.commit()
+    
+    result = await InventorySyncService().sync_pending_inventory()
+    
+    db.expire_all()
+    assert result["rows_synced"] == 1
+    assert db.query(InventoryItem.sync_status).scalar() == SyncStatus.COMPLETED
+    assert [level["current_stock"] for level in mock_server.inventory_levels[pharmacy_id].values()] == [7]
+
+
+@pytest.mark.asyncio
+async def test_row_changed_while_in_flight_stays_pending(db, make_pharmacy):
+    make_pharmacy()
+    inventory_item = db.query(InventoryItem).one()
+    inventory_item.sync_status = SyncStatus.PENDING
+    db.commit()
+    service = InventorySyncService()
+    
+    chunk = service._load_changed_chunk(db, str(inventory_item.pharmacy_id), None)
+    inventory_item.current_stock -= 1
+    inventory_item.updated_at = datetime.utcnow()
+    db.commit()
+    
+    assert service._mark_synced(db, chunk["versions"]) == 0
+    db.commit()
+    assert db.query(InventoryItem.sync_status).scalar() == SyncStatus.PENDING
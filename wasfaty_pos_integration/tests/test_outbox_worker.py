@@ -0,0 +1,72 @@
+"""
+Tests for OutboxWorker membership and maintenance
+"""
+
+import pytest
+
+from services.outbox_worker import OutboxWorker
+
+
+async def join(worker_ids):
+    """Heartbeat every worker, then let each see the full membership"""
+    workers = [OutboxWorker(worker_id=worker_id) for worker_id in worker_ids]
+    for worker in workers:
+        await worker._maintain_membership()
+    for worker in workers:
+        worker._next_heartbeat_at = 0.0
+        await worker._maintain_membership()
+    return workers
+
+
+@pytest.mark.asyncio
+async def test_exactly_one_worker_leads_maintenance(db):
+    workers = await join([f"worker-{i}" for i in range(5)])
+    
+    assert sum(worker.is_maintenance_leader for worker in workers) == 1
+    assert sorted(shard for worker in workers for shard in worker.owned_shards) == list(range(workers[0].shard_count))
+
+
+@pytest.mark.asyncio
+async def test_only_the_leader_runs_global_maintenance(db, monkeypatch):
+    workers = await join(["worker-a", "worker-b", "worker-c"])
+    swept = []
+    
+    for worker in workers:
+        async def sweep(worker=worker):
+            swept.append(worker.worker_id)
+            return {}
+        
+        async def roll_up():
+            return 0
+        
+        monkeypatch.setattr(worker.expiry_service, "sweep", sweep)
+        monkeypatch.setattr(worker.sync_service, "roll_up_sync_logs", roll_up)
+        worker.owned_shards = []
+        await worker._run_maintenance()
+    
+    assert swept == [worker.worker_id for worker in workers if worker.is_maintenance_leader]
+
+
+@pytest.mark.asyncio
+async def test_maintenance_error_does_not_stop_the_worker(monkeypatch):
+    worker = OutboxWorker(worker_id="worker-a")
+    maintenance_runs = []
+    
+    async def idle(*args):
+        return 0
+    
+    async def maintenance():
+        maintenance_runs.append(len(maintenance_runs))
+        if len(maintenance_runs) == 1:
+            raise RuntimeError("database went away")
+        worker.stop()
+    
+    monkeypatch.setattr(worker, "_maintain_membership", idle)
+    monkeypatch.setattr(worker, "run_once", idle)
+    monkeypatch.setattr(worker, "_wait_for_capacity", idle)
+    monkeypatch.setattr(worker, "_run_maintenance", maintenance)
+    monkeypatch.setattr(worker, "_leave", lambda db: None)
+    
+    await worker.run_forever()
+    
+    assert maintenance_runs == [0, 1]
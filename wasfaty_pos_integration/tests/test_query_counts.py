@@ -0,0 +1,129 @@
+"""
+Query count tests: the sync paths issue the same number of queries
+whether a prescription or sale has one item or many
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from database.models import Prescription, Transaction, SyncStatus
+from services.pos_service import POSService
+from services.query_builders import prescription_graph_query
+from services.sync_service import SyncService
+from services.transaction_numbers import transaction_number_allocator
+
+from query_counter import count_queries
+
+
+ITEM_COUNTS = (1, 8)
+
+
+def create_prescription(db, make_pharmacy, item_count):
+    pharmacy_id, sale_items = make_pharmacy(drug_count=item_count)
+    now = datetime.utcnow()
+    prescription = SyncService()._create_or_update_prescription(db, {
+        "prescription_id": f"RX-{pharmacy_id}",
+        "pharmacy_id": pharmacy_id,
+        "prescription_date": now.isoformat(),
+        "expiry_date": (now + timedelta(days=30)).isoformat(),
+        "items": [
+            {"wasfaty_drug_id": item["barcode"].replace("BC-", "W-"), "quantity": 2, "unit_price": 5.0}
+            for item in sale_items
+        ]
+    })
+    db.commit()
+    
+    # Reload the way the services do, so nothing is already in memory
+    db.expire_all()
+    return prescription_graph_query(db).filter(Prescription.id == prescription.id).one()
+
+
+def create_pos_sale(db, make_pharmacy, item_count, sync_status=SyncStatus.PENDING):
+    pharmacy_id, sale_items = make_pharmacy(drug_count=item_count)
+    result = POSService()._record_pos_sale(db, pharmacy_id, {"items": sale_items})
+    transaction = db.get(Transaction, result["transaction_id"])
+    transaction.sync_status = sync_status
+    db.commit()
+    return str(transaction.id)
+
+
+def queries_per_item_count(measure):
+    """Queries measure(item_count) issues, for each item count"""
+    counts = {}
+    for item_count in ITEM_COUNTS:
+        counts[item_count] = measure(item_count)
+    return counts
+
+
+def assert_constant(counts):
+    assert len(set(counts.values())) == 1, f"Query count grows with items: {counts}"
+
+
+def test_check_inventory_availability(db, make_pharmacy):
+    service = SyncService()
+    
+    def measure(item_count):
+        prescription = create_prescription(db, make_pharmacy, item_count)
+        with count_queries() as counter:
+            result = service._check_inventory_availability(db, prescription)
+        assert result["available"]
+        return counter.count
+    
+    assert_constant(queries_per_item_count(measure))
+
+
+def test_create_dispensing_transaction(db, make_pharmacy):
+    service = SyncService()
+    
+    def measure(item_count):
+        prescription = create_prescription(db, make_pharmacy, item_count)
+        
+        # Reserve a fresh number block so no call pays for nextval()
+        transaction_number_allocator.reset()
+        transaction_number_allocator.next_value(db)
+        
+        with count_queries() as counter:
+            service._create_dispensing_transaction(db, prescription, {"transaction_id": "WT-1"})
+            db.flush()
+        db.rollback()
+        return counter.count
+    
+    assert_constant(queries_per_item_count(measure))
+
+
+@pytest.mark.asyncio
+async def test_retry_pos_sale_sync(db, make_pharmacy, mock_shared_wasfaty_client):
+    service = SyncService()
+    counts = {}
+    
+    for item_count in ITEM_COUNTS:
+        transaction_id = create_pos_sale(db, make_pharmacy, item_count)
+        sync_request = service._load_sync_request(db, transaction_id)
+        db.commit()
+        
+        with count_queries() as counter:
+            await service._retry_pos_sale_sync(sync_request)
+        counts[item_count] = counter.count
+        
+        db.expire_all()
+        assert db.get(Transaction, transaction_id).sync_status == SyncStatus.COMPLETED
+    
+    assert_constant(counts)
+
+
+@pytest.mark.asyncio
+async def test_pos_service_retry_failed_sync(db, make_pharmacy, mock_shared_wasfaty_client):
+    service = POSService()
+    counts = {}
+    
+    for item_count in ITEM_COUNTS:
+        transaction_id = create_pos_sale(db, make_pharmacy, item_count, sync_status=SyncStatus.FAILED)
+        
+        with count_queries() as counter:
+            result = await service.retry_failed_sync(transaction_id)
+        counts[item_count] = counter.count
+        
+        assert result["success"]
+    
+    assert_constant(counts)
@@ -0,0 +1,111 @@
+"""
+Tests for the circuit breaker and retry policy
+"""
+
+import pytest
+
+import services.resilience
+from services.resilience import CircuitBreaker, CircuitState, RetryPolicy
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+    
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(services.resilience.time, "monotonic", clock)
+    return clock
+
+
+def open_breaker(clock, **kwargs) -> CircuitBreaker:
+    breaker = CircuitBreaker("test", failure_threshold=3, recovery_timeout_seconds=30, **kwargs)
+    for _ in range(3):
+        assert breaker.allow_request()
+        breaker.record_failure()
+    return breaker
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3, recovery_timeout_seconds=30)
+    
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.CLOSED
+    
+    breaker.record_failure()
+    assert breaker.is_open()
+    assert not breaker.allow_request()
+    assert breaker.retry_after() == 30
+
+
+def test_breaker_lets_one_probe_through_after_the_recovery_timeout(clock):
+    breaker = open_breaker(clock)
+    
+    clock.now += 29
+    assert not breaker.allow_request()
+    
+    clock.now += 1
+    assert breaker.allow_request()
+    assert breaker.state == CircuitState.HALF_OPEN
+    assert not breaker.allow_request()
+
+
+def test_successful_probe_closes_the_breaker(clock):
+    breaker = open_breaker(clock)
+    clock.now += 30
+    assert breaker.allow_request()
+    
+    breaker.record_success()
+    
+    assert breaker.state == CircuitState.CLOSED
+    assert breaker.allow_request()
+    assert breaker.allow_request()
+
+
+def test_failed_probe_reopens_the_breaker(clock):
+    breaker = open_breaker(clock)
+    clock.now += 30
+    assert breaker.allow_request()
+    
+    breaker.record_failure()
+    
+    assert breaker.is_open()
+    assert breaker.retry_after() == 30
+
+
+def test_probe_that_never_reports_back_frees_its_slot(clock):
+    breaker = open_breaker(clock)
+    clock.now += 30
+    assert breaker.allow_request()
+    
+    clock.now += 29
+    assert not breaker.allow_request()
+    clock.now += 1
+    assert breaker.allow_request()
+
+
+def test_backoff_grows_exponentially_up_to_the_cap(monkeypatch):
+    monkeypatch.setattr(services.resilience.random, "uniform", lambda low, high: (low, high))
+    policy = RetryPolicy(max_attempts=6, base_delay_seconds=0.2, max_delay_seconds=1.0)
+    
+    bounds = [policy.delay(attempt) for attempt in range(1, 6)]
+    
+    assert bounds == [(0, 0.2), (0, 0.4), (0, 0.8), (0, 1.0), (0, 1.0)]
+
+
+def test_backoff_is_jittered_within_bounds():
+    policy = RetryPolicy(base_delay_seconds=0.2, max_delay_seconds=5.0)
+    
+    delays = [policy.delay(3) for _ in range(200)]
+    
+    assert all(0 <= delay <= 0.8 for delay in delays)
+    assert len(set(delays)) > 1
@@ -0,0 +1,150 @@
+"""
+Tests for the TTL/LRU response cache
+"""
+
+import asyncio
+
+import pytest
+
+import services.response_cache
+from services.response_cache import ResponseCache, parse_cache_control
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+    
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(services.response_cache.time, "monotonic", clock)
+    return clock
+
+
+class Upstream:
+    """Fetcher counting its calls, optionally held open until released"""
+    
+    def __init__(self, cache_control=None):
+        self.cache_control = cache_control
+        self.calls = 0
+        self.release = None
+    
+    async def __call__(self):
+        self.calls += 1
+        if self.release is not None:
+            await self.release.wait()
+        return {"version": self.calls}, self.cache_control
+
+
+@pytest.mark.asyncio
+async def test_miss_fetches_and_hit_is_served_from_cache(clock):
+    cache = ResponseCache()
+    upstream = Upstream()
+    
+    first = await cache.get_or_fetch("rx", upstream, ttl_seconds=60)
+    second = await cache.get_or_fetch("rx", upstream, ttl_seconds=60)
+    
+    assert first == second == {"version": 1}
+    assert upstream.calls == 1
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+@pytest.mark.asyncio
+async def test_expired_entry_is_fetched_again(clock):
+    cache = ResponseCache()
+    upstream = Upstream()
+    await cache.get_or_fetch("rx", upstream, ttl_seconds=60)
+    
+    clock.now += 60
+    
+    assert await cache.get_or_fetch("rx", upstream, ttl_seconds=60) == {"version": 2}
+    assert cache.get("rx") == {"version": 2}
+    clock.now += 60
+    assert cache.get("rx") is None
+
+
+@pytest.mark.asyncio
+async def test_stale_entry_is_served_while_one_refresh_runs(clock):
+    cache = ResponseCache()
+    upstream = Upstream()
+    await cache.get_or_fetch("rx", upstream, ttl_seconds=60, stale_seconds=30)
+    clock.now += 70
+    upstream.release = asyncio.Event()
+    
+    stale = await asyncio.gather(*(
+        cache.get_or_fetch("rx", upstream, ttl_seconds=60, stale_seconds=30) for _ in range(5)
+    ))
+    
+    assert stale == [{"version": 1}] * 5
+    assert upstream.calls == 2
+    
+    upstream.release.set()
+    await cache._in_flight["rx"]
+    assert await cache.get_or_fetch("rx", upstream, ttl_seconds=60) == {"version": 2}
+    assert upstream.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_share_one_fetch(clock):
+    cache = ResponseCache()
+    upstream = Upstream()
+    upstream.release = asyncio.Event()
+    
+    pending = asyncio.gather(*(cache.get_or_fetch("rx", upstream, ttl_seconds=60) for _ in range(5)))
+    await asyncio.sleep(0)
+    upstream.release.set()
+    results = await pending
+    
+    assert results == [{"version": 1}] * 5
+    assert upstream.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_least_recently_used_entry_is_evicted(clock):
+    cache = ResponseCache(max_entries=2)
+    upstream = Upstream()
+    await cache.get_or_fetch("a", upstream, ttl_seconds=60)
+    await cache.get_or_fetch("b", upstream, ttl_seconds=60)
+    await cache.get_or_fetch("a", upstream, ttl_seconds=60)
+    
+    await cache.get_or_fetch("c", upstream, ttl_seconds=60)
+    
+    assert cache.get("a") is not None
+    assert cache.get("b") is None
+    assert cache.get("c") is not None
+    assert cache.stats()["entries"] == 2
+
+
+@pytest.mark.asyncio
+async def test_no_store_response_is_not_cached(clock):
+    cache = ResponseCache()
+    upstream = Upstream(cache_control="no-store")
+    
+    await cache.get_or_fetch("rx", upstream, ttl_seconds=60)
+    await cache.get_or_fetch("rx", upstream, ttl_seconds=60)
+    
+    assert upstream.calls == 2
+    assert cache.get("rx") is None
+
+
+@pytest.mark.asyncio
+async def test_max_age_overrides_the_configured_ttl(clock):
+    cache = ResponseCache()
+    upstream = Upstream(cache_control="max-age=5")
+    await cache.get_or_fetch("rx", upstream, ttl_seconds=60)
+    
+    clock.now += 5
+    
+    assert cache.get("rx") is None
+
+
+def test_parse_cache_control():
+    assert parse_cache_control('Max-Age=10, stale-while-revalidate="20", no-store') == {
+        "max-age": 10, "stale-while-revalidate": 20, "no-store": True
+    }
+    assert parse_cache_control(None) == {}
@@ -0,0 +1,125 @@
+"""
+Tests for the hourly sync log rollup and the sync status report
+"""
+
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from database.database import SessionLocal
+from database.models import SyncLog, SyncLogHourlySummary, SyncStatus
+from database.partitions import SYNC_LOG_TABLE, ensure_monthly_partitions
+from services.sync_service import SyncService
+
+
+@pytest.fixture
+def sync_logs(db):
+    """Sync logs spread over the last few hours, including the current one"""
+    now = datetime.utcnow()
+    ensure_monthly_partitions(db, SYNC_LOG_TABLE, 1, since=now - timedelta(hours=6))
+    
+    statuses = [SyncStatus.COMPLETED, SyncStatus.COMPLETED, SyncStatus.FAILED]
+    db.add_all([
+        SyncLog(
+            sync_type="pos_sale_sync",
+            entity_type="transaction",
+            direction="pos_to_wasfaty",
+            status=statuses[i % len(statuses)],
+            created_at=now - timedelta(minutes=25 * i)
+        )
+        for i in range(12)
+    ])
+    db.commit()
+    return now
+
+
+def summary_rows(db):
+    return db.query(
+        SyncLogHourlySummary.hour, SyncLogHourlySummary.sync_type, SyncLogHourlySummary.status
+    ).all()
+
+
+def roll_up(service: SyncService) -> int:
+    session = SessionLocal()
+    try:
+        written = service._roll_up_sync_logs(session)
+        session.commit()
+        return written
+    finally:
+        session.close()
+
+
+def test_rollup_is_idempotent(db, sync_logs):
+    service = SyncService()
+    
+    first = roll_up(service)
+    rows_after_first = sorted(summary_rows(db))
+    roll_up(service)
+    
+    assert first > 0
+    assert sorted(summary_rows(db)) == rows_after_first
+    assert len(rows_after_first) == len(set(rows_after_first))
+
+
+def test_rollup_counts_late_rows_without_duplicating(db, sync_logs):
+    service = SyncService()
+    roll_up(service)
+    
+    last_hour = db.query(SyncLogHourlySummary.hour).order_by(SyncLogHourlySummary.hour.desc()).first()[0]
+    db.add(SyncLog(
+        sync_type="pos_sale_sync",
+        entity_type="transaction",
+        direction="pos_to_wasfaty",
+        status=SyncStatus.COMPLETED,
+        created_at=last_hour + timedelta(minutes=59)
+    ))
+    db.commit()
+    roll_up(service)
+    db.expire_all()
+    
+    late_hour = db.query(SyncLogHourlySummary).filter(
+        SyncLogHourlySummary.hour == last_hour,
+        SyncLogHourlySummary.status == SyncStatus.COMPLETED
+    ).all()
+    raw_count = db.query(SyncLog).filter(
+        SyncLog.created_at >= last_hour,
+        SyncLog.created_at < last_hour + timedelta(hours=1),
+        SyncLog.status == SyncStatus.COMPLETED
+    ).count()
+    
+    assert len(late_hour) == 1
+    assert late_hour[0].sync_count == raw_count
+
+
+def test_concurrent_rollups_write_each_group_once(db, sync_logs):
+    service = SyncService()
+    barrier = threading.Barrier(4)
+    
+    def run():
+        barrier.wait()
+        roll_up(service)
+    
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    rows = summary_rows(db)
+    assert rows
+    assert len(rows) == len(set(rows))
+
+
+def test_report_from_summaries_matches_raw_logs(db, sync_logs):
+    service = SyncService()
+    roll_up(service)
+    
+    service.report_use_summaries = True
+    from_summaries = service._build_sync_status_report(db, None, 6)
+    service.report_use_summaries = False
+    from_raw = service._build_sync_status_report(db, None, 6)
+    
+    for field in ("total_syncs", "successful_syncs", "failed_syncs", "sync_types"):
+        assert from_summaries[field] == from_raw[field]
+    assert from_raw["total_syncs"] == 12
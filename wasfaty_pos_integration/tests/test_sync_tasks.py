@@ -0,0 +1,97 @@
+"""
+Tests for the Celery sync tasks, run eagerly against the mock Wasfaty server
+"""
+
+from types import SimpleNamespace
+
+import pytest
+
+from database.models import InventoryItem, SyncJob, OutboxStatus, Transaction, SyncStatus
+from services import sync_tasks
+from services.outbox_worker import OutboxWorker
+from services.pos_service import POSService
+
+
+@pytest.fixture
+def task_process(mock_shared_wasfaty_client):
+    """Stands in for a Celery worker process; its event loop is torn down afterwards"""
+    yield
+    if sync_tasks._loop is not None:
+        sync_tasks._loop.run_until_complete(sync_tasks._drain())
+        sync_tasks._loop.close()
+        sync_tasks._loop = None
+
+
+def record_sales(db, pharmacy_id, sale_items, count=1):
+    pos_service = POSService()
+    for _ in range(count):
+        pos_service._record_pos_sale(db, pharmacy_id, {"items": sale_items, "total_amount": 5.0})
+    db.commit()
+
+
+def claim_all(db, worker):
+    jobs = worker._claim_due_jobs(db, {shard: 100 for shard in range(worker.shard_count)}, 100)
+    db.commit()
+    return [{**job, "id": str(job["id"])} for job in jobs]
+
+
+def test_pos_sale_task_reports_the_sale(db, make_pharmacy, mock_server, task_process):
+    pharmacy_id, sale_items = make_pharmacy()
+    record_sales(db, pharmacy_id, sale_items)
+    [job] = claim_all(db, OutboxWorker(worker_id="dispatcher"))
+    
+    result = sync_tasks.sync_pos_sale.apply(args=[job]).get()
+    
+    db.expire_all()
+    assert result == {"job_id": job["id"], "status": "processed"}
+    assert db.get(SyncJob, job["id"]).status == OutboxStatus.COMPLETED
+    assert db.query(Transaction.sync_status).scalar() == SyncStatus.COMPLETED
+    assert mock_server.request_counts["transactions/report"] == 1
+
+
+def test_pos_sale_task_skips_a_reclaimed_job(db, make_pharmacy, mock_server, task_process):
+    pharmacy_id, sale_items = make_pharmacy()
+    record_sales(db, pharmacy_id, sale_items)
+    [job] = claim_all(db, OutboxWorker(worker_id="dispatcher"))
+    
+    result = sync_tasks.sync_pos_sale.apply(args=[{**job, "locked_by": "someone-else"}]).get()
+    
+    db.expire_all()
+    assert result["status"] == "skipped"
+    assert db.get(SyncJob, job["id"]).status == OutboxStatus.IN_PROGRESS
+    assert mock_server.request_counts["transactions/report"] == 0
+
+
+def test_inventory_task_pushes_pending_stock(db, make_pharmacy, mock_server, task_process):
+    pharmacy_id, sale_items = make_pharmacy(drug_count=2)
+    record_sales(db, pharmacy_id, sale_items)
+    
+    result = sync_tasks.sync_inventory.apply(args=[None]).get()
+    
+    db.expire_all()
+    assert result["drugs_synced"] == 2
+    assert not result["failed_pharmacies"]
+    assert {row.sync_status for row in db.query(InventoryItem)} == {SyncStatus.COMPLETED}
+    assert [level["current_stock"] for level in mock_server.inventory_levels[pharmacy_id].values()] == [99, 99]
+
+
+@pytest.mark.asyncio
+async def test_dispatched_jobs_count_against_shard_capacity(db, make_pharmacy):
+    pharmacy_id, sale_items = make_pharmacy()
+    worker = OutboxWorker(worker_id="dispatcher")
+    record_sales(db, pharmacy_id, sale_items, count=worker.max_in_flight_per_shard + 3)
+    
+    dispatched = []
+    worker.dispatch_to_celery = True
+    worker.sync_tasks = SimpleNamespace(
+        JOB_TASKS={"pos_sale_sync": None},
+        dispatch_sync_job=dispatched.append
+    )
+    worker.owned_shards = list(range(worker.shard_count))
+    
+    first = await worker.run_once()
+    second = await worker.run_once()
+    
+    assert first == worker.max_in_flight_per_shard
+    assert second == 0
+    assert len(dispatched) == worker.max_in_flight_per_shard
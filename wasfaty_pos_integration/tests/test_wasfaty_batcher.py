@@ -0,0 +1,185 @@
+"""
+Tests for WasfatyBatcher against the mock Wasfaty server
+"""
+
+import asyncio
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from services.wasfaty_batcher import WasfatyBatcher, batch_idempotency_key, merge_inventory_delta
+from services.wasfaty_client import WasfatyAPIError
+
+
+def make_batcher(client, max_batch_size: int = 100, max_wait_seconds: float = 0.05) -> WasfatyBatcher:
+    batcher = WasfatyBatcher(client=client)
+    batcher.max_batch_size = max_batch_size
+    batcher.max_wait_seconds = max_wait_seconds
+    return batcher
+
+
+def transaction(transaction_id: str) -> dict:
+    return {"transaction_id": transaction_id, "total_amount": 10.0}
+
+
+@pytest.mark.asyncio
+async def test_full_batch_is_sent_without_waiting(mock_wasfaty_client, mock_server):
+    batcher = make_batcher(mock_wasfaty_client, max_batch_size=3, max_wait_seconds=60)
+    
+    results = await asyncio.wait_for(
+        asyncio.gather(*(batcher.report_pos_transaction(transaction(f"T{i}")) for i in range(3))),
+        timeout=5
+    )
+    
+    assert len(results) == 3
+    assert mock_server.request_counts["transactions/report/batch"] == 1
+    assert mock_server.request_counts["transactions/report"] == 0
+
+
+@pytest.mark.asyncio
+async def test_partial_batch_is_sent_when_the_window_closes(mock_wasfaty_client, mock_server):
+    batcher = make_batcher(mock_wasfaty_client, max_batch_size=100, max_wait_seconds=0.1)
+    
+    pending = asyncio.gather(*(batcher.report_pos_transaction(transaction(f"T{i}")) for i in range(2)))
+    await asyncio.sleep(0.02)
+    assert mock_server.request_counts["transactions/report/batch"] == 0
+    
+    await asyncio.wait_for(pending, timeout=5)
+    assert mock_server.request_counts["transactions/report/batch"] == 1
+
+
+@pytest.mark.asyncio
+async def test_lone_report_uses_the_single_endpoint(mock_wasfaty_client, mock_server):
+    batcher = make_batcher(mock_wasfaty_client, max_wait_seconds=0.01)
+    
+    result = await batcher.report_pos_transaction(transaction("T1"), idempotency_key="key-1")
+    
+    assert result["transaction_id"] == "T1"
+    assert mock_server.request_counts["transactions/report"] == 1
+    assert mock_server.request_counts["transactions/report/batch"] == 0
+
+
+@pytest.mark.asyncio
+async def test_each_caller_gets_its_own_batch_result(mock_wasfaty_client, mock_server):
+    mock_server.mock_config["rejected_transaction_ids"] = ["T2"]
+    batcher = make_batcher(mock_wasfaty_client, max_batch_size=3)
+    
+    results = await asyncio.gather(
+        *(batcher.report_pos_transaction(transaction(f"T{i}")) for i in range(1, 4)),
+        return_exceptions=True
+    )
+    
+    assert results[0]["transaction_id"] == "T1"
+    assert results[2]["transaction_id"] == "T3"
+    assert results[0]["wasfaty_transaction_id"] != results[2]["wasfaty_transaction_id"]
+    assert isinstance(results[1], WasfatyAPIError)
+    assert results[1].status_code == 422
+    assert mock_server.request_counts["transactions/report/batch"] == 1
+
+
+@pytest.mark.asyncio
+async def test_batched_identifiers_are_encrypted(mock_wasfaty_client, mock_server):
+    sent = []
+    
+    async def capture(request):
+        sent.append(request)
+    
+    mock_wasfaty_client.client.event_hooks["request"].append(capture)
+    batcher = make_batcher(mock_wasfaty_client, max_batch_size=2)
+    
+    await asyncio.gather(*(
+        batcher.report_pos_transaction({**transaction(f"T{i}"), "patient_id": f"PAT-{i}", "prescription_id": f"RX-{i}"})
+        for i in range(2)
+    ))
+    
+    [request] = [request for request in sent if request.url.path.endswith("/transactions/report/batch")]
+    items = json.loads(request.content)["transactions"]
+    for i, item in enumerate(items):
+        assert "patient_id" not in item and "prescription_id" not in item
+        assert mock_wasfaty_client.field_cipher.decrypt_value(item["encrypted_patient_id"]) == f"PAT-{i}"
+        assert mock_wasfaty_client.field_cipher.decrypt_value(item["encrypted_prescription_id"]) == f"RX-{i}"
+
+
+@pytest.mark.asyncio
+async def test_keyed_batch_is_retried_after_a_transient_failure(mock_wasfaty_client, mock_server, monkeypatch):
+    mock_wasfaty_client.retry_policy.base_delay_seconds = 0
+    simulate_upstream = mock_server.simulate_upstream
+    
+    async def fail_first_batch(endpoint):
+        await simulate_upstream(endpoint)
+        if endpoint == "transactions/report/batch" and mock_server.request_counts[endpoint] == 1:
+            raise HTTPException(status_code=503, detail="Injected failure")
+    
+    monkeypatch.setattr(mock_server, "simulate_upstream", fail_first_batch)
+    batcher = make_batcher(mock_wasfaty_client, max_batch_size=2)
+    
+    results = await asyncio.gather(*(
+        batcher.report_pos_transaction(transaction(f"T{i}"), idempotency_key=f"key-{i}") for i in range(2)
+    ))
+    
+    assert [result["transaction_id"] for result in results] == ["T0", "T1"]
+    assert mock_server.request_counts["transactions/report/batch"] == 2
+
+
+def test_batch_key_depends_only_on_its_items_keys():
+    assert batch_idempotency_key(["a", "b"]) == batch_idempotency_key(["b", "a"])
+    assert batch_idempotency_key(["a", "b"]) != batch_idempotency_key(["a", "c"])
+    assert batch_idempotency_key(["a", None]) is None
+
+
+@pytest.mark.asyncio
+async def test_inventory_updates_are_merged_per_drug(mock_wasfaty_client, mock_server):
+    batcher = make_batcher(mock_wasfaty_client)
+    
+    first, second = await asyncio.gather(
+        batcher.sync_inventory_update("P1", [
+            {"drug_id": "D1", "current_stock": 10, "available_stock": 8},
+            {"drug_id": "D2", "current_stock": 4, "available_stock": 4}
+        ]),
+        batcher.sync_inventory_update("P1", [
+            {"drug_id": "D1", "current_stock": 7, "available_stock": 5}
+        ])
+    )
+    
+    assert mock_server.request_counts["inventory/sync"] == 1
+    assert first == second
+    assert first["accepted"] == 2
+    assert mock_server.inventory_levels["P1"]["D1"]["current_stock"] == 7
+    assert mock_server.inventory_levels["P1"]["D2"]["current_stock"] == 4
+
+
+@pytest.mark.asyncio
+async def test_inventory_updates_are_batched_per_pharmacy(mock_wasfaty_client, mock_server):
+    batcher = make_batcher(mock_wasfaty_client)
+    
+    await asyncio.gather(
+        batcher.sync_inventory_update("P1", [{"drug_id": "D1", "current_stock": 1, "available_stock": 1}]),
+        batcher.sync_inventory_update("P2", [{"drug_id": "D1", "current_stock": 2, "available_stock": 2}])
+    )
+    
+    assert mock_server.request_counts["inventory/sync"] == 2
+    assert mock_server.inventory_levels["P2"]["D1"]["current_stock"] == 2
+
+
+@pytest.mark.asyncio
+async def test_flush_sends_queued_inventory_immediately(mock_wasfaty_client, mock_server):
+    batcher = make_batcher(mock_wasfaty_client, max_wait_seconds=60)
+    
+    pending = asyncio.ensure_future(
+        batcher.sync_inventory_update("P1", [{"drug_id": "D1", "current_stock": 3, "available_stock": 3}])
+    )
+    await asyncio.sleep(0)
+    await batcher.flush()
+    
+    assert (await pending)["accepted"] == 1
+
+
+def test_merge_adds_deltas_and_keeps_latest_levels():
+    merged = {}
+    merge_inventory_delta(merged, {"drug_id": "D1", "quantity_sold": 2, "current_stock": 8})
+    merge_inventory_delta(merged, {"drug_id": "D1", "quantity_sold": 3, "current_stock": 5})
+    merge_inventory_delta(merged, {"wasfaty_drug_id": "W9", "drug_id": "D9", "quantity_sold": 1})
+    
+    assert merged["D1"] == {"drug_id": "D1", "quantity_sold": 5, "current_stock": 5}
+    assert merged["W9"]["quantity_sold"] == 1
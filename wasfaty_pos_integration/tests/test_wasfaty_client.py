@@ -0,0 +1,178 @@
+"""
+Tests for WasfatyClient's retry gating, circuit breaker accounting and
+access token renewal
+"""
+
+import asyncio
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+import pytest_asyncio
+
+from services.resilience import CircuitState
+from services.wasfaty_client import WasfatyAPIError, WasfatyCircuitOpenError, WasfatyClient
+
+
+class Upstream:
+    """httpx transport answering every call with a fixed status"""
+    
+    def __init__(self):
+        self.status_code = 200
+        self.token_status_code = 200
+        self.token_expires_in = 3600
+        self.latency_seconds = 0
+        self.calls = Counter()
+    
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        self.calls[path] += 1
+        await asyncio.sleep(self.latency_seconds)
+        if path == "/oauth/token":
+            if self.token_status_code != 200:
+                return httpx.Response(self.token_status_code, json={})
+            return httpx.Response(200, json={
+                "access_token": f"token-{self.calls[path]}",
+                "expires_in": self.token_expires_in
+            })
+        return httpx.Response(self.status_code, json={"message": "upstream says so"})
+    
+    def api_calls(self) -> int:
+        return sum(count for path, count in self.calls.items() if path != "/oauth/token")
+
+
+@pytest.fixture
+def upstream():
+    return Upstream()
+
+
+@pytest_asyncio.fixture
+async def client(upstream):
+    client = WasfatyClient()
+    client.base_url = "http://wasfaty.test"
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(upstream))
+    client._client_pid = os.getpid()
+    client.retry_policy.base_delay_seconds = 0
+    yield client
+    await client.close()
+
+
+def authenticate(client):
+    client._access_token = "token"
+    client._token_expires_at = datetime.utcnow() + timedelta(hours=1)
+    client._token_renew_at = client._token_expires_at - client._token_refresh_margin
+
+
+@pytest.mark.asyncio
+async def test_post_without_idempotency_key_is_not_retried(client, upstream):
+    authenticate(client)
+    upstream.status_code = 503
+    
+    with pytest.raises(WasfatyAPIError):
+        await client._make_request("POST", "transactions/report", data={})
+    
+    assert upstream.api_calls() == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("method,idempotency_key", [("GET", None), ("POST", "key-1")])
+async def test_idempotent_calls_are_retried(client, upstream, method, idempotency_key):
+    authenticate(client)
+    upstream.status_code = 503
+    
+    with pytest.raises(WasfatyAPIError):
+        await client._make_request(method, "transactions/report", idempotency_key=idempotency_key)
+    
+    assert upstream.api_calls() == client.retry_policy.max_attempts
+
+
+@pytest.mark.asyncio
+async def test_server_errors_trip_the_breaker_without_being_retried(client, upstream):
+    authenticate(client)
+    upstream.status_code = 500
+    threshold = client.config["circuit_failure_threshold"]
+    
+    for _ in range(threshold):
+        with pytest.raises(WasfatyAPIError):
+            await client._make_request("GET", "prescriptions/RX-1")
+    
+    assert upstream.api_calls() == threshold
+    with pytest.raises(WasfatyCircuitOpenError):
+        await client._make_request("GET", "prescriptions/RX-1")
+    assert upstream.api_calls() == threshold
+
+
+@pytest.mark.asyncio
+async def test_client_errors_do_not_count_against_the_breaker(client, upstream):
+    authenticate(client)
+    upstream.status_code = 404
+    
+    for _ in range(client.config["circuit_failure_threshold"] + 1):
+        with pytest.raises(WasfatyAPIError):
+            await client._make_request("GET", "prescriptions/RX-1")
+    
+    assert not client.is_circuit_open("prescriptions")
+
+
+@pytest.mark.asyncio
+async def test_auth_outage_counts_against_the_breaker(client, upstream):
+    upstream.token_status_code = 503
+    breaker = client._get_circuit_breaker("prescriptions")
+    
+    for _ in range(client.config["circuit_failure_threshold"]):
+        with pytest.raises(WasfatyAPIError):
+            await client._make_request("GET", "prescriptions/RX-1")
+    
+    assert breaker.is_open()
+    assert upstream.api_calls() == 0
+
+
+@pytest.mark.asyncio
+async def test_auth_failure_during_a_probe_reopens_the_breaker(client, upstream):
+    breaker = client._get_circuit_breaker("prescriptions")
+    breaker.state = CircuitState.HALF_OPEN
+    upstream.token_status_code = 503
+    
+    with pytest.raises(WasfatyAPIError):
+        await client._make_request("GET", "prescriptions/RX-1")
+    
+    assert breaker.is_open()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_callers_share_one_token_fetch(client, upstream):
+    upstream.latency_seconds = 0.05
+    
+    tokens = await asyncio.gather(*(client._get_access_token() for _ in range(10)))
+    
+    assert set(tokens) == {"token-1"}
+    assert upstream.calls["/oauth/token"] == 1
+
+
+@pytest.mark.asyncio
+async def test_token_inside_the_margin_is_renewed_once_in_the_background(client, upstream):
+    upstream.latency_seconds = 0.05
+    client._access_token = "old-token"
+    client._token_expires_at = datetime.utcnow() + timedelta(seconds=60)
+    client._token_renew_at = datetime.utcnow() - timedelta(seconds=1)
+    
+    tokens = await asyncio.gather(*(client._get_access_token() for _ in range(10)))
+    await client._token_refresh_task
+    
+    assert set(tokens) == {"old-token"}
+    assert upstream.calls["/oauth/token"] == 1
+    assert await client._get_access_token() == "token-1"
+
+
+@pytest.mark.asyncio
+async def test_short_lived_token_is_renewed_halfway_through(client, upstream):
+    upstream.token_expires_in = 300
+    
+    await client._get_access_token()
+    
+    lifetime = client._token_expires_at - datetime.utcnow()
+    renew_in = client._token_renew_at - datetime.utcnow()
+    assert not client._token_needs_renewal()
+    assert abs(renew_in.total_seconds() - lifetime.total_seconds() / 2) < 1